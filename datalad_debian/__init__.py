@@ -27,6 +27,12 @@ command_suite = (
             'deb-build-package',
             'deb_build_package',
         ),
+        (
+            'datalad_debian.build_packages',
+            'BuildPackages',
+            'deb-build-packages',
+            'deb_build_packages',
+        ),
         (
             'datalad_debian.configure_builder',
             'ConfigureBuilder',
@@ -57,6 +63,36 @@ command_suite = (
             'deb-add-distribution',
             'deb_add_distribution',
         ),
+        (
+            'datalad_debian.publish_archive',
+            'PublishArchive',
+            'deb-publish-archive',
+            'deb_publish_archive',
+        ),
+        (
+            'datalad_debian.verify_archive',
+            'VerifyArchive',
+            'deb-verify-archive',
+            'deb_verify_archive',
+        ),
+        (
+            'datalad_debian.archive_query',
+            'ArchiveQuery',
+            'deb-archive-query',
+            'deb_archive_query',
+        ),
+        (
+            'datalad_debian.archive_lag',
+            'ArchiveLag',
+            'deb-archive-lag',
+            'deb_archive_lag',
+        ),
+        (
+            'datalad_debian.archive_snapshot',
+            'ArchiveSnapshot',
+            'deb-archive-snapshot',
+            'deb_archive_snapshot',
+        ),
     ]
 )
 
@@ -0,0 +1,281 @@
+import hashlib
+import logging
+import os
+import shutil
+import tempfile
+import urllib.error
+import urllib.request
+from contextlib import contextmanager
+from http.server import (
+    BaseHTTPRequestHandler,
+    ThreadingHTTPServer,
+)
+from pathlib import Path
+from threading import (
+    Lock,
+    Thread,
+)
+from urllib.parse import urlparse
+
+lgr = logging.getLogger('datalad.debian.apt_proxy')
+
+# files that never change once published in an APT archive. Anything
+# else (e.g. package indices) is passed through without caching
+cacheable_suffixes = (
+    '.deb', '.udeb', '.ddeb', '.dsc', '.gz', '.xz', '.bz2', '.lzma', '.zst')
+# request and response headers that only concern a single connection
+hop_headers = {
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'proxy-connection', 'te', 'trailers', 'transfer-encoding', 'upgrade'}
+# environment variables that make (apt in) builder containers use a proxy
+proxy_env_vars = ('SINGULARITYENV_http_proxy', 'APPTAINERENV_http_proxy')
+
+
+class AptProxy:
+    """Caching HTTP proxy for APT, on localhost
+
+    Package files requested from pool/ directories are kept in a store
+    directory on the host, which is bounded in size: the least recently
+    used files are removed, when it grows beyond `max_size`. HTTPS is not
+    proxied, APT only uses a proxy for HTTPS with a separate setting.
+
+    Parameters
+    ----------
+    store: Path
+      Directory to keep package files in. It can be shared by proxies
+      that do not run at the same time.
+    max_size: int
+      Size limit of the store, in bytes.
+    """
+    def __init__(self, store, max_size):
+        self.store = Path(store)
+        self.max_size = max_size
+        self.stats = dict(
+            hits=0, misses=0, passed=0, hit_bytes=0, miss_bytes=0,
+            evicted=0)
+        self._lock = Lock()
+        self._server = None
+        self._thread = None
+        self.store.mkdir(parents=True, exist_ok=True)
+        # file name -> (size, last use), the LRU order of the store
+        self._entries = {
+            p.name: (st.st_size, st.st_mtime)
+            for p, st in ((p, p.stat()) for p in self.store.iterdir()
+                          if p.is_file() and not p.name.startswith('.'))
+        }
+        # no proxy must be used for upstream requests
+        self._opener = urllib.request.build_opener(
+            urllib.request.ProxyHandler({}))
+
+    @property
+    def url(self):
+        host, port = self._server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        proxy = self
+
+        class Handler(_ProxyRequestHandler):
+            pass
+        Handler.proxy = proxy
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = Thread(
+            target=self._server.serve_forever, name='apt-proxy', daemon=True)
+        self._thread.start()
+        lgr.debug('APT proxy listening at %s, caching in %s',
+                  self.url, self.store)
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        lgr.debug('APT proxy stopped: %s', self.stats)
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats)
+
+    def _count(self, **kwargs):
+        with self._lock:
+            for k, v in kwargs.items():
+                self.stats[k] += v
+
+    def _lookup(self, name):
+        """Report the path of a stored file, and mark it as used"""
+        with self._lock:
+            if name not in self._entries:
+                return None
+            path = self.store / name
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                del self._entries[name]
+                return None
+            self._entries[name] = (self._entries[name][0], path.stat().st_mtime)
+            return path
+
+    def _add(self, name, tmp_path):
+        with self._lock:
+            path = self.store / name
+            os.replace(tmp_path, path)
+            st = path.stat()
+            self._entries[name] = (st.st_size, st.st_mtime)
+            total = sum(size for size, _ in self._entries.values())
+            for victim, (size, _) in sorted(
+                    self._entries.items(), key=lambda e: e[1][1]):
+                if total <= self.max_size:
+                    break
+                if victim == name:
+                    continue
+                try:
+                    (self.store / victim).unlink()
+                except FileNotFoundError:
+                    pass
+                del self._entries[victim]
+                total -= size
+                self.stats['evicted'] += 1
+
+
+class _ProxyRequestHandler(BaseHTTPRequestHandler):
+    proxy = None
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.scheme != 'http':
+            self.send_error(400, 'Only http:// URLs can be proxied')
+            return
+        if '/pool/' in url.path and url.path.endswith(cacheable_suffixes):
+            self._serve_cached()
+        else:
+            self._serve_upstream()
+
+    def log_message(self, format, *args):
+        lgr.debug('APT proxy: ' + format, *args)
+
+    def _serve_cached(self):
+        name = hashlib.sha256(self.path.encode()).hexdigest()
+        path = self.proxy._lookup(name)
+        if path is not None:
+            with path.open('rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                self.send_response(200)
+                self.send_header('Content-Length', str(size))
+                self.send_header('Content-Type', 'application/octet-stream')
+                self.end_headers()
+                shutil.copyfileobj(f, self.wfile)
+            self.proxy._count(hits=1, hit_bytes=size)
+            return
+        response = self._open_upstream(forward_headers=False)
+        if response is None:
+            return
+        with response, tempfile.NamedTemporaryFile(
+                dir=self.proxy.store, prefix='.', delete=False) as tmp:
+            self._send_upstream_headers(response)
+            size = 0
+            try:
+                while True:
+                    chunk = response.read(1 << 16)
+                    if not chunk:
+                        break
+                    tmp.write(chunk)
+                    self.wfile.write(chunk)
+                    size += len(chunk)
+            except Exception:
+                Path(tmp.name).unlink()
+                raise
+        if response.getcode() == 200:
+            self.proxy._add(name, tmp.name)
+        else:
+            Path(tmp.name).unlink()
+        self.proxy._count(misses=1, miss_bytes=size)
+
+    def _serve_upstream(self):
+        response = self._open_upstream(forward_headers=True)
+        if response is None:
+            return
+        with response:
+            self._send_upstream_headers(response)
+            shutil.copyfileobj(response, self.wfile)
+        self.proxy._count(passed=1)
+
+    def _open_upstream(self, forward_headers):
+        request = urllib.request.Request(self.path, headers={
+            k: v for k, v in self.headers.items()
+            if forward_headers and k.lower() not in hop_headers
+            and k.lower() != 'host'
+        })
+        try:
+            return self.proxy._opener.open(request)
+        except urllib.error.HTTPError as e:
+            # e.g. 304 Not Modified, or 404
+            with e:
+                self._send_upstream_headers(e)
+                shutil.copyfileobj(e, self.wfile)
+            return None
+        except OSError as e:
+            self.send_error(502, f'Cannot reach upstream: {e}')
+            return None
+
+    def _send_upstream_headers(self, response):
+        # HTTPError has no `status` before Python 3.9
+        self.send_response(response.getcode())
+        for k, v in response.headers.items():
+            if k.lower() not in hop_headers:
+                self.send_header(k, v)
+        if 'Content-Length' not in response.headers:
+            # the end of the content can only be signaled by closing
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        self.end_headers()
+
+
+# proxies running in this process, by store, with their number of users
+_running = {}
+_running_lock = Lock()
+
+
+@contextmanager
+def running_apt_proxy(store, max_size):
+    """Run an APT proxy, and point builder containers to it
+
+    Concurrent users of the same store share a single proxy, which runs
+    until the last of them is done. Builder containers are pointed to the
+    proxy via the environment of this process, hence only one proxy can run
+    at a time.
+
+    Yields
+    ------
+    AptProxy
+
+    Raises
+    ------
+    RuntimeError
+      If a proxy with a different store is running already.
+    """
+    store = Path(store).resolve()
+    with _running_lock:
+        if store in _running:
+            proxy, users = _running[store]
+        elif _running:
+            raise RuntimeError(
+                f'Cannot run an APT proxy for {store}, '
+                f'one for {next(iter(_running))} is running already')
+        else:
+            proxy, users = AptProxy(store, max_size), 0
+            proxy.start()
+            for var in proxy_env_vars:
+                os.environ[var] = proxy.url
+        _running[store] = (proxy, users + 1)
+    try:
+        yield proxy
+    finally:
+        with _running_lock:
+            proxy, users = _running.pop(store)
+            if users > 1:
+                _running[store] = (proxy, users - 1)
+            else:
+                for var in proxy_env_vars:
+                    os.environ.pop(var, None)
+                proxy.stop()
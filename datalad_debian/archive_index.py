@@ -0,0 +1,403 @@
+import bz2
+import gzip
+import lzma
+import os
+import sqlite3
+from contextlib import closing
+from pathlib import (
+    Path,
+    PurePosixPath,
+)
+
+from debian.deb822 import (
+    Packages,
+    Sources,
+)
+
+# basenames of the package index files
+index_names = ('Packages', 'Sources')
+# in order of preference, cheapest to read first
+index_compressions = {
+    '': open,
+    '.xz': lzma.open,
+    '.gz': gzip.open,
+    '.bz2': bz2.open,
+}
+# checksum field names in index stanzas, mapped to hashlib algorithm names
+packages_checksum_fields = {
+    'MD5sum': 'md5',
+    'SHA1': 'sha1',
+    'SHA256': 'sha256',
+    'SHA512': 'sha512',
+}
+# for Sources, the values are (algorithm, key in the parsed file list)
+sources_checksum_fields = {
+    'Files': ('md5', 'md5sum'),
+    'Checksums-Sha1': ('sha1', 'sha1'),
+    'Checksums-Sha256': ('sha256', 'sha256'),
+    'Checksums-Sha512': ('sha512', 'sha512'),
+}
+
+
+def iter_index_files(www):
+    """Yield the package index files of an archive
+
+    For each index, only a single variant (uncompressed, or compressed with
+    any supported compression) is reported, because they all have the
+    same content.
+
+    Parameters
+    ----------
+    www: Path
+      Root directory of the archive (contains `dists/`)
+
+    Yields
+    ------
+    Path
+    """
+    for root, dirs, files in os.walk(Path(www) / 'dists'):
+        # stable order
+        dirs.sort()
+        for name in index_names:
+            for ext in index_compressions:
+                if f'{name}{ext}' in files:
+                    yield Path(root) / f'{name}{ext}'
+                    break
+
+
+def get_index_type(path):
+    """Return 'Packages' or 'Sources' for a path to an index file"""
+    return Path(path).name.split('.', maxsplit=1)[0]
+
+
+def open_index(path):
+    """Open a (compressed) index file for reading text"""
+    path = Path(path)
+    opener = index_compressions.get(path.suffix, open)
+    return opener(path, 'rt', encoding='utf-8')
+
+
+def iter_index_entries(path):
+    """Yield the stanzas of an index file, one at a time
+
+    Yields
+    ------
+    Packages or Sources
+    """
+    cls = Sources if get_index_type(path) == 'Sources' else Packages
+    with open_index(path) as f:
+        yield from cls.iter_paragraphs(f, use_apt_pkg=False)
+
+
+def get_entry_files(entry):
+    """Report the pool files referenced by an index entry
+
+    Parameters
+    ----------
+    entry: Packages or Sources
+
+    Returns
+    -------
+    dict
+      Keys are POSIX paths relative to the archive root, values are dicts
+      with the file 'size', and any checksums declared in the index entry,
+      keyed by hashlib algorithm name.
+    """
+    if isinstance(entry, Sources):
+        files = {}
+        for field, (algorithm, key) in sources_checksum_fields.items():
+            for f in entry.get(field) or []:
+                props = files.setdefault(
+                    f"{entry['Directory']}/{f['name']}",
+                    dict(size=int(f['size'])),
+                )
+                props[algorithm] = f[key]
+        return files
+    props = dict(size=int(entry['Size']))
+    props.update(
+        (algorithm, entry[field])
+        for field, algorithm in packages_checksum_fields.items()
+        if field in entry
+    )
+    return {entry['Filename']: props}
+
+
+# schema of the SQLite index of all archive index entries. `indices` records
+# the checksum of each index file at the time its entries were recorded, to
+# be able to only re-read index files that changed. `package_datasets` caches
+# the packages found in a package dataset commit (JSON-encoded).
+# `verified_keys` records annex keys whose content was found to match a
+# SHA256 checksum
+db_schema = """
+CREATE TABLE IF NOT EXISTS indices (
+    path TEXT PRIMARY KEY,
+    checksum TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    idx TEXT NOT NULL REFERENCES indices(path),
+    codename TEXT NOT NULL,
+    component TEXT NOT NULL,
+    type TEXT NOT NULL,
+    package TEXT NOT NULL,
+    version TEXT NOT NULL,
+    architecture TEXT NOT NULL,
+    source TEXT NOT NULL,
+    source_version TEXT NOT NULL,
+    filename TEXT
+);
+CREATE INDEX IF NOT EXISTS entries_idx ON entries (idx);
+CREATE INDEX IF NOT EXISTS entries_package ON entries (package);
+CREATE INDEX IF NOT EXISTS entries_source ON entries (source);
+CREATE TABLE IF NOT EXISTS package_datasets (
+    commit_sha TEXT PRIMARY KEY,
+    packages TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS verified_keys (
+    annex_key TEXT NOT NULL,
+    sha256 TEXT NOT NULL,
+    PRIMARY KEY (annex_key, sha256)
+);
+CREATE TABLE IF NOT EXISTS debdeltas (
+    old_key TEXT NOT NULL,
+    new_key TEXT NOT NULL,
+    filename TEXT,
+    PRIMARY KEY (old_key, new_key)
+);
+"""
+# columns reported by query_index_db()
+db_columns = ('codename', 'component', 'type', 'package', 'version',
+              'architecture', 'source', 'source_version', 'filename')
+
+
+def get_index_db_path(ds):
+    """Location of the SQLite index of an archive repository dataset
+
+    It is kept inside the Git directory, as it is a local cache that is
+    not versioned.
+    """
+    return ds.repo.dot_git / 'datalad' / 'debian' / 'archive-index.sqlite'
+
+
+def connect_index_db(path):
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    db = sqlite3.connect(str(path))
+    db.executescript(db_schema)
+    return db
+
+
+def update_index_db(db_path, www, checksums=None):
+    """Bring the SQLite index in sync with the index files of an archive
+
+    Only index files whose checksum differs from the recorded one are read.
+
+    Parameters
+    ----------
+    db_path: Path
+    www: Path
+      Root directory of the archive (contains `dists/`)
+    checksums: dict, optional
+      Mapping of index file paths to a checksum of their content (e.g.,
+      the Git SHA of a committed file). For any index file not in this
+      mapping, size and modification time are used.
+
+    Yields
+    ------
+    tuple
+      (index path, state) for any index that was 'added', 'modified', or
+      'removed', or is 'unavailable' (content not present locally).
+    """
+    www = Path(www)
+    checksums = checksums or {}
+    with closing(connect_index_db(db_path)) as db:
+        recorded = dict(db.execute('SELECT path, checksum FROM indices'))
+        present = set()
+        for index in iter_index_files(www):
+            relpath = PurePosixPath(index.relative_to(www)).as_posix()
+            # all compression variants share one record
+            key = relpath[:-len(index.suffix)] \
+                if index.suffix and index.suffix in index_compressions \
+                else relpath
+            present.add(key)
+            checksum = checksums.get(index)
+            if checksum is None:
+                try:
+                    st = index.stat()
+                except FileNotFoundError:
+                    yield key, 'unavailable'
+                    continue
+                checksum = f'{st.st_size}:{st.st_mtime_ns}'
+            if recorded.get(key) == checksum:
+                continue
+            try:
+                rows = list(_iter_db_rows(index, key))
+            except FileNotFoundError:
+                # annexed index without content, keep what is known
+                yield key, 'unavailable'
+                continue
+            with db:
+                db.execute('DELETE FROM entries WHERE idx = ?', (key,))
+                db.executemany(
+                    'INSERT INTO entries VALUES (?,?,?,?,?,?,?,?,?,?)',
+                    rows)
+                db.execute(
+                    'INSERT OR REPLACE INTO indices VALUES (?, ?)',
+                    (key, checksum))
+            yield key, 'modified' if key in recorded else 'added'
+        for key in set(recorded).difference(present):
+            with db:
+                db.execute('DELETE FROM entries WHERE idx = ?', (key,))
+                db.execute('DELETE FROM indices WHERE path = ?', (key,))
+            yield key, 'removed'
+
+
+def query_index_db(db_path, package=None, codename=None, architecture=None,
+                   type=None, source=None):
+    """Query the SQLite index of an archive
+
+    Parameters
+    ----------
+    package: str, optional
+      Package name. Shell-style wildcards are supported.
+    codename: str, optional
+    architecture: str, optional
+      Architecture-independent packages ('all') always match.
+    type: {'binary', 'source'}, optional
+    source: str, optional
+      Source package name. Shell-style wildcards are supported.
+
+    Yields
+    ------
+    dict
+      With the keys listed in `db_columns`.
+    """
+    conditions = []
+    args = []
+    for column, op, value in (
+            ('package', 'GLOB', package),
+            ('source', 'GLOB', source),
+            ('codename', '=', codename),
+            ('type', '=', type)):
+        if value is not None:
+            conditions.append(f'{column} {op} ?')
+            args.append(value)
+    if architecture is not None:
+        conditions.append("architecture IN (?, 'all')")
+        args.append(architecture)
+    sql = f'SELECT {", ".join(db_columns)} FROM entries'
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += ' ORDER BY codename, component, package, architecture'
+    with closing(connect_index_db(db_path)) as db:
+        for row in db.execute(sql, args):
+            yield dict(zip(db_columns, row))
+
+
+def get_verified_keys(db_path, candidates):
+    """Report which (annex key, SHA256) pairs were verified before
+
+    Parameters
+    ----------
+    candidates: iterable
+      (annex key, SHA256) tuples
+
+    Returns
+    -------
+    set
+    """
+    candidates = set(candidates)
+    if not candidates:
+        return set()
+    with closing(connect_index_db(db_path)) as db:
+        return {
+            c for c in candidates
+            if db.execute(
+                'SELECT 1 FROM verified_keys '
+                'WHERE annex_key = ? AND sha256 = ?', c).fetchone()
+        }
+
+
+def add_verified_keys(db_path, verified):
+    """Record (annex key, SHA256) pairs as verified"""
+    verified = list(verified)
+    if not verified:
+        return
+    with closing(connect_index_db(db_path)) as db, db:
+        db.executemany(
+            'INSERT OR IGNORE INTO verified_keys VALUES (?, ?)', verified)
+
+
+def get_debdeltas(db_path, pairs):
+    """Report the debdelta files known for pairs of annex keys
+
+    Parameters
+    ----------
+    pairs: iterable
+      (old annex key, new annex key) tuples
+
+    Returns
+    -------
+    dict
+      Mapping of known pairs to the path of their debdelta file (relative
+      to the archive root), or None if no delta was worth keeping.
+    """
+    pairs = set(pairs)
+    if not pairs:
+        return {}
+    known = {}
+    with closing(connect_index_db(db_path)) as db:
+        for pair in pairs:
+            row = db.execute(
+                'SELECT filename FROM debdeltas '
+                'WHERE old_key = ? AND new_key = ?', pair).fetchone()
+            if row:
+                known[pair] = row[0]
+    return known
+
+
+def add_debdeltas(db_path, deltas):
+    """Record (old annex key, new annex key, debdelta path) records"""
+    deltas = list(deltas)
+    if not deltas:
+        return
+    with closing(connect_index_db(db_path)) as db, db:
+        db.executemany(
+            'INSERT OR REPLACE INTO debdeltas VALUES (?, ?, ?)', deltas)
+
+
+def _get_index_location(key):
+    """Report the codename and the component of a package index
+
+    dists/<codename>/<component>/[debian-installer/]{binary-<arch>,source}/
+    <index>, where the codename may contain slashes.
+
+    Returns
+    -------
+    (str, str)
+    """
+    # strip 'dists', the index file name, and its architecture directory
+    parts = PurePosixPath(key).parts[1:-2]
+    if parts[-1] == 'debian-installer':
+        parts = parts[:-1]
+    return '/'.join(parts[:-1]), parts[-1]
+
+
+def _iter_db_rows(index, key):
+    codename, component = _get_index_location(key)
+    is_source = get_index_type(index) == 'Sources'
+    for entry in iter_index_entries(index):
+        if is_source:
+            files = get_entry_files(entry)
+            dsc = [f for f in files if f.endswith('.dsc')]
+            yield (key, codename, component, 'source',
+                   entry['Package'], entry['Version'], 'source',
+                   entry['Package'], entry['Version'],
+                   dsc[0] if dsc else None)
+            continue
+        # Source: name (version), both optional
+        source = entry.get('Source', entry['Package']).split()
+        source_version = source[1].strip('()') if len(source) > 1 \
+            else entry['Version']
+        yield (key, codename, component, 'binary',
+               entry['Package'], entry['Version'], entry['Architecture'],
+               source[0], source_version, entry.get('Filename'))
@@ -0,0 +1,304 @@
+import json
+import logging
+from contextlib import closing
+from pathlib import Path
+
+from debian.debian_support import Version
+
+from datalad.distribution.dataset import (
+    Dataset,
+    EnsureDataset,
+    datasetmethod,
+    require_dataset,
+)
+from datalad.interface.base import (
+    Interface,
+    build_doc,
+)
+from datalad.interface.results import get_status_dict
+from datalad.interface.utils import (
+    eval_results,
+)
+from datalad.support.constraints import (
+    EnsureNone,
+    EnsureStr,
+)
+from datalad.support.exceptions import (
+    CapturedException,
+    CommandError,
+)
+from datalad.support.param import Parameter
+
+from datalad_debian.archive_index import (
+    connect_index_db,
+    get_index_db_path,
+    query_index_db,
+)
+from datalad_debian.archive_query import update_archive_index
+from datalad_debian.utils import get_dist_codename
+
+lgr = logging.getLogger('datalad.debian.archive_lag')
+
+
+@build_doc
+class ArchiveLag(Interface):
+    """Report differences between distribution datasets and their archive
+
+    For each distribution registered in a Debian archive repository dataset,
+    the latest version of each source and binary package found in its
+    package datasets is compared with the version in the archive, using
+    Debian version ordering. A result is reported for each package that
+    is 'missing' from the archive, or whose archive version is 'behind' or
+    'ahead' of the distribution. Packages in the archive that are not
+    found in any package dataset are reported as 'unknown'. A summary with
+    the number of packages in each category is reported per codename.
+
+    Only file names are compared, and they are read from the Git records
+    of the package datasets, hence no file content is needed. The findings
+    are cached per package dataset commit, and the archive side is read from
+    the index maintained by [CMD: deb-archive-query CMD][PY: deb_archive_query
+    PY]. Package epochs are not part of the file names, and are ignored in
+    the comparison.
+
+    Reading the Git records requires the distribution datasets, and any
+    package dataset without cached findings, to be installed. If they are
+    absent, they are installed without obtaining any file content. Apart
+    from that, and from the cache, nothing is modified.
+    """
+    _params_ = dict(
+        dataset=Parameter(
+            args=("-d", "--dataset"),
+            doc="""specify the Debian archive repository dataset to
+            inspect""",
+            constraints=EnsureDataset() | EnsureNone()),
+        codename=Parameter(
+            args=("--codename",),
+            doc="""only inspect distributions with this codename""",
+            constraints=EnsureStr() | EnsureNone()),
+    )
+
+    _examples_ = [
+        dict(text="Report which packages of bullseye still need to be "
+                  "imported into the archive",
+             code_cmd="datalad deb-archive-lag --codename bullseye",
+             code_py="deb_archive_lag(codename='bullseye')"),
+    ]
+
+    @staticmethod
+    @datasetmethod(name='deb_archive_lag')
+    @eval_results
+    def __call__(*, dataset=None, codename=None):
+        archive_ds = require_dataset(dataset)
+        www_ds = Dataset(archive_ds.pathobj / 'www')
+        if not www_ds.is_installed():
+            yield get_status_dict(
+                action='archive_lag',
+                status='impossible',
+                ds=archive_ds,
+                message=('No archive dataset installed at %s', www_ds.path),
+            )
+            return
+        yield from update_archive_index(archive_ds)
+        db_path = get_index_db_path(archive_ds)
+
+        # distribution datasets are needed to find the package datasets
+        dists = archive_ds.pathobj / 'distributions'
+        yield from archive_ds.get(
+            dists,
+            get_data=False,
+            recursive=True,
+            recursion_limit=1,
+            result_renderer='disabled',
+            return_type='generator',
+            on_failure='ignore',
+        )
+        # codename -> (type, package, architecture) -> version
+        dist_versions = {}
+        for r in archive_ds.subdatasets(
+                dists,
+                result_renderer='disabled',
+                return_type='generator',
+                on_failure='ignore'):
+            if r.get('status') != 'ok' or Path(r['path']).parent != dists:
+                continue
+            dist_ds = Dataset(r['path'])
+            dist_codename = get_dist_codename(dist_ds)
+            if codename is not None and dist_codename != codename:
+                continue
+            versions = dist_versions.setdefault(dist_codename, {})
+            with closing(connect_index_db(db_path)) as db:
+                for pkg_path, commit in _get_package_datasets(dist_ds):
+                    packages = _get_cached_packages(db, commit)
+                    if packages is None and \
+                            not Dataset(pkg_path).is_installed():
+                        # only the Git records are needed
+                        yield from dist_ds.get(
+                            pkg_path,
+                            get_data=False,
+                            result_renderer='disabled',
+                            return_type='generator',
+                            on_failure='ignore',
+                        )
+                        if not Dataset(pkg_path).is_installed():
+                            # the failure was reported by get()
+                            continue
+                    try:
+                        if packages is None:
+                            packages = _get_packages(db, pkg_path, commit)
+                    except CommandError as e:
+                        yield get_status_dict(
+                            action='archive_lag',
+                            status='impossible',
+                            path=str(pkg_path),
+                            type='dataset',
+                            message=(
+                                'Cannot read package dataset state %s, '
+                                'update the distribution dataset first',
+                                commit),
+                            exception=CapturedException(e),
+                        )
+                        continue
+                    for ptype, name, version, arch in packages:
+                        _keep_latest(versions, (ptype, name, arch), version)
+
+        for dist_codename, versions in sorted(dist_versions.items()):
+            archive_versions = {}
+            for entry in query_index_db(db_path, codename=dist_codename):
+                _keep_latest(
+                    archive_versions,
+                    (entry['type'], entry['package'], entry['architecture']),
+                    _strip_epoch(entry['version']),
+                )
+            counts = dict(current=0, missing=0, behind=0, ahead=0, unknown=0)
+            for key in sorted(set(versions).union(archive_versions)):
+                dist_version = versions.get(key)
+                archive_version = archive_versions.get(key)
+                lag = _get_lag(dist_version, archive_version)
+                counts[lag] += 1
+                if lag == 'current':
+                    continue
+                ptype, name, arch = key
+                yield get_status_dict(
+                    action='archive_lag',
+                    status='ok',
+                    ds=archive_ds,
+                    message=(
+                        '%s %s (%s): %s, distribution %s, archive %s',
+                        ptype, name, arch, lag, dist_version,
+                        archive_version),
+                    codename=dist_codename,
+                    package=name,
+                    package_type=ptype,
+                    architecture=arch,
+                    dist_version=dist_version,
+                    archive_version=archive_version,
+                    lag=lag,
+                )
+            yield get_status_dict(
+                action='archive_lag',
+                status='ok',
+                ds=archive_ds,
+                message=(
+                    '%s: %i current, %i missing, %i behind, %i ahead, '
+                    '%i unknown',
+                    dist_codename, counts['current'], counts['missing'],
+                    counts['behind'], counts['ahead'], counts['unknown']),
+                codename=dist_codename,
+                **counts
+            )
+
+
+def _get_package_datasets(dist_ds):
+    """Yield path and recorded commit of all package datasets"""
+    packages = dist_ds.pathobj / 'packages'
+    if not packages.exists():
+        return
+    for path, props in dist_ds.repo.get_content_info(
+            paths=[packages.relative_to(dist_ds.pathobj)],
+            ref='HEAD').items():
+        if props.get('type') == 'dataset':
+            yield path, props['gitshasum']
+
+
+def _get_cached_packages(db, commit):
+    """Report the cached packages of a package dataset commit, if any"""
+    cached = db.execute(
+        'SELECT packages FROM package_datasets WHERE commit_sha = ?',
+        (commit,)).fetchone()
+    return json.loads(cached[0]) if cached else None
+
+
+def _get_packages(db, pkg_path, commit):
+    """Report the packages in a package dataset commit
+
+    The package dataset must be installed. The result is cached by
+    commit SHA.
+
+    Returns
+    -------
+    list
+      Of (type, name, version, architecture) tuples.
+    """
+    pkg_ds = Dataset(pkg_path)
+    packages = [
+        p for p in (
+            parse_package_filename(f)
+            for f in pkg_ds.repo.call_git_items_(
+                ['ls-tree', '--name-only', commit], read_only=True))
+        if p
+    ]
+    with db:
+        db.execute(
+            'INSERT OR REPLACE INTO package_datasets VALUES (?, ?)',
+            (commit, json.dumps(packages)))
+    return packages
+
+
+def parse_package_filename(name):
+    """Determine package properties from a file name
+
+    Parameters
+    ----------
+    name: str
+      File name of a source package description (.dsc) or binary package
+      (.deb, .udeb).
+
+    Returns
+    -------
+    tuple or None
+      (type, name, version, architecture), or None if the file is no
+      package.
+    """
+    stem, _, ext = name.rpartition('.')
+    if ext == 'dsc':
+        parts = stem.split('_')
+        if len(parts) != 2:
+            return None
+        return ('source', parts[0], parts[1], 'source')
+    if ext in ('deb', 'udeb'):
+        parts = stem.split('_')
+        if len(parts) != 3:
+            return None
+        return ('binary', parts[0], parts[1], parts[2])
+    return None
+
+
+def _strip_epoch(version):
+    return version.split(':', maxsplit=1)[-1]
+
+
+def _keep_latest(versions, key, version):
+    known = versions.get(key)
+    if known is None or Version(version) > Version(known):
+        versions[key] = version
+
+
+def _get_lag(dist_version, archive_version):
+    if archive_version is None:
+        return 'missing'
+    if dist_version is None:
+        return 'unknown'
+    d, a = Version(dist_version), Version(archive_version)
+    if d == a:
+        return 'current'
+    return 'behind' if a < d else 'ahead'
@@ -0,0 +1,177 @@
+import logging
+
+from datalad.distribution.dataset import (
+    Dataset,
+    EnsureDataset,
+    datasetmethod,
+    require_dataset,
+)
+from datalad.interface.base import (
+    Interface,
+    build_doc,
+)
+from datalad.interface.results import get_status_dict
+from datalad.interface.utils import (
+    eval_results,
+)
+from datalad.support.constraints import (
+    EnsureChoice,
+    EnsureNone,
+    EnsureStr,
+)
+from datalad.support.param import Parameter
+
+from datalad_debian.archive_index import (
+    get_index_db_path,
+    query_index_db,
+    update_index_db,
+)
+
+lgr = logging.getLogger('datalad.debian.archive_query')
+
+
+@build_doc
+class ArchiveQuery(Interface):
+    """Query the package versions in a Debian archive
+
+    The Packages and Sources indices of the 'www' subdataset of a Debian
+    archive repository dataset are kept in a local SQLite database (in the
+    Git directory of the dataset). This database is updated at the end of
+    each archive update, and incrementally before each query: only index
+    files that changed since the last query are read.
+
+    One result is reported for each matching index entry, with the
+    properties 'codename', 'component', 'package_type' (binary or source),
+    'package', 'version', 'architecture', 'source', 'source_version', and
+    'filename'.
+    """
+    _params_ = dict(
+        dataset=Parameter(
+            args=("-d", "--dataset"),
+            doc="""specify the Debian archive repository dataset to
+            query""",
+            constraints=EnsureDataset() | EnsureNone()),
+        package=Parameter(
+            args=("package",),
+            nargs='?',
+            metavar='PACKAGE',
+            doc="""name of the package to query. Shell-style wildcards
+            are supported. If not given, all packages are reported""",
+            constraints=EnsureStr() | EnsureNone()),
+        codename=Parameter(
+            args=("--codename",),
+            doc="""only report packages in this distribution""",
+            constraints=EnsureStr() | EnsureNone()),
+        architecture=Parameter(
+            args=("--architecture",),
+            doc="""only report binary packages for this architecture, or
+            architecture-independent packages""",
+            constraints=EnsureStr() | EnsureNone()),
+        type=Parameter(
+            args=("--type",),
+            doc="""only report binary or source packages""",
+            constraints=EnsureChoice('binary', 'source', None)),
+        source=Parameter(
+            args=("--source",),
+            doc="""only report packages built from this source package.
+            Shell-style wildcards are supported""",
+            constraints=EnsureStr() | EnsureNone()),
+    )
+
+    _examples_ = [
+        dict(text="Which version of 'hello' is in bullseye for amd64",
+             code_cmd="datalad deb-archive-query --codename bullseye "
+                      "--architecture amd64 hello",
+             code_py="deb_archive_query('hello', codename='bullseye', "
+                     "architecture='amd64')"),
+        dict(text="Report all binary packages built from the 'hello' "
+                  "source package",
+             code_cmd="datalad deb-archive-query --type binary "
+                      "--source hello",
+             code_py="deb_archive_query(type='binary', source='hello')"),
+    ]
+
+    @staticmethod
+    @datasetmethod(name='deb_archive_query')
+    @eval_results
+    def __call__(package=None, *, dataset=None, codename=None,
+                 architecture=None, type=None, source=None):
+        archive_ds = require_dataset(dataset)
+        www_ds = Dataset(archive_ds.pathobj / 'www')
+        if not www_ds.is_installed():
+            yield get_status_dict(
+                action='archive_query',
+                status='impossible',
+                ds=archive_ds,
+                message=('No archive dataset installed at %s', www_ds.path),
+            )
+            return
+        yield from update_archive_index(archive_ds)
+
+        for entry in query_index_db(
+                get_index_db_path(archive_ds),
+                package=package,
+                codename=codename,
+                architecture=architecture,
+                type=type,
+                source=source):
+            yield get_status_dict(
+                action='archive_query',
+                status='ok',
+                path=str(www_ds.pathobj / entry['filename'])
+                if entry['filename'] else www_ds.path,
+                type='file',
+                message=(
+                    '%s %s %s (%s/%s)',
+                    entry['package'], entry['version'],
+                    entry['architecture'], entry['codename'],
+                    entry['component']),
+                **{
+                    # `type` is the file type in a result
+                    'package_type' if k == 'type' else k: v
+                    for k, v in entry.items()
+                }
+            )
+
+
+def update_archive_index(archive_ds):
+    """Update the SQLite index of an archive repository dataset
+
+    Yields
+    ------
+    dict
+      Result records for index files that could not be read.
+    """
+    www_ds = Dataset(archive_ds.pathobj / 'www')
+    dists = www_ds.pathobj / 'dists'
+    if not dists.exists():
+        return
+    # the checksums of committed files are known without reading them.
+    # Files modified in the work tree are not represented by them, and
+    # are checked by their size and modification time instead
+    modified = {
+        www_ds.pathobj / p
+        for p in www_ds.repo.call_git_items_(
+            ['diff', '--name-only', 'HEAD'],
+            files=[str(dists.relative_to(www_ds.pathobj))],
+            read_only=True)
+    }
+    checksums = {
+        p: props['gitshasum']
+        for p, props in www_ds.repo.get_content_info(
+            paths=[dists.relative_to(www_ds.pathobj)], ref='HEAD').items()
+        if 'gitshasum' in props and p not in modified
+    }
+    for index, state in update_index_db(
+            get_index_db_path(archive_ds), www_ds.pathobj, checksums):
+        if state != 'unavailable':
+            lgr.debug('Archive index %s %s', index, state)
+            continue
+        yield get_status_dict(
+            action='archive_index',
+            status='impossible',
+            path=str(www_ds.pathobj / index),
+            type='file',
+            message='Index content not available locally, not updated',
+            logger=lgr,
+        )
@@ -0,0 +1,330 @@
+import logging
+import os
+from datetime import (
+    datetime,
+    timezone,
+)
+from pathlib import Path
+
+from datalad.distribution.dataset import (
+    Dataset,
+    EnsureDataset,
+    datasetmethod,
+    require_dataset,
+)
+from datalad.interface.base import (
+    Interface,
+    build_doc,
+)
+from datalad.interface.results import get_status_dict
+from datalad.interface.utils import (
+    eval_results,
+)
+from datalad.runner import (
+    Runner,
+    StdOutErrCapture,
+)
+from datalad.support.constraints import (
+    EnsureNone,
+    EnsureStr,
+)
+from datalad.support.exceptions import (
+    CapturedException,
+    CommandError,
+)
+from datalad.support.param import Parameter
+
+lgr = logging.getLogger('datalad.debian.archive_snapshot')
+
+# snapshots are Git tags of the 'www' subdataset, named after the (UTC)
+# time they were taken, in the style of snapshot.debian.org
+snapshot_tag_prefix = 'snapshot/'
+snapshot_time_format = '%Y%m%dT%H%M%SZ'
+# appended to the name of a snapshot that is taken in the same second as
+# a previous one, keeps the names in chronological order
+snapshot_suffix_format = '.{:02d}'
+
+
+@build_doc
+class ArchiveSnapshot(Interface):
+    """Report, record, and materialize point-in-time snapshots of an archive
+
+    Each update with [CMD: deb-update-reprepro-repository CMD][PY:
+    deb_update_reprepro_repository PY] that changes the 'www' subdataset of
+    an archive repository dataset records its new state as a snapshot: a
+    Git tag 'snapshot/<timestamp>' in 'www', with the UTC time of the
+    update (e.g. 'snapshot/20261019T114500Z'). Snapshots taken within the
+    same second get a counter appended ('snapshot/20261019T114500Z.01').
+    A snapshot takes no space
+    besides the tag, because the annex of 'www' keeps the content of all
+    package versions.
+
+    Without a snapshot given, all snapshots are reported. A snapshot can
+    be given by its tag name or by its timestamp. A timestamp selects the
+    latest snapshot taken no later than that time, and may be truncated:
+    '20261013' selects the last snapshot taken on or before October 13th.
+
+    With [CMD: --to CMD][PY: `to` PY] a snapshot is materialized as a
+    directory tree that a web server can serve as an APT archive. Annexed
+    files are hardlinks to the annex objects of 'www', or reflinks where
+    hardlinks are not possible (e.g. across file systems). No content is
+    copied, hence the content of all annexed files of the snapshot must be
+    present in 'www'. Files of a materialized snapshot must not be modified,
+    because they are the annex objects of the archive.
+    """
+    _params_ = dict(
+        dataset=Parameter(
+            args=("-d", "--dataset"),
+            doc="""specify the Debian archive repository dataset""",
+            constraints=EnsureDataset() | EnsureNone()),
+        snapshot=Parameter(
+            args=("snapshot",),
+            nargs='?',
+            metavar='SNAPSHOT',
+            doc="""name or (possibly truncated) timestamp of the snapshot to
+            report or materialize""",
+            constraints=EnsureStr() | EnsureNone()),
+        to=Parameter(
+            args=("--to",),
+            metavar='PATH',
+            doc="""materialize the snapshot in this directory, which must
+            not exist or be empty. If no snapshot is given, the latest one
+            is materialized""",
+            constraints=EnsureStr() | EnsureNone()),
+        tag=Parameter(
+            args=("--tag",),
+            doc="""record the current state of the archive as a snapshot,
+            unless it is recorded already. Updates do this automatically,
+            this is only needed for changes made by other means""",
+            action='store_true'),
+    )
+
+    _examples_ = [
+        dict(text="Report all snapshots of an archive",
+             code_cmd="datalad deb-archive-snapshot",
+             code_py="deb_archive_snapshot()"),
+        dict(text="Materialize the archive as it was at the end of "
+                  "October 13th, for serving it from a web server",
+             code_cmd="datalad deb-archive-snapshot --to "
+                      "/srv/snapshots/20261013 20261013",
+             code_py="deb_archive_snapshot('20261013', "
+                     "to='/srv/snapshots/20261013')"),
+    ]
+
+    @staticmethod
+    @datasetmethod(name='deb_archive_snapshot')
+    @eval_results
+    def __call__(snapshot=None, *, dataset=None, to=None, tag=False):
+        archive_ds = require_dataset(dataset)
+        www_ds = Dataset(archive_ds.pathobj / 'www')
+        if not www_ds.is_installed():
+            yield get_status_dict(
+                action='archive_snapshot',
+                status='impossible',
+                ds=archive_ds,
+                message=('No archive dataset installed at %s', www_ds.path),
+            )
+            return
+        if tag:
+            yield from tag_archive_snapshot(archive_ds)
+
+        snapshots = get_archive_snapshots(www_ds)
+        if snapshot is not None:
+            snapshots = _select_snapshot(snapshots, snapshot)
+            if not snapshots:
+                yield get_status_dict(
+                    action='archive_snapshot',
+                    status='impossible',
+                    ds=archive_ds,
+                    message=('No snapshot matches %r', snapshot),
+                )
+                return
+        if to is None:
+            for name, hexsha in snapshots:
+                yield _get_snapshot_result(www_ds, name, hexsha)
+        elif not snapshots:
+            yield get_status_dict(
+                action='archive_snapshot.materialize',
+                status='impossible',
+                ds=archive_ds,
+                message='No snapshot recorded yet',
+            )
+        else:
+            yield from _materialize_snapshot(
+                www_ds, *snapshots[-1], Path(to))
+
+
+def get_archive_snapshots(www_ds):
+    """Report all snapshots of an archive
+
+    Returns
+    -------
+    list
+      Of (tag name, commit) tuples, oldest first.
+    """
+    return sorted(
+        (t['name'], t['hexsha'])
+        for t in www_ds.repo.get_tags()
+        if t['name'].startswith(snapshot_tag_prefix)
+    )
+
+
+def tag_archive_snapshot(archive_ds):
+    """Record the current state of the 'www' subdataset as a snapshot
+
+    Yields
+    ------
+    dict
+      Result record, 'notneeded' if the state is recorded already.
+    """
+    www_ds = Dataset(archive_ds.pathobj / 'www')
+    hexsha = www_ds.repo.get_hexsha()
+    snapshots = get_archive_snapshots(www_ds)
+    known = [n for n, h in snapshots if h == hexsha]
+    if known:
+        yield _get_snapshot_result(
+            www_ds, known[-1], hexsha, action='archive_snapshot.tag',
+            status='notneeded')
+        return
+    timestamp = snapshot_tag_prefix + datetime.now(timezone.utc).strftime(
+        snapshot_time_format)
+    taken = {n for n, _ in snapshots}
+    name = timestamp
+    i = 0
+    while name in taken:
+        i += 1
+        name = timestamp + snapshot_suffix_format.format(i)
+    try:
+        www_ds.repo.tag(name, commit=hexsha)
+    except CommandError as e:
+        yield get_status_dict(
+            action='archive_snapshot.tag',
+            status='error',
+            ds=www_ds,
+            message=('Cannot record snapshot %s', name),
+            exception=CapturedException(e),
+        )
+        return
+    yield _get_snapshot_result(
+        www_ds, name, hexsha, action='archive_snapshot.tag')
+
+
+def _get_snapshot_result(www_ds, name, hexsha, action='archive_snapshot',
+                         status='ok'):
+    return get_status_dict(
+        action=action,
+        status=status,
+        ds=www_ds,
+        message=('%s (%s)', name, hexsha[:8]),
+        snapshot=name,
+        commit=hexsha,
+    )
+
+
+def _select_snapshot(snapshots, snapshot):
+    """Select a snapshot by name or timestamp
+
+    Returns
+    -------
+    list
+      With the selected (name, commit), or empty.
+    """
+    exact = [s for s in snapshots if s[0] == snapshot]
+    if exact:
+        return exact
+    timestamp = snapshot[len(snapshot_tag_prefix):] \
+        if snapshot.startswith(snapshot_tag_prefix) else snapshot
+    # a truncated timestamp covers the entire period it names
+    matching = [
+        s for s in snapshots
+        if s[0][len(snapshot_tag_prefix):][:len(timestamp)] <= timestamp
+    ]
+    return matching[-1:]
+
+
+def _materialize_snapshot(www_ds, name, hexsha, target):
+    if target.exists() and any(target.iterdir()):
+        yield get_status_dict(
+            action='archive_snapshot.materialize',
+            status='impossible',
+            ds=www_ds,
+            path=str(target),
+            message=('Target directory %s is not empty', target),
+        )
+        return
+    lgr.info('Materializing snapshot %s in %s', name, target)
+    counts = dict(hardlink=0, reflink=0, git=0)
+    for path, props in www_ds.repo.get_content_annexinfo(
+            ref=hexsha, eval_availability=True).items():
+        relpath = path.relative_to(www_ds.pathobj)
+        # dataset metadata is not part of the archive
+        if relpath.parts[0].startswith('.') or props['type'] == 'dataset':
+            continue
+        dst = target / relpath
+        dst.parent.mkdir(parents=True, exist_ok=True)
+        if 'key' not in props:
+            # not annexed, small enough to be written from Git. Apart
+            # from dataset metadata, these are the symlinks reprepro
+            # creates, and text files, everything else is annexed
+            content = www_ds.repo.call_git(
+                ['cat-file', 'blob', props['gitshasum']], read_only=True)
+            if props['type'] == 'symlink':
+                dst.symlink_to(content)
+            else:
+                dst.write_text(content)
+            counts['git'] += 1
+            continue
+        if not props.get('has_content'):
+            yield get_status_dict(
+                action='archive_snapshot.materialize',
+                status='impossible',
+                path=str(dst),
+                type='file',
+                message=('Content of %s not available locally', relpath),
+            )
+            continue
+        try:
+            counts[_link_object(props['objloc'], dst)] += 1
+        except (OSError, CommandError) as e:
+            yield get_status_dict(
+                action='archive_snapshot.materialize',
+                status='error',
+                path=str(dst),
+                type='file',
+                message=('Cannot link %s without a copy', relpath),
+                exception=CapturedException(e),
+            )
+    yield get_status_dict(
+        action='archive_snapshot.materialize',
+        status='ok',
+        ds=www_ds,
+        path=str(target),
+        type='directory',
+        message=(
+            '%s: %i hardlinked, %i reflinked, %i from Git',
+            name, counts['hardlink'], counts['reflink'], counts['git']),
+        snapshot=name,
+        commit=hexsha,
+        **counts
+    )
+
+
+def _link_object(objloc, dst):
+    """Link an annex object to a destination, without copying its content
+
+    Returns
+    -------
+    str
+      'hardlink' or 'reflink'
+    """
+    try:
+        os.link(objloc, dst)
+        return 'hardlink'
+    except OSError as e:
+        lgr.debug('Cannot hardlink %s: %s', objloc, CapturedException(e))
+    # fails where reflinks are not supported, rather than copying
+    Runner().run(
+        ['cp', '--reflink=always', str(objloc), str(dst)],
+        protocol=StdOutErrCapture,
+    )
+    return 'reflink'
@@ -13,15 +13,13 @@ from datalad.interface.base import (
 from datalad.interface.utils import (
     eval_results,
 )
-from datalad.runner import (
-    Runner,
-    StdOutCapture,
-)
 from datalad.support.constraints import (
     EnsureNone,
 )
 from datalad.support.param import Parameter
 
+from datalad_debian.utils import get_build_arch
+
 lgr = logging.getLogger('datalad.debian.bootstrap_builder')
 
 
@@ -50,6 +48,15 @@ class BootstrapBuilder(Interface):
         |    │       ├── README.md
         |    │       └── singularity-any     <- builder configuration
 
+    Two containers are registered for the build environment. The one named
+    after the build environment runs it with '--writable'.
+    The one with an '-overlay' suffix leaves the build environment itself
+    unmodified, changes made during a build (e.g., installed
+    build-dependencies) go into a writable overlay directory
+    'cache/overlay' of the 'builder' dataset instead.
+    [CMD: deb-build-package CMD][PY: deb_build_package PY] only uses it,
+    and sets up the overlay for each build, when the configuration
+    'datalad.debian.build-overlays' is set.
     """
 
     _params_ = dict(
@@ -78,9 +85,7 @@ class BootstrapBuilder(Interface):
         builder_ds = require_dataset(dataset)
 
         # figure out which architecture we will be building for
-        binarch = Runner().run(
-            ['dpkg-architecture', '-q', 'DEB_BUILD_ARCH'],
-            protocol=StdOutCapture)['stdout'].strip()
+        binarch = get_build_arch()
 
         buildenv_name = f"{cfgtype}-{binarch}"
 
@@ -113,7 +118,7 @@ class BootstrapBuilder(Interface):
 
         buildenv_callfmt = \
             'singularity run ' \
-            '--bind builder/cache/var/lib/apt:/var/lib/apt,builder/cache/var/cache/apt:/var/cache/apt,.:/pkg ' \
+            '--bind builder/cache/var/lib/apt:/var/lib/apt,builder/cache/var/cache/apt:/var/cache/apt,builder/cache/workspace:/workspace,.:/pkg ' \
             '--pwd /pkg ' \
             '--fakeroot ' \
             '--cleanenv ' \
@@ -123,15 +128,20 @@ class BootstrapBuilder(Interface):
             '--workdir {{tmpdir}} ' \
             '{img} {cmd}'
 
-        # this is a fresh addition of the build env
-        yield from builder_ds.containers_add(
-            buildenv_name,
-            image=str(buildenv),
-            call_fmt=buildenv_callfmt,
-            # tolerate an already existing record
-            update=True,
-            result_renderer='disabled',
-            return_type='generator',
-            # give control flow to caller
-            on_failure='ignore',
-        )
+        # this is a fresh addition of the build env, plus its variant for
+        # builds with a (kept) overlay
+        for name, callfmt in (
+                (buildenv_name, buildenv_callfmt),
+                (f"{buildenv_name}-overlay", buildenv_callfmt.replace(
+                    '--writable ', '--overlay builder/cache/overlay '))):
+            yield from builder_ds.containers_add(
+                name,
+                image=str(buildenv),
+                call_fmt=callfmt,
+                # tolerate an already existing record
+                update=True,
+                result_renderer='disabled',
+                return_type='generator',
+                # give control flow to caller
+                on_failure='ignore',
+            )
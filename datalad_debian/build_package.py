@@ -1,7 +1,22 @@
+import hashlib
+import json
 import logging
+import os
+import re
+import shutil
+import tempfile
+from contextlib import (
+    ExitStack,
+    contextmanager,
+)
+from datetime import datetime
 from pathlib import Path
+from threading import Lock
+
+from debian.deb822 import Dsc
 
 from datalad.distribution.dataset import (
+    Dataset,
     EnsureDataset,
     datasetmethod,
     require_dataset,
@@ -24,11 +39,51 @@ from datalad.runner import (
     Runner,
     StdOutCapture,
 )
+from datalad.support.exceptions import CommandError
 from datalad.support.param import Parameter
-from .utils import result_matches
+from .apt_proxy import running_apt_proxy
+from .utils import (
+    get_build_arch,
+    get_config_int,
+    result_matches,
+)
 
 lgr = logging.getLogger('datalad.debian.build_package')
 
+# timestamped markers in the log of a build, which start its phases
+build_phase_markers = {
+    'Extracting the source package': 'extract',
+    'Updating build environment': 'update',
+    'Installing build-dependencies': 'build_deps',
+    'Build starting': 'build',
+    'Deposit build results': 'deposit',
+    # ends the last phase
+    'Builder exit': None,
+}
+build_phase_marker_regex = re.compile(
+    r'^# (?P<marker>[^#:]+): (?P<time>\d{4}-\d\d-\d\dT[0-9:]+[+-][0-9:]+)$',
+    flags=re.MULTILINE)
+# fields of a .dsc that determine which packages a build installs
+build_deps_fields = (
+    'Build-Depends', 'Build-Depends-Arch', 'Build-Depends-Indep',
+    'Build-Conflicts', 'Build-Conflicts-Arch', 'Build-Conflicts-Indep')
+# a build tree, with all build products, is assumed to take up to this many
+# times the size of the (compressed) files of its source package
+workspace_size_factor = 10
+# RAM-backed file system for 'tmpfs' build workspaces
+tmpfs_path = Path('/dev/shm')
+# space of tmpfs workspaces reserved by running builds of this process.
+# Builds in other processes are only accounted for by the free space of the
+# tmpfs
+_tmpfs_reserved = 0
+_tmpfs_lock = Lock()
+# CPU cores allocated to running builds, the number of running builds, and
+# the number of builds expected to run concurrently
+_cpus_allocated = 0
+_builds_running = 0
+_builds_expected = 0
+_cpu_lock = Lock()
+
 
 @build_doc
 class BuildPackage(Interface):
@@ -43,6 +98,87 @@ class BuildPackage(Interface):
     Beyond binary .deb files, this command creates a .changes, a .buildinfo,
     and a logs/.txt file with build metadata and provenance. All resulting
     files are placed into the root of the package dataset.
+
+    A build is skipped, if the package dataset already records a build of
+    the same .dsc file for the same architecture, made with the same state
+    of the 'builder' subdataset. The result then points to the .changes
+    file and the build log of that build. Use [CMD: --rebuild CMD][PY:
+    `rebuild` PY] to build regardless.
+
+    By default, the APT package lists and downloaded packages of the build
+    environment are cached in the 'builder' subdataset of the package
+    dataset. With [CMD: --apt-cache CMD][PY: `apt_cache` PY] (or the
+    configuration 'datalad.debian.apt-cache') a cache directory shared by
+    all builds (e.g. of a distribution, or a host) is used instead.
+    Concurrent builds take turns for their APT operations, builders
+    bootstrapped with an earlier version of the default recipe do not, and
+    should be bootstrapped again before sharing a cache.
+
+    With [CMD: --apt-proxy CMD][PY: `apt_proxy` PY] (or the configuration
+    'datalad.debian.apt-proxy') a caching HTTP proxy is run on localhost for
+    the duration of the build, and the build environment downloads packages
+    through it. Package files are kept in the given directory on the host,
+    up to a size of 'datalad.debian.apt-proxy-size' MiB (default: 10240),
+    after which the least recently used ones are removed. Cache hits and
+    misses are reported in a 'deb_build_package.apt_proxy' result. They are
+    the totals of the proxy, which include concurrent builds of the same
+    process that use it too. Only one proxy store can be in use in a
+    process at a time.
+
+    By default, each build runs in the writable build environment itself.
+    With the configuration 'datalad.debian.build-overlays' set to a number
+    N, builds run with a writable overlay on top of the build environment
+    instead (for builders bootstrapped with a current version of
+    [CMD: deb-bootstrap-builder CMD][PY: deb_bootstrap_builder PY]), and
+    the overlays of up to N builds are kept in the 'builder' subdataset,
+    one for each set of build-dependencies (as declared in the .dsc file)
+    and state of the builder. A build with the same build-dependencies
+    reuses an overlay with the build-dependencies installed already.
+    Otherwise, the build starts from a copy of the most recently used
+    overlay, and installs what is missing. The least recently used overlays
+    are removed, when more than N are kept.
+
+    By default, the build takes place inside the build environment, in the
+    temporary directory of the container. The configuration
+    'datalad.debian.build-workspace' can place it elsewhere on the host (for
+    builders bootstrapped with a current version of [CMD:
+    deb-bootstrap-builder CMD][PY: deb_bootstrap_builder PY]): 'tmpfs' builds
+    in RAM, a path builds in a directory below this path (e.g., on a fast
+    scratch disk). A tmpfs workspace is only used if the estimated size of
+    the build fits into the free space of the tmpfs and into the limit
+    'datalad.debian.build-tmpfs-size' (in MiB, default: 4096), which is
+    shared by all concurrent builds of a process. Otherwise, the build falls
+    back to the default location. Workspaces are removed after the build.
+
+    The workspace, the overlay, and the APT cache of a build are set up as
+    links in the 'builder' subdataset of the package dataset. Hence, no two
+    builds must run in the same package dataset at the same time, neither
+    in one process nor in several ones. [CMD: deb-build-packages CMD][PY:
+    deb_build_packages PY] builds the source packages of a package dataset
+    one after another.
+
+    With [CMD: --ccache CMD][PY: `ccache` PY] (or the configuration
+    'datalad.debian.ccache') compilers run through ccache, with a cache of
+    the given maximum size in 'cache/ccache' of the 'builder' subdataset.
+    The cache is kept across builds of the package, e.g. of new Debian
+    revisions or after builder updates. The cache statistics of the build are
+    appended to the build log, and reported in a 'deb_build_package.ccache'
+    result. This needs a builder configured with a current version of the
+    default recipe.
+
+    The durations of the phases of a build (e.g., the installation of
+    build-dependencies, or the compilation) are read from the timestamps in
+    its log. They are written into a .json file next to the log in 'logs/',
+    and reported in a 'deb_build_package.phases' result.
+
+    Builds run in parallel (DEB_BUILD_OPTIONS=parallel=N) on the CPU cores
+    that are not in use by other builds of the same process. The number of
+    cores available to all builds is configured with
+    'datalad.debian.build-cpus' (default: all cores, 0 builds serially).
+    Each build gets an equal share of them, given the number of builds that
+    run (or are expected to run, e.g. by [CMD: deb-build-packages CMD][PY:
+    deb_build_packages PY]) concurrently, but no more than are free, and at
+    least one.
     """
     _params_ = dict(
         dataset=Parameter(
@@ -59,6 +195,33 @@ class BuildPackage(Interface):
             doc="""Update the builder subdataset from its origin before package
             build""",
             action='store_true'),
+        rebuild=Parameter(
+            args=("--rebuild",),
+            doc="""build even if the package dataset records a build of
+            the same source package with the same builder already""",
+            action='store_true'),
+        apt_cache=Parameter(
+            args=("--apt-cache",),
+            metavar='PATH',
+            doc="""directory with an APT cache to share with other builds.
+            A relative path is interpreted relative to the package dataset.
+            Defaults to the configuration 'datalad.debian.apt-cache'""",
+            constraints=EnsureStr() | EnsureNone()),
+        apt_proxy=Parameter(
+            args=("--apt-proxy",),
+            metavar='PATH',
+            doc="""directory to keep package files of a caching APT proxy
+            for the build in. A relative path is interpreted relative to the
+            package dataset. Defaults to the configuration
+            'datalad.debian.apt-proxy'""",
+            constraints=EnsureStr() | EnsureNone()),
+        ccache=Parameter(
+            args=("--ccache",),
+            metavar='SIZE',
+            doc="""compile with ccache, and keep a cache of up to this size
+            (e.g., '5G') for the package. Defaults to the configuration
+            'datalad.debian.ccache'""",
+            constraints=EnsureStr() | EnsureNone()),
     )
 
     _examples_ = [
@@ -72,30 +235,54 @@ class BuildPackage(Interface):
     @staticmethod
     @datasetmethod(name='deb_build_package')
     @eval_results
-    def __call__(dsc, *, dataset=None, update_builder=False):
+    def __call__(dsc, *, dataset=None, update_builder=False, rebuild=False,
+                 apt_cache=None, apt_proxy=None, ccache=None):
         dsc = Path(dsc)
 
         pkg_ds = require_dataset(dataset)
 
+        apt_proxy = apt_proxy or pkg_ds.config.get('datalad.debian.apt-proxy')
+        if apt_proxy:
+            apt_proxy_size = yield from get_config_int(
+                pkg_ds, 'datalad.debian.apt-proxy-size', 10240,
+                'deb_build_package', minimum=1)
+            if apt_proxy_size is None:
+                return
+        keep_overlays = yield from get_config_int(
+            pkg_ds, 'datalad.debian.build-overlays', 0, 'deb_build_package')
+        if keep_overlays is None:
+            return
+        tmpfs_size = yield from get_config_int(
+            pkg_ds, 'datalad.debian.build-tmpfs-size', 4096,
+            'deb_build_package')
+        if tmpfs_size is None:
+            return
+        build_cpus = yield from get_config_int(
+            pkg_ds, 'datalad.debian.build-cpus', _get_cpu_count(),
+            'deb_build_package')
+        if build_cpus is None:
+            return
+
         if not dsc.exists() and not dsc.is_symlink():
             # maybe this is just the dsc filename, inside the `dataset`
             dsc = pkg_ds.pathobj / dsc
 
         # we need to make sure the DSC is around to be able to parse it
-        yield from pkg_ds.get(
-            dsc,
-            result_renderer='disabled',
-            return_type='generator',
-            # leave flow-control to caller
-            on_failure='ignore',
-        )
+        if not dsc.exists():
+            yield from pkg_ds.get(
+                dsc,
+                result_renderer='disabled',
+                return_type='generator',
+                # leave flow-control to caller
+                on_failure='ignore',
+            )
 
+        # parsed once, for all needs of the build
+        with open(dsc) as f:
+            src = Dsc(f)
         srcpkg_files = [
-            str(Path(p).relative_to(pkg_ds.pathobj))
-            if Path(p).is_absolute() else p
-            for p in Runner().run(
-                ['dcmd', str(dsc)],
-                protocol=StdOutCapture)['stdout'].strip().split('\n')
+            str(p.relative_to(pkg_ds.pathobj)) if p.is_absolute() else str(p)
+            for p in _get_source_files(dsc, src)
         ]
 
         # TODO this could later by promoted to an option to support more than
@@ -103,23 +290,22 @@ class BuildPackage(Interface):
         cfgtype = 'singularity'
 
         # figure out which architecture we will be building for
-        binarch = Runner().run(
-            ['dpkg-architecture', '-q', 'DEB_BUILD_ARCH'],
-            protocol=StdOutCapture)['stdout'].strip()
+        binarch = get_build_arch()
 
         buildenv_name = f"{cfgtype}-{binarch}"
 
         # needed, even when no `update_builder` is intended because we want to
         # establish a cache dir inside the build dataset
         # (at least for now)
-        yield from pkg_ds.get(
-            'builder',
-            get_data=False,
-            result_renderer='disabled',
-            return_type='generator',
-            # leave flow-control to caller
-            on_failure='ignore',
-        )
+        if not Dataset(pkg_ds.pathobj / 'builder').is_installed():
+            yield from pkg_ds.get(
+                'builder',
+                get_data=False,
+                result_renderer='disabled',
+                return_type='generator',
+                # leave flow-control to caller
+                on_failure='ignore',
+            )
 
         # optionally pull in the latest builder updates
         if update_builder:
@@ -143,25 +329,39 @@ class BuildPackage(Interface):
                 on_failure='ignore',
             )
 
+        if not rebuild:
+            cached = _get_cached_build(pkg_ds, dsc, binarch)
+            if cached:
+                yield get_status_dict(
+                    action='deb_build_package',
+                    status='notneeded',
+                    path=cached['changes'],
+                    type='file',
+                    message=(
+                        "%s was built with this builder already, see %s",
+                        dsc.name, cached['build_log']),
+                    ds=pkg_ds,
+                    **cached)
+                return
+
         # TODO this should really be the task of a shim that
         # establishes the conditions for the singularity image to
         # function, and it should be registered with `containers-run`
         # making all of this obsolete
-        for p in (
-                pkg_ds.pathobj / 'builder' / 'cache' / 'var' / 'cache' / 'apt',
-                pkg_ds.pathobj / 'builder' / 'cache' / 'var' / 'lib' / 'apt'):
-            p.mkdir(exist_ok=True, parents=True)
+        apt_cache = apt_cache or pkg_ds.config.get('datalad.debian.apt-cache')
+        _setup_apt_cache(
+            pkg_ds.pathobj / 'builder' / 'cache',
+            pkg_ds.pathobj / Path(apt_cache).expanduser() if apt_cache
+            else None)
+        if keep_overlays > 0:
+            # the container variant that runs on top of builder/cache/overlay
+            buildenv_name = f"{buildenv_name}-overlay"
 
         # users might have forgotten to bootstrap the builder. Downstream, this
         # would result in no containers being found. We fail early & informative
         cname = f"builder/{buildenv_name}"
-        known_containers = pkg_ds.containers_list(
-            recursive=True,
-            result_renderer='disabled',
-            return_type='list',
-            on_failure='ignore'
-        )
-        if cname not in [c['name'] for c in known_containers]:
+        if buildenv_name not in _get_builder_containers(
+                pkg_ds.pathobj / 'builder'):
             yield dict(
                 action='deb_build_package',
                 status='impossible',
@@ -174,34 +374,556 @@ class BuildPackage(Interface):
             )
             return
 
-        build_log = None
-        for r in pkg_ds.containers_run(
-            # needs to go in relative, because it is interpreted inside the
-            # (containerized) buildenv
-            dsc.relative_to(pkg_ds.pathobj) if dsc.is_absolute() else dsc,
-            container_name=cname,
-            message=f"Build {dsc.name} for {binarch}",
-            inputs=srcpkg_files,
-            # we do not need to declare outputs,
-            # the debian tooling can handle existing files
-            #output=
-            result_renderer='disabled',
-            return_type='generator',
-            on_failure='ignore',
-        ):
-            # find the logfile
-            if result_matches(r, **dict(status='ok', action='add', type='file',
-                                        refds=pkg_ds.pathobj.as_posix())) and \
-                    r['path'].startswith(r['refds'] + "/logs"):
-                build_log = r['path']
-            yield r
+        overlay = _setup_build_overlay(
+            pkg_ds.pathobj / 'builder' / 'cache',
+            Dataset(pkg_ds.pathobj / 'builder').repo.get_hexsha(),
+            src,
+            keep_overlays)
+        if overlay:
+            yield get_status_dict(
+                action='deb_build_package.overlay',
+                status='ok',
+                ds=pkg_ds,
+                message=('Build environment overlay %s (%s)',
+                         overlay['overlay'], overlay['origin']),
+                **overlay)
+
+        # options of the build are passed to the runscript as name=value
+        build_opts = []
+        ccache = ccache or pkg_ds.config.get('datalad.debian.ccache')
+        if ccache:
+            (pkg_ds.pathobj / 'builder' / 'cache' / 'ccache').mkdir(
+                parents=True, exist_ok=True)
+            build_opts.append(f'ccache={ccache}')
+
+        with _build_workspace(
+                pkg_ds.pathobj / 'builder' / 'cache',
+                pkg_ds.config.get('datalad.debian.build-workspace'),
+                _get_source_size(dsc, src),
+                tmpfs_size * 1024 ** 2,
+        ) as workspace:
+            if workspace:
+                yield get_status_dict(
+                    action='deb_build_package.workspace',
+                    status='ok',
+                    ds=pkg_ds,
+                    message=('Building in %s workspace %s',
+                             workspace['workspace'], workspace['path']),
+                    **workspace)
+            with _allocate_cpus(build_cpus) as cpus, ExitStack() as stack:
+                proxy = None
+                if apt_proxy:
+                    try:
+                        proxy = stack.enter_context(running_apt_proxy(
+                            pkg_ds.pathobj / Path(apt_proxy).expanduser(),
+                            apt_proxy_size * 1024 ** 2))
+                    except RuntimeError as e:
+                        # another proxy serves the builds of this process
+                        yield get_status_dict(
+                            action='deb_build_package',
+                            status='impossible',
+                            ds=pkg_ds,
+                            path=str(dsc),
+                            message=str(e),
+                        )
+                        return
+                if cpus:
+                    lgr.info('Building %s with %i CPU core(s)', dsc.name, cpus)
+                    build_opts.append(f'parallel={cpus}')
+                build_log = None
+                for r in pkg_ds.containers_run(
+                    # needs to go in relative, because it is interpreted inside the
+                    # (containerized) buildenv
+                    [str(dsc.relative_to(pkg_ds.pathobj) if dsc.is_absolute()
+                         else dsc)] + build_opts,
+                    container_name=cname,
+                    message=f"Build {dsc.name} for {binarch}",
+                    inputs=srcpkg_files,
+                    # we do not need to declare outputs,
+                    # the debian tooling can handle existing files
+                    #output=
+                    result_renderer='disabled',
+                    return_type='generator',
+                    on_failure='ignore',
+                ):
+                    # find the logfile
+                    if result_matches(r, **dict(status='ok', action='add', type='file',
+                                                refds=pkg_ds.pathobj.as_posix())) and \
+                            r['path'].startswith(r['refds'] + "/logs"):
+                        build_log = r['path']
+                    yield r
+                if proxy:
+                    # the proxy may be shared by concurrent builds, whose
+                    # requests cannot be told apart from those of this build
+                    proxy_stats = proxy.get_stats()
+                    yield get_status_dict(
+                        action='deb_build_package.apt_proxy',
+                        status='ok',
+                        ds=pkg_ds,
+                        message=(
+                            'APT proxy (all builds using it): %i hit(s), '
+                            '%i miss(es), %i uncached',
+                            proxy_stats['hits'], proxy_stats['misses'],
+                            proxy_stats['passed']),
+                        **proxy_stats)
 
         if build_log:
+            log = Path(build_log).read_text()
+            ccache_stats = _get_ccache_stats(log) if ccache else None
+            if ccache_stats:
+                yield get_status_dict(
+                    action='deb_build_package.ccache',
+                    status='ok',
+                    ds=pkg_ds,
+                    path=build_log,
+                    message=(
+                        'ccache: %i hit(s), %i miss(es)',
+                        ccache_stats['hits'], ccache_stats['misses']),
+                    **ccache_stats)
+            phases = _get_build_phases(log)
+            if phases:
+                sidecar = Path(build_log).with_suffix('.json')
+                sidecar.write_text(json.dumps(dict(
+                    dsc=dsc.name,
+                    arch=binarch,
+                    phases=phases,
+                ), indent=2))
+                yield from pkg_ds.save(
+                    sidecar,
+                    message=f"Add build phase timings of {dsc.name}",
+                    result_renderer='disabled',
+                    return_type='generator',
+                    on_failure='ignore',
+                )
+                durations = {p['phase']: p['duration'] for p in phases}
+                yield get_status_dict(
+                    action='deb_build_package.phases',
+                    status='ok',
+                    ds=pkg_ds,
+                    path=str(sidecar),
+                    type='file',
+                    message=(
+                        'Build phases: %s', ', '.join(
+                            f'{k} {v:.0f}s' for k, v in durations.items())),
+                    phases=durations,
+                    duration=sum(durations.values()),
+                )
             # check for success marker from singularity runscript
-            lines = Path(build_log).read_text().splitlines()[-3:]
+            lines = log.splitlines()[-3:]
             if "# datalad-debian: build succeeded" not in lines:
                 yield get_status_dict(
                     action='deb_build_package',
                     status='error',
                     message=f"Build failed. Check {build_log} for details.",
                     ds=pkg_ds)
+
+
+def _setup_apt_cache(cache, shared=None):
+    """Establish the APT cache directories that are bound into a builder
+
+    Parameters
+    ----------
+    cache: Path
+      Cache directory of a builder.
+    shared: Path, optional
+      Shared cache directory. If given, the APT directories in `cache` are
+      symlinks to their counterparts in this directory.
+    """
+    for apt_dir in (Path('var', 'cache', 'apt'), Path('var', 'lib', 'apt')):
+        p = cache / apt_dir
+        if shared is None:
+            if p.is_symlink():
+                p.unlink()
+            p.mkdir(exist_ok=True, parents=True)
+            continue
+        target = shared / apt_dir
+        target.mkdir(exist_ok=True, parents=True)
+        if p.is_symlink() and p.resolve() == target.resolve():
+            continue
+        if p.is_symlink():
+            p.unlink()
+        elif p.exists():
+            # nothing but a cache, replaced by the shared one
+            lgr.debug('Replacing builder APT cache %s with %s', p, target)
+            shutil.rmtree(p)
+        p.parent.mkdir(exist_ok=True, parents=True)
+        p.symlink_to(target.resolve())
+
+
+def _get_cached_build(pkg_ds, dsc, binarch):
+    """Report a recorded build of a .dsc with the present builder
+
+    A build is identified by the .changes file it created. It matches, if
+    the .dsc file and the 'builder' subdataset recorded with it are
+    identical to their present state.
+
+    Returns
+    -------
+    dict or None
+      With the 'changes' file, the 'build_log', and all 'artifacts' of the
+      build, and the build 'commit'.
+    """
+    repo = pkg_ds.repo
+    dsc = dsc.relative_to(pkg_ds.pathobj) if dsc.is_absolute() else dsc
+    changes = dsc.with_name(f'{dsc.stem}_{binarch}.changes')
+    build_commit = repo.call_git(
+        ['log', '-1', '--format=%H', '--', str(changes)],
+        read_only=True).strip()
+    if not build_commit:
+        return None
+    builder = pkg_ds.pathobj / 'builder'
+    builder_repo = Dataset(builder).repo
+    if builder_repo is None:
+        return None
+
+    def _recorded(ref, path):
+        try:
+            return repo.call_git_oneline(
+                ['rev-parse', f'{ref}:{path}'], read_only=True)
+        except CommandError:
+            return None
+
+    if _recorded(build_commit, dsc.as_posix()) != _recorded(
+            'HEAD', dsc.as_posix()) \
+            or _recorded(build_commit, 'builder') != builder_repo.get_hexsha():
+        return None
+    artifacts = [
+        pkg_ds.pathobj / p
+        for p in repo.call_git_items_(
+            ['diff-tree', '--no-commit-id', '--name-only', '-r',
+             build_commit],
+            read_only=True)
+    ]
+    build_log = [
+        p for p in artifacts if p.parent == pkg_ds.pathobj / 'logs']
+    return dict(
+        changes=str(pkg_ds.pathobj / changes),
+        build_log=str(build_log[0]) if build_log else None,
+        artifacts=[str(p) for p in artifacts],
+        commit=build_commit,
+    )
+
+
+def _get_source_files(dsc, src):
+    """Report all files of a source package, like `dcmd` does
+
+    Parameters
+    ----------
+    dsc: Path
+    src: Dsc
+      The parsed `dsc`.
+    """
+    return [dsc] + [dsc.parent / f['name'] for f in src.get('Files', [])]
+
+
+def _get_builder_containers(builder):
+    """Report the names of the containers registered in a builder dataset
+
+    The names are read from the dataset configuration file, rather than
+    queried from Git.
+    """
+    cfg = builder / '.datalad' / 'config'
+    if not cfg.exists():
+        return set()
+    return set(re.findall(
+        r'^\s*\[datalad\s+"containers\.([^"]+)"\]', cfg.read_text(),
+        flags=re.MULTILINE))
+
+
+def _get_build_deps_hash(src):
+    """Hash the build-dependency declarations of a parsed source package"""
+    decl = ''.join(
+        f"{field}: {' '.join(src[field].split())}\n"
+        for field in build_deps_fields if field in src)
+    return hashlib.sha256(decl.encode()).hexdigest()[:16]
+
+
+def _setup_build_overlay(cache, builder_state, src, keep):
+    """Establish the writable overlay of a build environment for a build
+
+    The overlay is the directory 'overlay' in the cache directory of a
+    builder, which the call format of the overlay container of a
+    bootstrapped builder binds.
+
+    Parameters
+    ----------
+    cache: Path
+      Cache directory of a builder.
+    builder_state: str
+      Commit of the builder dataset. Overlays are only used with the build
+      environment they were made with.
+    src: Dsc
+      Parsed .dsc file of the source package to build.
+    keep: int
+      Number of overlays to keep. If 0, no overlay is used, and any
+      previous one is removed.
+
+    Returns
+    -------
+    dict or None
+      With the name of the 'overlay', and its 'origin': 'reused' for an
+      overlay with the same build-dependencies, 'copied' for a copy of the
+      most recently used one, or 'new'. None if no overlays are kept.
+    """
+    overlay = cache / 'overlay'
+    if overlay.is_symlink():
+        overlay.unlink()
+    elif overlay.exists():
+        shutil.rmtree(overlay)
+    if keep < 1:
+        return None
+
+    overlays = cache / 'overlays'
+    overlays.mkdir(parents=True, exist_ok=True)
+    prefix = f'{builder_state[:12]}-'
+    name = prefix + _get_build_deps_hash(src)
+    target = overlays / name
+    if target.exists():
+        origin = 'reused'
+    else:
+        candidates = sorted(
+            (p for p in overlays.iterdir()
+             if p.name.startswith(prefix) and p.is_dir()),
+            key=lambda p: p.stat().st_mtime)
+        if candidates:
+            # a partial copy must not be mistaken for an overlay
+            tmp = overlays / f'.{name}'
+            if tmp.exists():
+                shutil.rmtree(tmp)
+            # overlays contain special files (e.g. whiteouts), hence cp
+            Runner().run(
+                ['cp', '-a', '--reflink=auto', str(candidates[-1]), str(tmp)],
+                protocol=StdOutCapture)
+            tmp.rename(target)
+            origin = 'copied'
+        else:
+            target.mkdir()
+            origin = 'new'
+    # the modification time tracks the last use
+    os.utime(target)
+    overlay.symlink_to(target.resolve())
+
+    for p in sorted(
+            (p for p in overlays.iterdir()
+             if p.is_dir() and not p.name.startswith('.')),
+            key=lambda p: p.stat().st_mtime)[:-keep]:
+        if p == target:
+            continue
+        lgr.debug('Removing build environment overlay %s', p)
+        shutil.rmtree(p)
+    return dict(overlay=name, origin=origin)
+
+
+def _get_source_size(dsc, src):
+    """Report the size of all files of a source package, in bytes
+
+    Parameters
+    ----------
+    dsc: Path
+    src: Dsc
+      The parsed `dsc`.
+    """
+    return Path(dsc).stat().st_size + sum(
+        int(f['size']) for f in src.get('Files', []))
+
+
+@contextmanager
+def _build_workspace(cache, workspace, size, tmpfs_size):
+    """Provide a directory on the host for a build to take place in
+
+    The directory is bound into the build environment via the symlink
+    'workspace' in the cache directory of a builder. It contains a marker
+    file that makes a build use it, instead of a directory inside the
+    container. The symlink is replaced by each build with the same builder,
+    concurrent builds with one builder are not supported.
+
+    Space on the tmpfs is reserved per process. Concurrent builds in other
+    processes are only noticed via the free space left on the tmpfs, once
+    they have written to it.
+
+    Parameters
+    ----------
+    cache: Path
+      Cache directory of a builder.
+    workspace: str or None
+      'tmpfs', or a directory to create workspaces in. If None, no
+      workspace is provided.
+    size: int
+      Size of the source package, in bytes.
+    tmpfs_size: int
+      Limit of the space of all tmpfs workspaces, in bytes.
+
+    Yields
+    ------
+    dict or None
+      With the kind of 'workspace' ('tmpfs', 'scratch', or 'default', if
+      a tmpfs workspace was requested, but the build does not fit), and
+      its 'path' on the host.
+    """
+    global _tmpfs_reserved
+    link = cache / 'workspace'
+    if link.is_symlink():
+        link.unlink()
+    elif link.exists():
+        shutil.rmtree(link)
+    link.mkdir(parents=True)
+    if not workspace:
+        yield None
+        return
+
+    needed = size * workspace_size_factor
+    reserved = 0
+    if workspace == 'tmpfs':
+        base = tmpfs_path
+        with _tmpfs_lock:
+            free = shutil.disk_usage(base).free
+            if _tmpfs_reserved + needed <= min(
+                    tmpfs_size, _tmpfs_reserved + free):
+                reserved = needed
+                _tmpfs_reserved += reserved
+        if not reserved:
+            lgr.debug('Build of %i bytes does not fit into %s, using the '
+                      'default workspace', needed, base)
+            yield dict(workspace='default', path=None, size=needed)
+            return
+    else:
+        base = Path(workspace).expanduser()
+        base.mkdir(parents=True, exist_ok=True)
+    path = Path(tempfile.mkdtemp(prefix='datalad-debian-', dir=base))
+    try:
+        (path / '.datalad-debian-workspace').touch()
+        link.rmdir()
+        link.symlink_to(path.resolve())
+        yield dict(
+            workspace='tmpfs' if reserved else 'scratch',
+            path=str(path),
+            size=needed)
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+        if link.is_symlink():
+            link.unlink()
+            link.mkdir()
+        with _tmpfs_lock:
+            _tmpfs_reserved -= reserved
+
+
+def _get_ccache_stats(log):
+    """Read the ccache statistics of a build from its log
+
+    Returns
+    -------
+    dict or None
+      With the number of cache 'hits' and 'misses', and all 'counters' as
+      reported by `ccache --print-stats`. None if the log has no (readable)
+      statistics.
+    """
+    lines = iter(log.splitlines())
+    for line in lines:
+        if line == '# ccache statistics':
+            break
+    else:
+        return None
+    counters = {}
+    for line in lines:
+        if line.startswith('#'):
+            continue
+        if '\t' not in line:
+            if counters:
+                break
+            continue
+        k, v = line.split('\t', 1)
+        if v.isdigit():
+            counters[k] = int(v)
+    if not counters:
+        return None
+    return dict(
+        hits=counters.get('direct_cache_hit', 0)
+        + counters.get('preprocessed_cache_hit', 0),
+        misses=counters.get('cache_miss', 0),
+        counters=counters,
+    )
+
+
+def _get_cpu_count():
+    """Report the number of CPU cores this process can run on"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        # not on all platforms
+        return os.cpu_count() or 1
+
+
+@contextmanager
+def expecting_builds(n):
+    """Announce a number of builds that will run concurrently
+
+    CPU cores are shared among as many builds, when they are allocated,
+    even when not all of them run yet.
+    """
+    global _builds_expected
+    with _cpu_lock:
+        _builds_expected += n
+    try:
+        yield
+    finally:
+        with _cpu_lock:
+            _builds_expected -= n
+
+
+@contextmanager
+def _allocate_cpus(cpus):
+    """Allocate CPU cores to a build
+
+    Parameters
+    ----------
+    cpus: int
+      Number of CPU cores available to all concurrent builds. If 0, no
+      cores are allocated.
+
+    Yields
+    ------
+    int or None
+      Number of CPU cores for the build.
+    """
+    global _cpus_allocated, _builds_running
+    if cpus < 1:
+        yield None
+        return
+    with _cpu_lock:
+        _builds_running += 1
+        share = cpus // max(_builds_running, _builds_expected)
+        n = max(1, min(share, cpus - _cpus_allocated))
+        _cpus_allocated += n
+    try:
+        yield n
+    finally:
+        with _cpu_lock:
+            _builds_running -= 1
+            _cpus_allocated -= n
+
+
+def _get_build_phases(log):
+    """Read the phases of a build, and their durations, from its log
+
+    Returns
+    -------
+    list
+      Of dicts with the 'phase', the 'marker' in the log, its 'start' and
+      'end' time, and the 'duration' in seconds, in the order of the build.
+      A build that failed ends with the phase it failed in.
+    """
+    markers = [
+        (m['marker'], datetime.fromisoformat(m['time']))
+        for m in build_phase_marker_regex.finditer(log)
+    ]
+    return [
+        dict(
+            phase=build_phase_markers.get(marker, marker),
+            marker=marker,
+            start=start.isoformat(),
+            end=end.isoformat(),
+            duration=(end - start).total_seconds(),
+        )
+        for (marker, start), (_, end) in zip(markers, markers[1:])
+        if build_phase_markers.get(marker, marker) is not None
+    ]
@@ -0,0 +1,337 @@
+import logging
+from contextlib import ExitStack
+from functools import partial
+from pathlib import Path
+
+from debian.debian_support import Version
+
+from datalad.distribution.dataset import (
+    Dataset,
+    EnsureDataset,
+    datasetmethod,
+    require_dataset,
+    resolve_path,
+)
+from datalad.interface.base import (
+    Interface,
+    build_doc,
+)
+from datalad.interface.common_opts import jobs_opt
+from datalad.interface.results import get_status_dict
+from datalad.interface.utils import (
+    eval_results,
+)
+from datalad.support.constraints import (
+    EnsureNone,
+    EnsureStr,
+)
+from datalad.support.parallel import ProducerConsumer
+from datalad.support.param import Parameter
+
+from datalad_debian.apt_proxy import running_apt_proxy
+from datalad_debian.archive_lag import parse_package_filename
+from datalad_debian.build_package import (
+    BuildPackage,
+    expecting_builds,
+)
+from datalad_debian.utils import get_config_int
+
+lgr = logging.getLogger('datalad.debian.build_packages')
+
+# what the status of a 'build_packages' result means for a build
+build_outcomes = dict(ok='succeeded', notneeded='skipped', error='failed')
+
+
+@build_doc
+class BuildPackages(Interface):
+    """Build binary packages for many source packages concurrently
+
+    Runs [CMD: deb-build-package CMD][PY: deb_build_package PY] for source
+    packages of a distribution dataset, with up to [CMD: --jobs CMD][PY:
+    `jobs` PY] builds at a time. Results are reported as they come in, and
+    each build ends with a 'build_packages' result for its .dsc file.
+
+    The builds can be given as package datasets, or as .dsc files in
+    package datasets. For a package dataset, the source package with the
+    highest version is built. Without any, the latest source package of
+    every package dataset of the distribution is built. Each build runs in
+    its own package dataset, and the package datasets are saved in the
+    distribution dataset once all builds are done. Several source packages
+    of the same package dataset are built one after another, because their
+    builds share the package dataset and its build caches.
+
+    Builds that were made with the present builder already are skipped
+    (unless [CMD: --rebuild CMD][PY: `rebuild` PY] is given), hence after a
+    builder update only packages built with a previous builder are rebuilt.
+
+    All builds share the APT cache given with [CMD: --apt-cache CMD][PY:
+    `apt_cache` PY], or configured with 'datalad.debian.apt-cache' in the
+    distribution dataset, see [CMD: deb-build-package CMD][PY:
+    deb_build_package PY]. Likewise, all builds use a single caching APT
+    proxy, if one is given with [CMD: --apt-proxy CMD][PY: `apt_proxy` PY]
+    or configured with 'datalad.debian.apt-proxy'. Its overall hits and
+    misses are reported with the final result. With [CMD: --ccache CMD][PY:
+    `ccache` PY] (or the configuration 'datalad.debian.ccache'), each
+    package keeps a ccache across its builds. The CPU cores of the host are
+    shared among the concurrent builds, see [CMD: deb-build-package CMD][PY:
+    deb_build_package PY]. The final result reports how much time all builds
+    took in each of their phases.
+    """
+    _params_ = dict(
+        dataset=Parameter(
+            args=("-d", "--dataset"),
+            doc="""specify the distribution dataset with the packages to
+            build""",
+            constraints=EnsureDataset() | EnsureNone()),
+        path=Parameter(
+            args=("path",),
+            nargs='*',
+            metavar='PATH',
+            doc="""package dataset or .dsc file to build. If none is
+            given, all package datasets of the distribution are built""",
+            constraints=EnsureStr() | EnsureNone()),
+        jobs=jobs_opt,
+        update_builder=Parameter(
+            args=("--update-builder",),
+            doc="""Update the builder subdataset of each package dataset
+            from its origin before the build""",
+            action='store_true'),
+        rebuild=Parameter(
+            args=("--rebuild",),
+            doc="""build even if a package dataset records a build of the
+            same source package with the same builder already""",
+            action='store_true'),
+        apt_cache=Parameter(
+            args=("--apt-cache",),
+            metavar='PATH',
+            doc="""directory with an APT cache to share by all builds. A
+            relative path is interpreted relative to the distribution
+            dataset. Defaults to the configuration
+            'datalad.debian.apt-cache'""",
+            constraints=EnsureStr() | EnsureNone()),
+        apt_proxy=Parameter(
+            args=("--apt-proxy",),
+            metavar='PATH',
+            doc="""directory to keep package files of a caching APT proxy,
+            used by all builds, in. A relative path is interpreted relative
+            to the distribution dataset. Defaults to the configuration
+            'datalad.debian.apt-proxy'""",
+            constraints=EnsureStr() | EnsureNone()),
+        ccache=Parameter(
+            args=("--ccache",),
+            metavar='SIZE',
+            doc="""compile with ccache, keeping a cache of up to this size
+            (e.g., '5G') for each package. Defaults to the configuration
+            'datalad.debian.ccache'""",
+            constraints=EnsureStr() | EnsureNone()),
+    )
+
+    _examples_ = [
+        dict(text="Rebuild all packages of a distribution, with 16 "
+                  "concurrent builds",
+             code_cmd="datalad deb-build-packages -J 16",
+             code_py="deb_build_packages(jobs=16)"),
+        dict(text="Build two particular source packages",
+             code_cmd="datalad deb-build-packages "
+                      "packages/hello/hello_2.10-2.dsc packages/tqdm",
+             code_py="deb_build_packages(["
+                     "'packages/hello/hello_2.10-2.dsc', 'packages/tqdm'])"),
+    ]
+
+    @staticmethod
+    @datasetmethod(name='deb_build_packages')
+    @eval_results
+    def __call__(path=None, *, dataset=None, jobs='auto',
+                 update_builder=False, rebuild=False, apt_cache=None,
+                 apt_proxy=None, ccache=None):
+        dist_ds = require_dataset(dataset)
+        apt_cache = apt_cache or dist_ds.config.get('datalad.debian.apt-cache')
+        if apt_cache:
+            apt_cache = str(dist_ds.pathobj / Path(apt_cache).expanduser())
+        apt_proxy = apt_proxy or dist_ds.config.get('datalad.debian.apt-proxy')
+        if apt_proxy:
+            apt_proxy = str(dist_ds.pathobj / Path(apt_proxy).expanduser())
+            apt_proxy_size = yield from get_config_int(
+                dist_ds, 'datalad.debian.apt-proxy-size', 10240,
+                'build_packages', minimum=1)
+            if apt_proxy_size is None:
+                return
+        ccache = ccache or dist_ds.config.get('datalad.debian.ccache')
+        packages = dist_ds.pathobj / 'packages'
+        if not path:
+            pkg_paths = [
+                Path(r['path']) for r in dist_ds.subdatasets(
+                    path=packages,
+                    result_renderer='disabled',
+                    return_type='generator',
+                    on_failure='ignore')
+                if r.get('status') == 'ok'
+                and Path(r['path']).parent == packages
+            ]
+            requested = [(p, None) for p in pkg_paths]
+        else:
+            requested = []
+            for p in path:
+                p = resolve_path(p, dist_ds)
+                if packages not in p.parents:
+                    yield get_status_dict(
+                        action='build_packages',
+                        status='impossible',
+                        ds=dist_ds,
+                        path=str(p),
+                        message=('%s is not in a package dataset of %s',
+                                 p, dist_ds),
+                    )
+                    continue
+                pkg_path = packages / p.relative_to(packages).parts[0]
+                requested.append((pkg_path, p if p != pkg_path else None))
+        if not requested:
+            return
+
+        # all package datasets are installed up front, installing them
+        # from concurrent builds would modify the distribution dataset
+        # concurrently
+        yield from dist_ds.get(
+            sorted({str(p) for p, _ in requested}),
+            get_data=False,
+            jobs=jobs,
+            result_renderer='disabled',
+            return_type='generator',
+            on_failure='ignore',
+        )
+        # .dsc files to build, by package dataset
+        builds = {}
+        for pkg_path, dsc in requested:
+            dsc = dsc or _get_latest_dsc(Dataset(pkg_path))
+            if dsc is None:
+                yield get_status_dict(
+                    action='build_packages',
+                    status='notneeded',
+                    path=str(pkg_path),
+                    type='dataset',
+                    message='No source package to build',
+                )
+                continue
+            dscs = builds.setdefault(str(pkg_path), [])
+            if str(dsc) not in dscs:
+                dscs.append(str(dsc))
+
+        counts = dict(succeeded=0, skipped=0, failed=0)
+        if ccache:
+            counts.update(ccache_hits=0, ccache_misses=0)
+        # total durations of the phases of all builds
+        phases = {}
+        # builds in the same package dataset would compete for its
+        # version control state and its build caches, each package dataset
+        # is processed by a single job. There is one proxy for all builds,
+        # rather than one per build
+        with expecting_builds(min(
+                ProducerConsumer.get_effective_jobs(jobs) or 1,
+                len(builds))), \
+                ExitStack() as stack:
+            proxy = None
+            if apt_proxy and builds:
+                try:
+                    proxy = stack.enter_context(running_apt_proxy(
+                        apt_proxy, apt_proxy_size * 1024 ** 2))
+                except RuntimeError as e:
+                    # another proxy serves the builds of this process
+                    yield get_status_dict(
+                        action='build_packages',
+                        status='impossible',
+                        ds=dist_ds,
+                        message=str(e),
+                    )
+                    return
+            for r in ProducerConsumer(
+                    [(p, tuple(dscs)) for p, dscs in builds.items()],
+                    partial(_build_packages, update_builder=update_builder,
+                            rebuild=rebuild, apt_cache=apt_cache,
+                            apt_proxy=apt_proxy, ccache=ccache),
+                    jobs=jobs):
+                if r.get('action') == 'build_packages':
+                    counts[build_outcomes[r['status']]] += 1
+                elif r.get('action') == 'deb_build_package.ccache':
+                    counts['ccache_hits'] += r['hits']
+                    counts['ccache_misses'] += r['misses']
+                elif r.get('action') == 'deb_build_package.phases':
+                    for phase, duration in r['phases'].items():
+                        phases[phase] = phases.get(phase, 0) + duration
+                yield r
+            if proxy:
+                counts.update(proxy.get_stats())
+
+        yield from dist_ds.save(
+            path=sorted(builds),
+            message=f'Build {sum(map(len, builds.values()))} package(s)',
+            result_renderer='disabled',
+            return_type='generator',
+            on_failure='ignore',
+        )
+        yield get_status_dict(
+            action='build_packages',
+            status='ok',
+            ds=dist_ds,
+            message=('%i build(s) succeeded, %i skipped, %i failed',
+                     counts['succeeded'], counts['skipped'], counts['failed']),
+            phases=phases,
+            **counts
+        )
+
+
+def _get_latest_dsc(pkg_ds):
+    """Report the .dsc file with the highest version in a package dataset"""
+    # read from the work tree, because asking Git for each of hundreds of
+    # package datasets would take longer than planning all builds otherwise
+    dscs = [
+        (Version(pkg[2]), name)
+        for name, pkg in (
+            (p.name, parse_package_filename(p.name))
+            for p in pkg_ds.pathobj.glob('*.dsc'))
+        if pkg
+    ]
+    if not dscs:
+        return None
+    return pkg_ds.pathobj / max(dscs)[1]
+
+
+def _build_packages(builds, update_builder, rebuild, apt_cache, apt_proxy,
+                    ccache):
+    """Build .dsc files of a single package dataset, one after another"""
+    pkg_path, dscs = builds
+    for dsc in dscs:
+        yield from _build_package(
+            pkg_path, dsc, update_builder, rebuild, apt_cache, apt_proxy,
+            ccache)
+
+
+def _build_package(pkg_path, dsc, update_builder, rebuild, apt_cache,
+                   apt_proxy, ccache):
+    status = 'ok'
+    for r in BuildPackage.__call__(
+            dsc,
+            dataset=pkg_path,
+            update_builder=update_builder,
+            rebuild=rebuild,
+            apt_cache=apt_cache,
+            apt_proxy=apt_proxy,
+            ccache=ccache,
+            result_renderer='disabled',
+            return_type='generator',
+            on_failure='ignore'):
+        if r.get('status') in ('error', 'impossible'):
+            status = 'error'
+        elif r.get('action') == 'deb_build_package' \
+                and r.get('status') == 'notneeded' and status == 'ok':
+            status = 'notneeded'
+        yield r
+    yield get_status_dict(
+        action='build_packages',
+        status=status,
+        path=dsc,
+        type='file',
+        message=(
+            dict(ok='Built %s', notneeded='Build of %s not needed',
+                 error='Build of %s failed')[status],
+            Path(dsc).name),
+    )
@@ -0,0 +1,199 @@
+import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import PurePosixPath
+
+from datalad.distribution.dataset import Dataset
+from datalad.interface.results import get_status_dict
+from datalad.runner import (
+    Runner,
+    StdOutErrCapture,
+)
+from datalad.support.exceptions import (
+    CapturedException,
+    CommandError,
+)
+
+from datalad_debian.archive_index import (
+    add_debdeltas,
+    get_debdeltas,
+    get_index_db_path,
+    query_index_db,
+)
+
+lgr = logging.getLogger('datalad.debian.debdeltas')
+
+# location of the deltas in the archive, with the directory layout of the
+# package pool underneath
+debdeltas_dir = 'debdeltas'
+
+
+def get_binary_files(archive_ds):
+    """Report the files of all binary packages in an archive
+
+    The information is read from the archive index, which must be up-to-date.
+
+    Returns
+    -------
+    dict
+      Mapping of (codename, package, architecture) to (version, filename).
+    """
+    return {
+        (e['codename'], e['package'], e['architecture']):
+            (e['version'], e['filename'])
+        for e in query_index_db(get_index_db_path(archive_ds), type='binary')
+        if e['filename']
+    }
+
+
+def get_debdelta_path(filename, package, old_version, new_version, arch):
+    """Location of a debdelta file, relative to the archive root
+
+    File names follow the convention of debdelta, such that clients can
+    use them with debdelta-upgrade.
+    """
+    # debdelta escapes the epoch separator in file names
+    old_version, new_version = (
+        v.replace(':', '%3a') for v in (old_version, new_version))
+    return PurePosixPath(debdeltas_dir).joinpath(
+        PurePosixPath(filename).parent,
+        f'{package}_{old_version}_{new_version}_{arch}.debdelta')
+
+
+def generate_debdeltas(archive_ds, old_files, old_ref):
+    """Generate debdeltas for all binary packages updated since `old_ref`
+
+    Deltas are generated in parallel, one debdelta process per CPU core.
+    Each pair of package files is only considered once: deltas (and the
+    decision that a delta was not worth keeping) are recorded by the annex
+    keys of both files.
+
+    Parameters
+    ----------
+    archive_ds: Dataset
+    old_files: dict
+      Binary package files before the update, as reported by
+      `get_binary_files()`.
+    old_ref: str
+      Commit of the 'www' subdataset before the update.
+
+    Yields
+    ------
+    dict
+      Result records.
+    """
+    www_ds = Dataset(archive_ds.pathobj / 'www')
+    pairs = {}
+    for k, (new_version, new_file) in get_binary_files(archive_ds).items():
+        old_version, old_file = old_files.get(k, (None, new_file))
+        if old_file == new_file:
+            continue
+        codename, package, arch = k
+        # the same pool files can be part of multiple codenames
+        pairs[(old_file, new_file)] = get_debdelta_path(
+            new_file, package, old_version, new_version, arch)
+    if not pairs:
+        return
+    if shutil.which('debdelta') is None:
+        yield get_status_dict(
+            action='update_repository.debdelta',
+            status='impossible',
+            ds=archive_ds,
+            message='Cannot generate debdeltas, debdelta is not installed',
+        )
+        return
+
+    # old files are likely gone from the pool, but not from the annex
+    old_info = www_ds.repo.get_content_annexinfo(
+        paths=sorted({PurePosixPath(o) for o, _ in pairs}), ref=old_ref,
+        eval_availability=True)
+    new_info = www_ds.repo.get_content_annexinfo(
+        paths=sorted({PurePosixPath(n) for _, n in pairs}),
+        eval_availability=True)
+    tasks = []
+    for (old_file, new_file), delta in pairs.items():
+        old_props = old_info.get(www_ds.pathobj / old_file, {})
+        new_props = new_info.get(www_ds.pathobj / new_file, {})
+        if not old_props.get('has_content') \
+                or not new_props.get('has_content'):
+            yield get_status_dict(
+                action='update_repository.debdelta',
+                status='impossible',
+                ds=www_ds,
+                path=str(www_ds.pathobj / delta),
+                type='file',
+                message=('Content of %s or %s not available locally',
+                         old_file, new_file),
+            )
+            continue
+        tasks.append((
+            (old_props['key'], new_props['key']),
+            old_props['objloc'],
+            www_ds.pathobj / new_file,
+            www_ds.pathobj / delta,
+        ))
+    db_path = get_index_db_path(archive_ds)
+    known = get_debdeltas(db_path, (t[0] for t in tasks))
+    tasks = [t for t in tasks if t[0] not in known]
+    if not tasks:
+        return
+
+    lgr.info('Generating %i debdelta(s)', len(tasks))
+    generated = []
+    with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+        for (keys, _, _, delta), error in zip(
+                tasks, executor.map(_run_debdelta, tasks)):
+            if error:
+                # not recorded, to be attempted again with the next update
+                yield get_status_dict(
+                    action='update_repository.debdelta',
+                    status='error',
+                    ds=www_ds,
+                    path=str(delta),
+                    type='file',
+                    message='debdelta failed',
+                    exception=error,
+                )
+                continue
+            # debdelta does not write a delta that is not worth it
+            exists = delta.exists()
+            generated.append((*keys, str(PurePosixPath(
+                delta.relative_to(www_ds.pathobj))) if exists else None))
+            if exists:
+                yield get_status_dict(
+                    action='update_repository.debdelta',
+                    status='ok',
+                    ds=www_ds,
+                    path=str(delta),
+                    type='file',
+                )
+    if any(g[2] for g in generated):
+        yield from www_ds.save(
+            path=debdeltas_dir,
+            message='Add debdeltas',
+            result_renderer='disabled',
+            return_type='generator',
+            on_failure='ignore',
+        )
+        yield from archive_ds.save(
+            path='www',
+            message='Add debdeltas',
+            result_renderer='disabled',
+            return_type='generator',
+            on_failure='ignore',
+        )
+    add_debdeltas(db_path, generated)
+
+
+def _run_debdelta(task):
+    _, old, new, delta = task
+    delta.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        Runner().run(
+            ['debdelta', str(old), str(new), str(delta)],
+            protocol=StdOutErrCapture,
+        )
+    except CommandError as e:
+        return CapturedException(e)
+    return None
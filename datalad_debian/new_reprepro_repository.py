@@ -13,6 +13,7 @@ from datalad.interface.utils import (
     eval_results,
 )
 from datalad.support.constraints import (
+    EnsureChoice,
     EnsureNone,
     EnsureStr,
 )
@@ -36,6 +37,15 @@ ckwa = dict(
 @build_doc
 class NewRepreproRepository(Interface):
     """Create a new (reprepro) package repository dataset
+
+    By default, a single reprepro instance (configuration in ``conf/``,
+    database in ``db/``) maintains all distributions (codenames) of the
+    archive. With the 'per-codename' layout, a separate reprepro instance is
+    maintained for each codename underneath ``shards/<codename>/``. Their
+    configuration is derived from the configuration in ``conf/``
+    automatically. All instances publish into the same package pool, and
+    [CMD: deb-update-reprepro-repository CMD][PY: deb_update_reprepro_repository
+    PY] imports into different codenames in parallel.
     """
     _params_ = dict(
         dataset=Parameter(
@@ -60,14 +70,27 @@ class NewRepreproRepository(Interface):
             args=("-f", "--force",),
             doc="""enforce creation of a dataset in a non-empty directory""",
             action='store_true'),
+        layout=Parameter(
+            args=("--layout",),
+            doc="""archive layout. 'single' uses one reprepro instance for
+            all codenames, 'per-codename' one instance per codename with a
+            shared package pool""",
+            constraints=EnsureChoice('single', 'per-codename')),
     )
 
-    _examples_ = []
+    _examples_ = [
+        dict(text="Create a repository dataset with one reprepro instance "
+                  "per codename",
+             code_cmd="datalad deb-new-reprepro-repository "
+                      "--layout per-codename myarchive",
+             code_py="deb_new_reprepro_repository('myarchive', "
+                     "layout='per-codename')"),
+    ]
 
     @staticmethod
     @datasetmethod(name='deb_new_reprepro_repository')
     @eval_results
-    def __call__(path=None, *, dataset=None, force=False):
+    def __call__(path=None, *, dataset=None, force=False, layout='single'):
         reprepro_ds = None
         archive_ds = None
 
@@ -112,17 +135,19 @@ class NewRepreproRepository(Interface):
             lgr.debug('Archive dataset did not materialize, stopping')
             return
 
-        yield from _setup_reprepro_ds(reprepro_ds)
+        yield from _setup_reprepro_ds(reprepro_ds, layout)
 
 
-def _setup_reprepro_ds(ds):
+def _setup_reprepro_ds(ds, layout='single'):
     repo = ds.repo
+    sharded = layout == 'per-codename'
     # destination for the reprepro config
     (ds.pathobj / 'conf').mkdir()
     # we want the config and documentation to be in git
     repo.call_annex([
         'config', '--set', 'annex.largefiles',
-        'exclude=conf/* and exclude=README and exclude=*/README'])
+        'exclude=conf/* and exclude=README and exclude=*/README'
+        + (' and exclude=shards/*/conf/*' if sharded else '')])
     # establish basic config for repository and reprepro behavior
     (ds.pathobj / 'conf' / 'options').write_text(conf_opts_tmpl)
     # the DB files written and read by reprepro need special handling
@@ -131,15 +156,24 @@ def _setup_reprepro_ds(ds):
     # cannot fully ignore them: make sure the anything in db/ is tracked
     # but always unlocked
     repo.call_annex([
-        'config', '--set', 'annex.addunlocked', 'include=db/*'])
+        'config', '--set', 'annex.addunlocked',
+        'include=db/*' + (' or include=shards/*/db/*' if sharded else '')])
 
     main_readme = ds.pathobj / 'README'
     main_readme.write_text(superdataset_readme)
     dist_readme = ds.pathobj / 'distributions' / 'README'
     dist_readme.parent.mkdir(parents=True, exist_ok=True)
     dist_readme.write_text(dist_subds_readme)
+    to_save = ['conf', main_readme, dist_readme]
+    if sharded:
+        ds.config.set(
+            'datalad.debian.archive-layout', layout, scope='branch')
+        shards_readme = ds.pathobj / 'shards' / 'README'
+        shards_readme.parent.mkdir()
+        shards_readme.write_text(shards_readme_text)
+        to_save.extend([ds.pathobj / '.datalad' / 'config', shards_readme])
     yield from ds.save(
-        path=['conf', main_readme, dist_readme],
+        path=to_save,
         message='Basic reprepro setup',
         **ckwa
     )
@@ -175,6 +209,14 @@ Distribution datasets with packages to be included in the package
 repository are placed into this directory as subdatasets.
 """
 
+shards_readme_text = """\
+This package repository dataset maintains a separate reprepro instance
+for each distribution codename, in a subdirectory named after the
+codename. Their configuration is generated from the configuration in
+conf/ and must not be edited here. All instances publish into the same
+package pool in www/.
+"""
+
 superdataset_readme = """\
 This package repository dataset has been created with datalad-debian
 [1], a DataLad [2] extension for creating and disseminating Debian
@@ -0,0 +1,277 @@
+import json
+import logging
+import os
+import shutil
+from pathlib import (
+    Path,
+    PurePosixPath,
+)
+
+from datalad.distribution.dataset import (
+    Dataset,
+    EnsureDataset,
+    datasetmethod,
+    require_dataset,
+)
+from datalad.interface.base import (
+    Interface,
+    build_doc,
+)
+from datalad.interface.common_opts import jobs_opt
+from datalad.interface.results import get_status_dict
+from datalad.interface.utils import (
+    eval_results,
+)
+from datalad.support.constraints import (
+    EnsureNone,
+    EnsureStr,
+)
+from datalad.support.param import Parameter
+
+lgr = logging.getLogger('datalad.debian.publish_archive')
+
+
+# name of the record of the last published state in the target directory
+manifest_name = '.datalad-debian-publish.json'
+
+# files that make a new state of a distribution visible to clients.
+# they are published last, in this order: a detached signature goes out
+# before the Release file it signs, a client never sees a new Release file
+# with an old signature
+release_file_names = ('Release.gpg', 'Release', 'InRelease')
+
+
+@build_doc
+class PublishArchive(Interface):
+    """Publish a Debian archive to a (static) web server directory
+
+    The content of the 'www' subdataset of a Debian archive repository
+    dataset is copied to a target directory, for example, the document root of
+    a web server. A manifest of the published state (path, size, and checksum
+    of each file) is kept in the target directory, and only files that changed
+    since the last publication are copied. Files that are no longer part of the
+    archive are removed from the target directory.
+
+    To never present a torn state to APT clients, files are published in a
+    fixed order: package pool files first, then the package indices, and
+    release files last (Release.gpg before the Release file it signs, then
+    InRelease). Removals happen at the very end. If any file of a stage
+    cannot be published, the publication stops before the next stage, and
+    nothing is removed. A release file that cannot be published stops the
+    publication right away.
+
+    Checksums are taken from the version control records of the 'www' dataset,
+    hence no file content needs to be read to determine what changed, and the
+    duration of a publication scales with the amount of changes.
+    """
+    _params_ = dict(
+        dataset=Parameter(
+            args=("-d", "--dataset"),
+            doc="""specify the Debian archive repository dataset to
+            publish""",
+            constraints=EnsureDataset() | EnsureNone()),
+        target=Parameter(
+            args=("target",),
+            metavar='TARGET',
+            doc="""path of the directory to publish the archive to. It will
+            be created, if it does not exist yet""",
+            constraints=EnsureStr()),
+        jobs=jobs_opt,
+    )
+
+    _examples_ = [
+        dict(text="Publish an archive to the document root of a web server",
+             code_cmd="datalad deb-publish-archive /var/www/html/debian",
+             code_py="deb_publish_archive('/var/www/html/debian')"),
+    ]
+
+    @staticmethod
+    @datasetmethod(name='deb_publish_archive')
+    @eval_results
+    def __call__(target, *, dataset=None, jobs='auto'):
+        archive_ds = require_dataset(dataset)
+        www_ds = Dataset(archive_ds.pathobj / 'www')
+        if not www_ds.is_installed():
+            yield get_status_dict(
+                action='publish_archive',
+                status='impossible',
+                ds=archive_ds,
+                message=('No archive dataset installed at %s', www_ds.path),
+            )
+            return
+
+        target = Path(target)
+        target.mkdir(parents=True, exist_ok=True)
+        manifest_path = target / manifest_name
+        manifest = json.loads(manifest_path.read_text()) \
+            if manifest_path.exists() else {}
+
+        current = _get_archive_state(www_ds)
+
+        changed = [
+            p for p, props in current.items()
+            if manifest.get(p, {}).get('checksum') != props['checksum']
+            # the target copy might have been modified or removed
+            # behind our back
+            or not _matches_manifest(target / p, manifest[p])
+        ]
+        removed = [p for p in manifest if p not in current]
+
+        if changed:
+            # content must be around to be copied
+            yield from www_ds.get(
+                [www_ds.pathobj / p for p in changed],
+                jobs=jobs,
+                result_renderer='disabled',
+                return_type='generator',
+                on_failure='ignore',
+            )
+
+        # removed files stay on record until they are actually removed
+        published = dict(manifest)
+        copied = 0
+        failed = 0
+        stage = 0
+        try:
+            for p in sorted(changed, key=_publication_order):
+                if failed and (_publication_order(p)[0] > stage
+                               or stage == 2):
+                    # files of the next stage would reference files that
+                    # failed to be published, and release files must not
+                    # be published without their signatures
+                    break
+                stage = _publication_order(p)[0]
+                src = www_ds.pathobj / p
+                dst = target / p
+                try:
+                    _copy_file(src, dst)
+                except OSError as e:
+                    failed += 1
+                    yield get_status_dict(
+                        action='publish_archive',
+                        status='error',
+                        path=str(dst),
+                        message=('Cannot publish %s: %s', src, e),
+                        type='file',
+                    )
+                    continue
+                copied += 1
+                published[p] = dict(
+                    current[p],
+                    size=dst.stat().st_size,
+                )
+                yield get_status_dict(
+                    action='publish_archive',
+                    status='ok',
+                    path=str(dst),
+                    type='file',
+                )
+            # published indices may still reference removed files, until
+            # all new ones are published
+            for p in removed if not failed else []:
+                dst = target / p
+                try:
+                    dst.unlink()
+                except FileNotFoundError:
+                    pass
+                _remove_empty_dirs(dst.parent, target)
+                del published[p]
+                yield get_status_dict(
+                    action='publish_archive.remove',
+                    status='ok',
+                    path=str(dst),
+                    type='file',
+                )
+        finally:
+            # record what was actually published, even on interruption, to
+            # not redo the work next time
+            _write_manifest(manifest_path, published)
+
+        if failed:
+            yield get_status_dict(
+                action='publish_archive',
+                status='error',
+                path=str(target),
+                type='directory',
+                ds=archive_ds,
+                message=(
+                    '%i file(s) could not be published, stopped before '
+                    'publishing files that reference them', failed),
+                copied=copied,
+                failed=failed,
+                removed=0,
+                unchanged=len(current) - len(changed),
+            )
+            return
+        yield get_status_dict(
+            action='publish_archive',
+            status='ok' if changed or removed else 'notneeded',
+            path=str(target),
+            type='directory',
+            ds=archive_ds,
+            copied=copied,
+            failed=0,
+            removed=len(removed),
+            unchanged=len(current) - len(changed),
+        )
+
+
+def _get_archive_state(ds):
+    """Report checksums of all committed files in an archive dataset
+
+    For annexed files, the checksum is the Git SHA of the annex symlink or
+    pointer file, which is determined by the annex key, and therefore by the
+    file content.
+
+    Returns
+    -------
+    dict
+      Keys are POSIX paths relative to the dataset root, values are
+      dicts with a 'checksum' property.
+    """
+    return {
+        PurePosixPath(p.relative_to(ds.pathobj)).as_posix(): dict(
+            checksum=props['gitshasum'],
+        )
+        for p, props in ds.repo.get_content_info(ref='HEAD').items()
+        if props.get('type') in ('file', 'symlink')
+        # exclude dataset-internals
+        and not p.relative_to(ds.pathobj).parts[0].startswith('.')
+    }
+
+
+def _matches_manifest(path, props):
+    try:
+        return path.stat().st_size == props.get('size')
+    except FileNotFoundError:
+        return False
+
+
+def _publication_order(path):
+    """Sort key to publish pool files first, and release files last"""
+    p = PurePosixPath(path)
+    if p.parts[0] != 'dists':
+        return 0, 0, path
+    elif p.name not in release_file_names:
+        return 1, 0, path
+    return 2, release_file_names.index(p.name), path
+
+
+def _copy_file(src, dst):
+    """Copy (dereferenced) file content, atomically replacing the target"""
+    dst.parent.mkdir(parents=True, exist_ok=True)
+    tmp = dst.parent / f'.{dst.name}.tmp'
+    shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+
+def _remove_empty_dirs(path, root):
+    while path != root and path.is_dir() and not any(path.iterdir()):
+        path.rmdir()
+        path = path.parent
+
+
+def _write_manifest(path, manifest):
+    tmp = path.parent / f'{path.name}.tmp'
+    tmp.write_text(json.dumps(manifest, indent=1, sort_keys=True))
+    os.replace(tmp, path)
@@ -0,0 +1,92 @@
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from functools import partial
+from http.server import (
+    SimpleHTTPRequestHandler,
+    ThreadingHTTPServer,
+)
+from pathlib import Path
+
+from datalad.tests.utils_pytest import (
+    assert_raises,
+    with_tempfile,
+)
+
+from ..apt_proxy import (
+    proxy_env_vars,
+    running_apt_proxy,
+)
+
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def _wait(condition):
+    # files are stored once the client has received them
+    for i in range(50):
+        if condition():
+            return
+        time.sleep(0.1)
+
+
+@with_tempfile(mkdir=True)
+@with_tempfile
+def test_apt_proxy(archive=None, store=None):
+    archive = Path(archive)
+    pool = archive / 'pool' / 'main' / 'h' / 'hello'
+    pool.mkdir(parents=True)
+    for name, size in (('hello_1.0_all.deb', 100), ('hello_2.0_all.deb', 80)):
+        (pool / name).write_bytes(b'x' * size)
+    (archive / 'dists').mkdir()
+    (archive / 'dists' / 'Release').write_text('release')
+    upstream = ThreadingHTTPServer(
+        ('127.0.0.1', 0), partial(_QuietHandler, directory=str(archive)))
+    threading.Thread(target=upstream.serve_forever, daemon=True).start()
+    base = 'http://127.0.0.1:%i' % upstream.server_address[1]
+
+    try:
+        with running_apt_proxy(store, 150) as proxy:
+            assert all(os.environ[v] == proxy.url for v in proxy_env_vars)
+            opener = urllib.request.build_opener(
+                urllib.request.ProxyHandler({'http': proxy.url}))
+
+            def fetch(path):
+                with opener.open(base + path) as r:
+                    return r.read()
+
+            deb1 = '/pool/main/h/hello/hello_1.0_all.deb'
+            assert fetch(deb1) == b'x' * 100
+            _wait(lambda: proxy.get_stats()['misses'])
+            assert fetch(deb1) == b'x' * 100
+            assert fetch('/dists/Release') == b'release'
+            with assert_raises(urllib.error.HTTPError):
+                fetch('/pool/main/h/hello/missing.deb')
+            stats = proxy.get_stats()
+            assert stats['hits'] == 1
+            assert stats['hit_bytes'] == 100
+            assert stats['passed'] == 1
+            # the least recently used file makes room
+            assert fetch('/pool/main/h/hello/hello_2.0_all.deb') == b'x' * 80
+            _wait(lambda: proxy.get_stats()['evicted'])
+            assert proxy.get_stats()['evicted'] == 1
+            assert len([p for p in Path(store).iterdir()
+                        if not p.name.startswith('.')]) == 1
+            # the same store is served by the same proxy
+            with running_apt_proxy(store, 150) as same:
+                assert same is proxy
+            assert os.environ[proxy_env_vars[0]] == proxy.url
+            # containers are pointed to a single proxy, another store is
+            # refused
+            with assert_raises(RuntimeError):
+                with running_apt_proxy(archive / 'other', 150):
+                    pass
+            assert os.environ[proxy_env_vars[0]] == proxy.url
+        assert not any(v in os.environ for v in proxy_env_vars)
+    finally:
+        upstream.shutdown()
+        upstream.server_close()
@@ -0,0 +1,86 @@
+from pathlib import Path
+
+from datalad.tests.utils_pytest import (
+    assert_in_results,
+    assert_not_in_results,
+    assert_result_count,
+    with_tempfile,
+)
+
+from datalad.api import (
+    Dataset,
+    deb_add_distribution,
+    deb_archive_lag,
+    deb_new_distribution,
+    deb_new_package,
+    deb_new_reprepro_repository,
+)
+
+from datalad_debian.archive_lag import parse_package_filename
+
+ckwa = dict(result_renderer='disabled', on_failure='ignore')
+
+
+def test_parse_package_filename():
+    assert parse_package_filename('hello_2.10-2.dsc') == \
+        ('source', 'hello', '2.10-2', 'source')
+    assert parse_package_filename('hello_2.10-2_amd64.deb') == \
+        ('binary', 'hello', '2.10-2', 'amd64')
+    assert parse_package_filename('hello_2.10.orig.tar.gz') is None
+    assert parse_package_filename('hello_2.10-2_amd64.changes') is None
+
+
+@with_tempfile
+def test_archive_lag(path=None):
+    path = Path(path)
+    dist_ds = Dataset(path / 'dist')
+    deb_new_distribution(dist_ds.path, **ckwa)
+    for pkg, files in (
+            ('hello', ('hello_1.0-2.dsc', 'hello_1.0-2_amd64.deb',
+                       'hello_1.0-1.dsc')),
+            ('tqdm', ('tqdm_4.0-1.dsc',)),
+            ('bc', ('bc_1.0-1.dsc',))):
+        deb_new_package(dataset=dist_ds, name=pkg, **ckwa)
+        pkg_ds = Dataset(dist_ds.pathobj / 'packages' / pkg)
+        for f in files:
+            (pkg_ds.pathobj / f).write_text(f)
+        pkg_ds.save(**ckwa)
+    dist_ds.save(**ckwa)
+
+    archive_ds = Dataset(path / 'archive')
+    deb_new_reprepro_repository(archive_ds.path, **ckwa)
+    deb_add_distribution(
+        str(dist_ds.pathobj), 'bullseye-main', dataset=archive_ds, **ckwa)
+    sources = archive_ds.pathobj / 'www' / 'dists' / 'bullseye' / 'main' / \
+        'source' / 'Sources'
+    sources.parent.mkdir(parents=True)
+    sources.write_text(
+        "Package: hello\nVersion: 1:1.0-1\nDirectory: pool/main/h/hello\n\n"
+        "Package: bc\nVersion: 1.0-1\nDirectory: pool/main/b/bc\n\n"
+        "Package: tqdm\nVersion: 4.0-2\nDirectory: pool/main/t/tqdm\n\n"
+        "Package: other\nVersion: 1.0\nDirectory: pool/main/o/other\n"
+    )
+    archive_ds.save(recursive=True, **ckwa)
+
+    res = deb_archive_lag(dataset=archive_ds, **ckwa)
+    # the epoch is ignored, only the latest distribution version matters
+    assert_in_results(
+        res, package='hello', package_type='source', lag='behind',
+        dist_version='1.0-2', archive_version='1.0-1')
+    assert_in_results(
+        res, package='hello', package_type='binary', lag='missing',
+        architecture='amd64')
+    assert_in_results(res, package='tqdm', lag='ahead')
+    assert_in_results(res, package='other', lag='unknown')
+    assert_not_in_results(res, package='bc')
+    assert_in_results(
+        res, codename='bullseye', current=1, missing=1, behind=1, ahead=1,
+        unknown=1)
+
+    # a second run is served from the cache, with the same outcome
+    res2 = deb_archive_lag(dataset=archive_ds, codename='bullseye', **ckwa)
+    assert_result_count(
+        res2, len([r for r in res if r['action'] == 'archive_lag']),
+        action='archive_lag')
+    res = deb_archive_lag(dataset=archive_ds, codename='buster', **ckwa)
+    assert_result_count(res, 0, action='archive_lag')
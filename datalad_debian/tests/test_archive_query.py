@@ -0,0 +1,104 @@
+from pathlib import Path
+
+from datalad.tests.utils_pytest import (
+    assert_in_results,
+    assert_not_in_results,
+    assert_result_count,
+    with_tempfile,
+)
+
+from datalad.api import (
+    Dataset,
+    deb_archive_query,
+    deb_new_reprepro_repository,
+)
+
+from datalad_debian.archive_index import _get_index_location
+
+ckwa = dict(result_renderer='disabled', on_failure='ignore')
+
+
+def _write_indices(www, version):
+    binary = www / 'dists' / 'bullseye' / 'main' / 'binary-amd64' / \
+        'Packages'
+    binary.parent.mkdir(parents=True, exist_ok=True)
+    binary.write_text(
+        "Package: hello\n"
+        f"Version: {version}\n"
+        "Architecture: amd64\n"
+        f"Filename: pool/main/h/hello/hello_{version}_amd64.deb\n"
+        "Size: 1\n"
+        "\n"
+        "Package: hello-doc\n"
+        "Source: hello (1.0-1)\n"
+        "Version: 1:1.0-1\n"
+        "Architecture: all\n"
+        "Filename: pool/main/h/hello/hello-doc_1.0-1_all.deb\n"
+        "Size: 1\n"
+    )
+    source = www / 'dists' / 'bullseye' / 'main' / 'source' / 'Sources'
+    source.parent.mkdir(parents=True, exist_ok=True)
+    source.write_text(
+        "Package: hello\n"
+        f"Version: {version}\n"
+        "Directory: pool/main/h/hello\n"
+        "Files:\n"
+        f" 00000000000000000000000000000000 1 hello_{version}.dsc\n"
+    )
+
+
+@with_tempfile
+def test_archive_query(path=None):
+    path = Path(path)
+    deb_new_reprepro_repository(path, **ckwa)
+    www = Dataset(path / 'www')
+    _write_indices(www.pathobj, '1.0-1')
+    # in git, to be able to overwrite them in place below
+    www.save(to_git=True, **ckwa)
+    Dataset(path).save(**ckwa)
+
+    res = deb_archive_query(dataset=path, **ckwa)
+    assert_result_count(res, 3, action='archive_query')
+    res = deb_archive_query(
+        'hello', dataset=path, architecture='amd64', **ckwa)
+    assert_result_count(res, 1, action='archive_query')
+    assert_in_results(
+        res, package='hello', version='1.0-1', codename='bullseye',
+        component='main', package_type='binary',
+        path=str(www.pathobj / 'pool/main/h/hello/hello_1.0-1_amd64.deb'))
+    # architecture-independent packages match any architecture
+    res = deb_archive_query(
+        'hello-*', dataset=path, architecture='i386', **ckwa)
+    assert_in_results(
+        res, package='hello-doc', source='hello', source_version='1.0-1')
+    res = deb_archive_query(
+        dataset=path, source='hello', type='source', **ckwa)
+    assert_result_count(res, 1, action='archive_query')
+    assert_in_results(
+        res, package_type='source',
+        path=str(www.pathobj / 'pool/main/h/hello/hello_1.0-1.dsc'))
+
+    # the index follows changes of the archive
+    _write_indices(www.pathobj, '1.0-2')
+    www.save(to_git=True, **ckwa)
+    res = deb_archive_query('hello', dataset=path, **ckwa)
+    assert_in_results(res, version='1.0-2', package_type='binary')
+    assert_not_in_results(res, version='1.0-1')
+    assert_result_count(res, 0, codename='buster')
+
+    # changes in the work tree are not hidden by the committed state
+    _write_indices(www.pathobj, '1.0-3')
+    res = deb_archive_query('hello', dataset=path, **ckwa)
+    assert_in_results(res, version='1.0-3', package_type='binary')
+    assert_not_in_results(res, version='1.0-2')
+
+
+def test_get_index_location():
+    for key, location in (
+            ('dists/bullseye/main/binary-amd64/Packages', ('bullseye', 'main')),
+            ('dists/bullseye/main/source/Sources', ('bullseye', 'main')),
+            ('dists/bullseye/main/debian-installer/binary-amd64/Packages',
+             ('bullseye', 'main')),
+            ('dists/bullseye/updates/contrib/binary-all/Packages',
+             ('bullseye/updates', 'contrib'))):
+        assert _get_index_location(key) == location
@@ -0,0 +1,90 @@
+from pathlib import Path
+
+from datalad.tests.utils_pytest import (
+    assert_in_results,
+    assert_result_count,
+    assert_status,
+    with_tempfile,
+)
+
+from datalad.api import (
+    Dataset,
+    deb_archive_snapshot,
+    deb_new_reprepro_repository,
+)
+
+from datalad_debian.archive_snapshot import _select_snapshot
+
+ckwa = dict(result_renderer='disabled', on_failure='ignore')
+
+
+def test_select_snapshot():
+    snapshots = [
+        ('snapshot/20261012T230000Z', 'a'),
+        ('snapshot/20261013T120000Z', 'b'),
+        ('snapshot/20261013T120000Z.01', 'b2'),
+        ('snapshot/20261014T000000Z', 'c'),
+    ]
+    assert _select_snapshot(snapshots, '20261013') == [snapshots[2]]
+    assert _select_snapshot(snapshots, '20261013T120000Z') == [snapshots[2]]
+    # tag names are exact
+    assert _select_snapshot(snapshots, 'snapshot/20261013T120000Z') == \
+        [snapshots[1]]
+    assert _select_snapshot(snapshots, '20261013T11') == [snapshots[0]]
+    assert _select_snapshot(snapshots, 'snapshot/20261014T000000Z') == \
+        [snapshots[3]]
+    assert _select_snapshot(snapshots, '2027') == [snapshots[3]]
+    assert _select_snapshot(snapshots, '2025') == []
+
+
+@with_tempfile
+@with_tempfile
+def test_archive_snapshot(path=None, target=None):
+    path = Path(path)
+    target = Path(target)
+    deb_new_reprepro_repository(path, **ckwa)
+    www = Dataset(path / 'www')
+    deb = www.pathobj / 'pool' / 'main' / 'h' / 'hello' / 'hello_1.0_all.deb'
+    deb.parent.mkdir(parents=True)
+    deb.write_text('deb')
+    release = www.pathobj / 'dists' / 'bullseye' / 'Release'
+    release.parent.mkdir(parents=True)
+    release.write_text('1')
+    www.save(path=deb, **ckwa)
+    www.save(path=release, to_git=True, **ckwa)
+
+    res = deb_archive_snapshot(dataset=path, tag=True, **ckwa)
+    assert_result_count(res, 1, action='archive_snapshot.tag', status='ok')
+    first = [r for r in res if r['action'] == 'archive_snapshot'][0]
+    # the same state is not recorded twice
+    res = deb_archive_snapshot(dataset=path, tag=True, **ckwa)
+    assert_in_results(
+        res, action='archive_snapshot.tag', status='notneeded',
+        snapshot=first['snapshot'])
+
+    # snapshots taken within the same second do not collide
+    for i in ('2', '3'):
+        release.write_text(i)
+        www.save(path=release, to_git=True, **ckwa)
+        res = deb_archive_snapshot(dataset=path, tag=True, **ckwa)
+        assert_result_count(
+            res, 1, action='archive_snapshot.tag', status='ok')
+    res = deb_archive_snapshot(dataset=path, **ckwa)
+    assert_result_count(res, 3, action='archive_snapshot')
+    assert len({r['snapshot'] for r in res}) == 3
+
+    res = deb_archive_snapshot(
+        first['snapshot'], dataset=path, to=str(target), **ckwa)
+    assert_in_results(
+        res, action='archive_snapshot.materialize', status='ok',
+        snapshot=first['snapshot'], hardlink=1, git=1)
+    assert (target / 'dists' / 'bullseye' / 'Release').read_text() == '1'
+    linked = target / deb.relative_to(www.pathobj)
+    assert linked.read_text() == 'deb'
+    assert linked.stat().st_nlink > 1
+    assert not (target / '.datalad').exists()
+    # never into a populated directory
+    res = deb_archive_snapshot(dataset=path, to=str(target), **ckwa)
+    assert_status('impossible', res)
+    res = deb_archive_snapshot('2001', dataset=path, **ckwa)
+    assert_status('impossible', res)
@@ -0,0 +1,308 @@
+from pathlib import Path
+from unittest.mock import patch
+
+from debian.deb822 import Dsc
+
+from datalad.tests.utils_pytest import (
+    assert_in_results,
+    assert_result_count,
+    with_tempfile,
+)
+
+from datalad.api import (
+    Dataset,
+    deb_build_package,
+    deb_new_distribution,
+    deb_new_package,
+)
+
+from datalad_debian.build_package import (
+    _allocate_cpus,
+    _build_workspace,
+    _get_build_deps_hash,
+    _get_build_phases,
+    _get_builder_containers,
+    _get_cached_build,
+    _get_ccache_stats,
+    _get_source_files,
+    _get_source_size,
+    _setup_apt_cache,
+    _setup_build_overlay,
+    expecting_builds,
+)
+
+ckwa = dict(result_renderer='disabled', on_failure='ignore')
+
+
+@with_tempfile
+def test_get_cached_build(path=None):
+    dist_ds = Dataset(Path(path) / 'dist')
+    deb_new_distribution(dist_ds.path, **ckwa)
+    deb_new_package(dataset=dist_ds, name='hello', **ckwa)
+    pkg_ds = Dataset(dist_ds.pathobj / 'packages' / 'hello')
+    pkg_ds.get('builder', get_data=False, **ckwa)
+    dsc = pkg_ds.pathobj / 'hello_2.10-2.dsc'
+    dsc.write_text('source')
+    pkg_ds.save(**ckwa)
+    assert _get_cached_build(pkg_ds, dsc, 'amd64') is None
+
+    # what a build leaves behind
+    for f in ('hello_2.10-2_amd64.changes', 'hello_2.10-2_amd64.deb',
+              'logs/hello_2.10-2_amd64.txt'):
+        (pkg_ds.pathobj / f).parent.mkdir(exist_ok=True)
+        (pkg_ds.pathobj / f).write_text(f)
+    pkg_ds.save(message='Build', **ckwa)
+    cached = _get_cached_build(pkg_ds, dsc, 'amd64')
+    assert cached['changes'] == \
+        str(pkg_ds.pathobj / 'hello_2.10-2_amd64.changes')
+    assert cached['build_log'] == \
+        str(pkg_ds.pathobj / 'logs' / 'hello_2.10-2_amd64.txt')
+    assert str(pkg_ds.pathobj / 'hello_2.10-2_amd64.deb') in \
+        cached['artifacts']
+    # other architecture
+    assert _get_cached_build(pkg_ds, dsc, 'arm64') is None
+
+    # a builder change invalidates the build
+    builder = Dataset(pkg_ds.pathobj / 'builder')
+    (builder.pathobj / 'recipe').write_text('new')
+    builder.save(**ckwa)
+    assert _get_cached_build(pkg_ds, dsc, 'amd64') is None
+    # even once it is recorded
+    pkg_ds.save(**ckwa)
+    assert _get_cached_build(pkg_ds, dsc, 'amd64') is None
+
+
+@with_tempfile
+def test_build_package_invalid_config(path=None):
+    dist_ds = Dataset(Path(path) / 'dist')
+    deb_new_distribution(dist_ds.path, **ckwa)
+    deb_new_package(dataset=dist_ds, name='hello', **ckwa)
+    pkg_ds = Dataset(dist_ds.pathobj / 'packages' / 'hello')
+    hexsha = pkg_ds.repo.get_hexsha()
+    for name, value in (
+            ('datalad.debian.build-overlays', 'all'),
+            ('datalad.debian.build-overlays', '-1'),
+            ('datalad.debian.build-tmpfs-size', '4G'),
+            ('datalad.debian.build-cpus', '1.5')):
+        pkg_ds.config.set(name, value, scope='local')
+        # rejected before anything is obtained or modified
+        res = deb_build_package(
+            'hello_2.10-2.dsc', dataset=pkg_ds.path, **ckwa)
+        assert_result_count(res, 1)
+        assert_in_results(
+            res, action='deb_build_package', status='impossible')
+        assert name in res[0]['message'][1]
+        assert not Dataset(pkg_ds.pathobj / 'builder').is_installed()
+        assert pkg_ds.repo.get_hexsha() == hexsha
+        pkg_ds.config.unset(name, scope='local')
+
+
+@with_tempfile
+def test_setup_apt_cache(path=None):
+    path = Path(path)
+    cache = path / 'builder' / 'cache'
+    apt_dirs = (cache / 'var' / 'cache' / 'apt', cache / 'var' / 'lib' / 'apt')
+    _setup_apt_cache(cache)
+    assert all(p.is_dir() and not p.is_symlink() for p in apt_dirs)
+    (apt_dirs[0] / 'old.deb').write_text('old')
+
+    shared = path / 'shared'
+    _setup_apt_cache(cache, shared)
+    assert all(p.is_symlink() for p in apt_dirs)
+    assert apt_dirs[0].resolve() == shared / 'var' / 'cache' / 'apt'
+    assert (shared / 'var' / 'lib' / 'apt').is_dir()
+    # idempotent
+    _setup_apt_cache(cache, shared)
+    assert apt_dirs[1].resolve() == shared / 'var' / 'lib' / 'apt'
+    # and reversible
+    _setup_apt_cache(cache)
+    assert all(p.is_dir() and not p.is_symlink() for p in apt_dirs)
+
+
+@with_tempfile(mkdir=True)
+def test_setup_build_overlay(path=None):
+    path = Path(path)
+    cache = path / 'builder' / 'cache'
+    overlay = cache / 'overlay'
+    dscs = []
+    for i, deps in enumerate((
+            'debhelper-compat (= 13),\n texinfo',
+            'debhelper-compat (= 13), texinfo',
+            'debhelper-compat (= 13), python3',
+            'debhelper-compat (= 12)')):
+        dsc = path / f'pkg{i}.dsc'
+        dsc.write_text(f'Format: 3.0 (quilt)\nSource: pkg\n'
+                       f'Build-Depends: {deps}\n')
+        dscs.append(Dsc(dsc.read_text()))
+    # only the build-dependencies matter, not their formatting
+    assert _get_build_deps_hash(dscs[0]) == _get_build_deps_hash(dscs[1])
+    assert _get_build_deps_hash(dscs[0]) != _get_build_deps_hash(dscs[2])
+
+    # disabled, no overlay, and a leftover one is removed
+    assert _setup_build_overlay(cache, 'a' * 40, dscs[0], 0) is None
+    assert not overlay.exists()
+    overlay.mkdir(parents=True)
+    (overlay / 'leftover').write_text('')
+    assert _setup_build_overlay(cache, 'a' * 40, dscs[0], 0) is None
+    assert not overlay.exists()
+
+    first = _setup_build_overlay(cache, 'a' * 40, dscs[0], 2)
+    assert first['origin'] == 'new'
+    assert overlay.is_symlink()
+    (overlay / 'installed').write_text('deps')
+    assert _setup_build_overlay(cache, 'a' * 40, dscs[1], 2) == \
+        dict(first, origin='reused')
+    second = _setup_build_overlay(cache, 'a' * 40, dscs[2], 2)
+    assert second['origin'] == 'copied'
+    # starts from what the previous build installed
+    assert (overlay / 'installed').read_text() == 'deps'
+    # overlays of other builder states are not used
+    third = _setup_build_overlay(cache, 'b' * 40, dscs[3], 2)
+    assert third['origin'] == 'new'
+    # the least recently used one is gone
+    assert sorted(p.name for p in (cache / 'overlays').iterdir()) == \
+        sorted([second['overlay'], third['overlay']])
+    assert _setup_build_overlay(cache, 'a' * 40, dscs[0], 2)['origin'] \
+        == 'copied'
+    # and back to no overlay, the kept ones remain
+    assert _setup_build_overlay(cache, 'a' * 40, dscs[0], 0) is None
+    assert not overlay.exists() and not overlay.is_symlink()
+    assert (cache / 'overlays').is_dir()
+
+
+@with_tempfile(mkdir=True)
+def test_build_workspace(path=None):
+    path = Path(path)
+    cache = path / 'builder' / 'cache'
+    link = cache / 'workspace'
+    dsc = path / 'hello_2.10-2.dsc'
+    dsc.write_text(
+        'Format: 3.0 (quilt)\nSource: hello\nFiles:\n'
+        ' 0123456789abcdef0123456789abcdef 1000 hello_2.10.orig.tar.gz\n'
+        ' 0123456789abcdef0123456789abcdef 24 hello_2.10-2.debian.tar.xz\n')
+    size = _get_source_size(dsc, Dsc(dsc.read_text()))
+    assert size == 1024 + dsc.stat().st_size
+
+    with _build_workspace(cache, None, size, 0) as ws:
+        assert ws is None
+        assert link.is_dir() and not link.is_symlink()
+
+    scratch = path / 'scratch'
+    with _build_workspace(cache, str(scratch), size, 0) as ws:
+        assert ws['workspace'] == 'scratch'
+        assert link.resolve() == Path(ws['path']).resolve()
+        assert (link / '.datalad-debian-workspace').exists()
+        assert Path(ws['path']).parent == scratch
+    # cleaned up, and left for containers to bind
+    assert not any(scratch.iterdir())
+    assert link.is_dir() and not link.is_symlink()
+
+    with patch('datalad_debian.build_package.tmpfs_path', scratch):
+        with _build_workspace(cache, 'tmpfs', size, 15 * size) as ws:
+            assert ws['workspace'] == 'tmpfs'
+            # the limit is shared by concurrent builds
+            with _build_workspace(path / 'other', 'tmpfs', size,
+                                  15 * size) as other:
+                assert other == dict(
+                    workspace='default', path=None, size=ws['size'])
+        # released
+        with _build_workspace(cache, 'tmpfs', size, 15 * size) as ws:
+            assert ws['workspace'] == 'tmpfs'
+        # too large for the limit
+        with _build_workspace(cache, 'tmpfs', size, size) as ws:
+            assert ws['workspace'] == 'default'
+            assert link.is_dir() and not link.is_symlink()
+
+
+def test_get_ccache_stats():
+    assert _get_ccache_stats('# Build starting\nno ccache\n') is None
+    log = (
+        '#\n# ccache statistics\n#\n\n'
+        'stats_updated_timestamp\t1760875200\n'
+        'direct_cache_hit\t120\n'
+        'preprocessed_cache_hit\t3\n'
+        'cache_miss\t7\n'
+        '\n#\n# Deposit build results: 2026-10-19T12:00:00+00:00\n#\n'
+    )
+    stats = _get_ccache_stats(log)
+    assert stats['hits'] == 123
+    assert stats['misses'] == 7
+    assert stats['counters']['stats_updated_timestamp'] == 1760875200
+    # human-readable statistics of older versions
+    assert _get_ccache_stats(
+        '# ccache statistics\ncache hit (direct)  120\n') is None
+
+
+def test_allocate_cpus():
+    with _allocate_cpus(0) as cpus:
+        assert cpus is None
+    with _allocate_cpus(16) as cpus:
+        assert cpus == 16
+        # all cores are taken, but a build always gets one
+        with _allocate_cpus(16) as other:
+            assert other == 1
+    with expecting_builds(4):
+        with _allocate_cpus(16) as a, _allocate_cpus(16) as b:
+            assert (a, b) == (4, 4)
+            # more builds than expected
+            with _allocate_cpus(16) as c, _allocate_cpus(16) as d, \
+                    _allocate_cpus(16) as e:
+                assert (c, d, e) == (4, 4, 1)
+        # released
+        with _allocate_cpus(16) as cpus:
+            assert cpus == 4
+    with _allocate_cpus(16) as cpus:
+        assert cpus == 16
+
+
+@with_tempfile(mkdir=True)
+def test_build_planning(path=None):
+    path = Path(path)
+    dsc = path / 'hello_2.10-2.dsc'
+    dsc.write_text(
+        'Format: 3.0 (quilt)\nSource: hello\nFiles:\n'
+        ' 0123456789abcdef0123456789abcdef 1000 hello_2.10.orig.tar.gz\n'
+        ' 0123456789abcdef0123456789abcdef 24 hello_2.10-2.debian.tar.xz\n')
+    assert _get_source_files(dsc, Dsc(dsc.read_text())) == [
+        dsc,
+        path / 'hello_2.10.orig.tar.gz',
+        path / 'hello_2.10-2.debian.tar.xz',
+    ]
+
+    builder = path / 'builder'
+    assert _get_builder_containers(builder) == set()
+    (builder / '.datalad').mkdir(parents=True)
+    (builder / '.datalad' / 'config').write_text(
+        '[datalad "dataset"]\n'
+        '\tid = 0b2c4ec0-5c2b-4d8e-9f4e-3c6a8f1e2d7b\n'
+        '[datalad "containers.singularity-amd64"]\n'
+        '\timage = envs/singularity-amd64.sif\n'
+        '\tcmdexec = singularity run {img} {cmd}\n')
+    assert _get_builder_containers(builder) == {'singularity-amd64'}
+
+
+def test_get_build_phases():
+    assert _get_build_phases('no markers') == []
+    marker = '\n#\n# {}: 2026-10-19T12:{}+00:00\n#\n\n'
+    log = ''.join(marker.format(*m) for m in (
+        ('Extracting the source package', '00:00'),
+        ('Updating build environment', '00:02'),
+        ('Installing build-dependencies', '00:32'),
+        ('Build starting', '02:32'),
+        ('Deposit build results', '12:32'),
+        ('Builder exit', '12:33'),
+    )) + '#\n# datalad-debian: build succeeded\n#\n'
+    phases = _get_build_phases(log)
+    assert [(p['phase'], p['duration']) for p in phases] == [
+        ('extract', 2), ('update', 30), ('build_deps', 120), ('build', 600),
+        ('deposit', 1)]
+    assert phases[0]['start'] == '2026-10-19T12:00:00+00:00'
+    assert phases[-1]['end'] == '2026-10-19T12:12:33+00:00'
+    # a failed build ends with the phase it failed in
+    log = ''.join(marker.format(*m) for m in (
+        ('Extracting the source package', '00:00'),
+        ('Build starting', '00:10'),
+        ('Builder exit', '01:10'),
+    ))
+    assert [(p['phase'], p['duration']) for p in _get_build_phases(log)] \
+        == [('extract', 10), ('build', 60)]
@@ -0,0 +1,86 @@
+from pathlib import Path
+
+from datalad.tests.utils_pytest import (
+    assert_in_results,
+    assert_result_count,
+    with_tempfile,
+)
+
+from datalad.api import (
+    Dataset,
+    deb_build_packages,
+    deb_new_distribution,
+    deb_new_package,
+)
+
+from datalad_debian.apt_proxy import running_apt_proxy
+from datalad_debian.build_packages import _get_latest_dsc
+
+ckwa = dict(result_renderer='disabled', on_failure='ignore')
+
+
+@with_tempfile
+def test_build_packages_selection(path=None):
+    dist_ds = Dataset(Path(path) / 'dist')
+    deb_new_distribution(dist_ds.path, **ckwa)
+    for pkg in ('hello', 'empty'):
+        deb_new_package(dataset=dist_ds, name=pkg, **ckwa)
+    pkg_ds = Dataset(dist_ds.pathobj / 'packages' / 'hello')
+    for f in ('hello_2.10-10.dsc', 'hello_2.10-9.dsc', 'hello_2.9-1.dsc'):
+        (pkg_ds.pathobj / f).write_text(f)
+    pkg_ds.save(**ckwa)
+    dist_ds.save(**ckwa)
+
+    # Debian version ordering
+    assert _get_latest_dsc(pkg_ds) == pkg_ds.pathobj / 'hello_2.10-10.dsc'
+
+    res = deb_build_packages(
+        dataset=dist_ds, path=[str(pkg_ds.pathobj.parent / 'empty')], **ckwa)
+    assert_in_results(
+        res, action='build_packages', status='notneeded',
+        path=str(dist_ds.pathobj / 'packages' / 'empty'))
+    assert_in_results(
+        res, action='build_packages', status='ok', succeeded=0, skipped=0,
+        failed=0)
+    res = deb_build_packages(dataset=dist_ds, path=[path], **ckwa)
+    assert_result_count(res, 1, action='build_packages', status='impossible')
+    # a .dsc requested more than once, directly and via its package
+    # dataset, is built once; other .dsc files of the same package dataset
+    # are built one after another
+    dsc = pkg_ds.pathobj / 'hello_2.10-10.dsc'
+    res = deb_build_packages(
+        dataset=dist_ds,
+        path=[str(dsc), str(dsc), str(pkg_ds.path),
+              str(pkg_ds.pathobj / 'hello_2.10-9.dsc')],
+        **ckwa)
+    assert_result_count(
+        res, 1, action='build_packages', path=str(dsc))
+    assert_result_count(
+        res, 1, action='build_packages',
+        path=str(pkg_ds.pathobj / 'hello_2.10-9.dsc'))
+
+
+@with_tempfile
+def test_build_packages_apt_proxy(path=None):
+    path = Path(path)
+    dist_ds = Dataset(path / 'dist')
+    deb_new_distribution(dist_ds.path, **ckwa)
+    deb_new_package(dataset=dist_ds, name='hello', **ckwa)
+    pkg_ds = Dataset(dist_ds.pathobj / 'packages' / 'hello')
+    (pkg_ds.pathobj / 'hello_2.10-10.dsc').write_text('')
+    pkg_ds.save(**ckwa)
+    dist_ds.save(**ckwa)
+
+    # an invalid size of the proxy store
+    dist_ds.config.set('datalad.debian.apt-proxy-size', '10G', scope='local')
+    res = deb_build_packages(
+        dataset=dist_ds, apt_proxy=str(path / 'store'), **ckwa)
+    assert_result_count(res, 1)
+    assert_in_results(res, action='build_packages', status='impossible')
+    dist_ds.config.unset('datalad.debian.apt-proxy-size', scope='local')
+    # only one proxy store can be in use in a process
+    with running_apt_proxy(path / 'other', 1024):
+        res = deb_build_packages(
+            dataset=dist_ds, apt_proxy=str(path / 'store'), **ckwa)
+    assert_in_results(res, action='build_packages', status='impossible')
+    assert not (path / 'store').exists()
@@ -0,0 +1,144 @@
+import shutil
+from pathlib import (
+    Path,
+    PurePosixPath,
+)
+
+from datalad.tests.utils_pytest import (
+    assert_in_results,
+    assert_repo_status,
+    assert_result_count,
+    assert_status,
+    skip_if,
+    with_tempfile,
+)
+
+from datalad.api import (
+    Dataset,
+    deb_new_reprepro_repository,
+)
+from datalad.runner import (
+    Runner,
+    StdOutErrCapture,
+)
+
+from datalad_debian.archive_query import update_archive_index
+from datalad_debian.debdeltas import (
+    generate_debdeltas,
+    get_binary_files,
+    get_debdelta_path,
+)
+
+ckwa = dict(result_renderer='disabled', on_failure='ignore')
+
+
+def test_get_debdelta_path():
+    assert get_debdelta_path(
+        'pool/main/h/hello/hello_2.10-3_amd64.deb', 'hello', '2.10-2',
+        '2.10-3', 'amd64') == PurePosixPath(
+            'debdeltas/pool/main/h/hello/hello_2.10-2_2.10-3_amd64.debdelta')
+    # epochs are escaped
+    assert get_debdelta_path(
+        'pool/main/h/hello/hello_2.10-3_all.deb', 'hello', '1:2.10-2',
+        '1:2.10-3', 'all').name == 'hello_1%3a2.10-2_1%3a2.10-3_all.debdelta'
+
+
+def _publish(archive_ds, path, packages):
+    """Put binary packages into the pool and the index of an archive
+
+    Packages are given as (name, version), all other packages are removed.
+    """
+    www_ds = Dataset(archive_ds.pathobj / 'www')
+    pool = www_ds.pathobj / 'pool' / 'main'
+    if pool.exists():
+        shutil.rmtree(pool)
+    entries = []
+    for name, version in packages:
+        deb = pool / name[0] / name / f'{name}_{version}_all.deb'
+        deb.parent.mkdir(parents=True, exist_ok=True)
+        pkg = path / f'{name}_{version}'
+        (pkg / 'DEBIAN').mkdir(parents=True)
+        (pkg / 'DEBIAN' / 'control').write_text(
+            f'Package: {name}\nVersion: {version}\nArchitecture: all\n'
+            'Maintainer: Nobody <nobody@example.com>\n'
+            f'Description: {name}\n')
+        # most of the content is shared between versions
+        (pkg / 'usr' / 'share' / name).mkdir(parents=True)
+        (pkg / 'usr' / 'share' / name / 'data').write_text(
+            ''.join(f'{name} line {i}\n' for i in range(20000)) + version)
+        Runner().run(
+            ['dpkg-deb', '--root-owner-group', '-b', str(pkg), str(deb)],
+            protocol=StdOutErrCapture)
+        entries.append(
+            f'Package: {name}\nVersion: {version}\nArchitecture: all\n'
+            f'Filename: {deb.relative_to(www_ds.pathobj).as_posix()}\n')
+    index = www_ds.pathobj / 'dists' / 'bullseye' / 'main' / \
+        'binary-amd64' / 'Packages'
+    index.parent.mkdir(parents=True, exist_ok=True)
+    # replace, the annexed index must not be written to
+    if index.is_symlink():
+        index.unlink()
+    index.write_text('\n'.join(entries))
+    www_ds.save(**ckwa)
+    archive_ds.save(path='www', **ckwa)
+    list(update_archive_index(archive_ds))
+
+
+@with_tempfile
+def test_generate_debdeltas_unavailable(path=None):
+    path = Path(path)
+    archive_ds = Dataset(path / 'archive')
+    deb_new_reprepro_repository(archive_ds.path, **ckwa)
+    www_ds = Dataset(archive_ds.pathobj / 'www')
+    _publish(archive_ds, path / 'build1', [('hello', '1.0-1')])
+    old_files = get_binary_files(archive_ds)
+    old_ref = www_ds.repo.get_hexsha()
+    # nothing changed, nothing to do
+    assert list(generate_debdeltas(archive_ds, old_files, old_ref)) == []
+    _publish(archive_ds, path / 'build2', [('hello', '1.0-2')])
+    if shutil.which('debdelta') is None:
+        res = list(generate_debdeltas(archive_ds, old_files, old_ref))
+        assert_in_results(
+            res, action='update_repository.debdelta', status='impossible',
+            message='Cannot generate debdeltas, debdelta is not installed')
+        return
+    # without the content of the new version, there is nothing to compare
+    www_ds.drop(
+        path=www_ds.pathobj / 'pool', reckless='availability', **ckwa)
+    res = list(generate_debdeltas(archive_ds, old_files, old_ref))
+    assert_result_count(res, 1)
+    assert_in_results(
+        res, action='update_repository.debdelta', status='impossible')
+    assert not (www_ds.pathobj / 'debdeltas').exists()
+
+
+@skip_if(cond=shutil.which('debdelta') is None, msg='debdelta not installed')
+@with_tempfile
+def test_generate_debdeltas(path=None):
+    path = Path(path)
+    archive_ds = Dataset(path / 'archive')
+    deb_new_reprepro_repository(archive_ds.path, **ckwa)
+    www_ds = Dataset(archive_ds.pathobj / 'www')
+    _publish(archive_ds, path / 'build1',
+             [('hello', '1.0-1'), ('libfoo', '2.0-1')])
+    old_files = get_binary_files(archive_ds)
+    old_ref = www_ds.repo.get_hexsha()
+    # only hello is updated
+    _publish(archive_ds, path / 'build2',
+             [('hello', '1.0-2'), ('libfoo', '2.0-1')])
+    res = list(generate_debdeltas(archive_ds, old_files, old_ref))
+    delta = www_ds.pathobj / get_debdelta_path(
+        'pool/main/h/hello/hello_1.0-2_all.deb', 'hello', '1.0-1', '1.0-2',
+        'all')
+    assert_in_results(
+        res, action='update_repository.debdelta', status='ok',
+        path=str(delta))
+    assert_result_count(res, 1, action='update_repository.debdelta')
+    assert delta.exists()
+    assert_status(('ok', 'notneeded'), res)
+    # the deltas are saved, in 'www', and in the archive dataset
+    assert_repo_status(
+        archive_ds.path,
+        untracked=[archive_ds.pathobj / 'conf' / 'distributions'])
+    # the pair is known, and not considered again
+    assert list(generate_debdeltas(archive_ds, old_files, old_ref)) == []
@@ -50,3 +50,22 @@ def test_new_reprepro_repository(path=None):
     # the right name and version
     assert Dataset(pathobj / 'distribution').repo.get_hexsha() \
         == Dataset(pathobj / 'archive' / 'distributions' / 'mydist').repo.get_hexsha()
+
+
+@with_tempfile
+def test_new_reprepro_repository_per_codename(path=None):
+    pathobj = Path(path) / 'archive'
+    deb_new_reprepro_repository(path=pathobj, layout='per-codename', **ckwa)
+    assert (pathobj / 'shards' / 'README').exists()
+    assert Dataset(pathobj).config.get(
+        'datalad.debian.archive-layout') == 'per-codename'
+    # the layout choice is committed
+    assert_repo_status(
+        pathobj,
+        untracked=[pathobj / 'conf' / 'distributions'])
+    # shard databases are kept unlocked, and their configuration in git
+    repo = Dataset(pathobj).repo
+    assert 'shards/*/db/*' in repo.call_annex(
+        ['config', '--get', 'annex.addunlocked'])
+    assert 'shards/*/conf/*' in repo.call_annex(
+        ['config', '--get', 'annex.largefiles'])
@@ -0,0 +1,118 @@
+from pathlib import Path
+
+from datalad.tests.utils_pytest import (
+    assert_in_results,
+    assert_not_in_results,
+    assert_result_count,
+    with_tempfile,
+)
+
+from datalad.api import (
+    Dataset,
+    deb_new_reprepro_repository,
+    deb_publish_archive,
+)
+
+from datalad_debian.publish_archive import _publication_order
+
+ckwa = dict(result_renderer='disabled')
+
+
+@with_tempfile
+@with_tempfile
+def test_publish_archive(path=None, target=None):
+    path = Path(path)
+    target = Path(target)
+    deb_new_reprepro_repository(path, **ckwa)
+    www = Dataset(path / 'www')
+    # fake what reprepro would deposit
+    deb = www.pathobj / 'pool' / 'main' / 'h' / 'hello' / 'hello_1_amd64.deb'
+    deb.parent.mkdir(parents=True)
+    deb.write_text('deb1')
+    dists = www.pathobj / 'dists' / 'bullseye'
+    (dists / 'main' / 'binary-amd64').mkdir(parents=True)
+    (dists / 'main' / 'binary-amd64' / 'Packages').write_text('pkg1')
+    (dists / 'Release').write_text('rel1')
+    Dataset(path).save(recursive=True, **ckwa)
+
+    res = deb_publish_archive(str(target), dataset=path, **ckwa)
+    # one result per file, plus the summary
+    assert_result_count(res, 4, action='publish_archive', status='ok')
+    # release file comes last
+    published = [r['path'] for r in res
+                 if r['action'] == 'publish_archive' and r['type'] == 'file']
+    assert published == [
+        str(target / 'pool' / 'main' / 'h' / 'hello' / 'hello_1_amd64.deb'),
+        str(target / 'dists' / 'bullseye' / 'main' / 'binary-amd64' /
+            'Packages'),
+        str(target / 'dists' / 'bullseye' / 'Release'),
+    ]
+    assert (target / 'pool' / 'main' / 'h' / 'hello' / 'hello_1_amd64.deb'
+            ).read_text() == 'deb1'
+    assert (target / 'dists' / 'bullseye' / 'Release').read_text() == 'rel1'
+
+    # nothing changed, nothing to do
+    res = deb_publish_archive(str(target), dataset=path, **ckwa)
+    assert_result_count(res, 1)
+    assert_in_results(res, status='notneeded', copied=0, removed=0)
+
+    # replace a package, and update the indices
+    deb.unlink()
+    newdeb = deb.parent / 'hello_2_amd64.deb'
+    newdeb.write_text('deb2')
+    for f, content in ((dists / 'main' / 'binary-amd64' / 'Packages', 'pkg2'),
+                       (dists / 'Release', 'rel2')):
+        # do not write into the annexed file content
+        f.unlink()
+        f.write_text(content)
+    Dataset(path).save(recursive=True, **ckwa)
+    # a pool file that cannot be published
+    blocker = target / newdeb.relative_to(www.pathobj) / 'blocker'
+    blocker.parent.mkdir(parents=True)
+    blocker.write_text('')
+    res = deb_publish_archive(
+        str(target), dataset=path, on_failure='ignore', **ckwa)
+    assert_in_results(res, action='publish_archive', status='error',
+                      type='file', path=str(blocker.parent))
+    # no index refers to it, and nothing is removed
+    assert_in_results(res, action='publish_archive', status='error',
+                      type='directory', copied=0, failed=1, removed=0)
+    assert_not_in_results(res, action='publish_archive.remove')
+    assert (target / 'dists' / 'bullseye' / 'Release').read_text() == 'rel1'
+    assert (target / deb.relative_to(www.pathobj)).exists()
+
+    blocker.unlink()
+    blocker.parent.rmdir()
+    res = deb_publish_archive(str(target), dataset=path, **ckwa)
+    assert_in_results(res, action='publish_archive', status='ok',
+                      copied=3, removed=1, unchanged=0)
+    assert_in_results(res, action='publish_archive.remove',
+                      path=str(target / deb.relative_to(www.pathobj)))
+    assert not (target / deb.relative_to(www.pathobj)).exists()
+    assert (target / newdeb.relative_to(www.pathobj)).read_text() == 'deb2'
+    assert (target / 'dists' / 'bullseye' / 'Release').read_text() == 'rel2'
+
+    # a target file that got lost is republished
+    (target / 'dists' / 'bullseye' / 'Release').unlink()
+    res = deb_publish_archive(str(target), dataset=path, **ckwa)
+    assert_in_results(res, action='publish_archive', status='ok', copied=1)
+    assert_not_in_results(
+        res, path=str(target / newdeb.relative_to(www.pathobj)))
+
+
+def test_publication_order():
+    paths = [
+        'dists/bullseye/InRelease',
+        'dists/bullseye/Release',
+        'dists/bullseye/Release.gpg',
+        'dists/bullseye/main/binary-amd64/Packages',
+        'pool/main/h/hello/hello_1_amd64.deb',
+    ]
+    # a signature is in place before the Release file it belongs to
+    assert sorted(paths, key=_publication_order) == [
+        'pool/main/h/hello/hello_1_amd64.deb',
+        'dists/bullseye/main/binary-amd64/Packages',
+        'dists/bullseye/Release.gpg',
+        'dists/bullseye/Release',
+        'dists/bullseye/InRelease',
+    ]
@@ -1,14 +1,20 @@
 import gzip
+import hashlib
+import shutil
 from pathlib import Path
+from unittest.mock import patch
 
 from datalad.tests.utils_pytest import (
     assert_in_results,
     assert_repo_status,
+    assert_result_count,
     with_tempfile,
 )
 
 from datalad.api import (
     Dataset,
+    clone,
+    create,
     deb_add_distribution,
     deb_new_distribution,
     deb_new_package,
@@ -18,6 +24,26 @@ from datalad.api import (
     save,
     update,
 )
+from datalad.runner import (
+    Runner,
+    StdOutCapture,
+)
+
+from datalad_debian.update_reprepro_repository import (
+    _get_pkg_path,
+    _get_sibling_state,
+    _get_tracking_sibling,
+    _include_pkg_updates,
+    _register_pool_files,
+    _verify_uploads,
+    _set_pdiff_index_lines,
+    _watch_step,
+    pdiff_index_lines,
+)
+from datalad_debian.utils import (
+    ChangeDebouncer,
+    get_annex_key,
+)
 
 ckwa = dict(
     result_renderer='disabled',
@@ -123,3 +149,405 @@ Architectures: source amd64
     assert '4.64.0-1' in (
         archive_ds_p / 'www' / 'dists' / 'bullseye' / 'main' / 'binary-amd64' /
         'Packages').read_text()
+
+
+@with_tempfile
+def test_update_sharded_reprepro_repo(path=None):
+    path = Path(path)
+    archive_ds_p = path / 'archive'
+    deb_new_reprepro_repository(
+        archive_ds_p, layout='per-codename', **ckwa)
+    (archive_ds_p / 'conf' / 'distributions').write_text("""\
+Codename: bullseye
+Components: main
+Architectures: source amd64
+
+Codename: bookworm
+Components: main
+Architectures: source amd64
+""")
+    save(dataset=archive_ds_p, **ckwa)
+    dists = {}
+    for codename in ('bullseye', 'bookworm'):
+        dist_ds_p = path / codename
+        deb_new_distribution(dist_ds_p, **ckwa)
+        deb_new_package(dataset=dist_ds_p, name='tqdm', **ckwa)
+        run('dget -u -d '
+            'https://snapshot.debian.org/archive/debian/20210218T082603Z/pool/main/t/tqdm/tqdm_4.57.0-1.dsc',
+            dataset=Dataset(dist_ds_p / 'packages' / 'tqdm'),
+            **ckwa
+        )
+        save(dataset=dist_ds_p, **ckwa)
+        deb_add_distribution(
+            dataset=archive_ds_p, source=str(dist_ds_p), name=codename,
+            **ckwa)
+        dists[codename] = dist_ds_p
+    res = deb_update_reprepro_repository(dataset=archive_ds_p, **ckwa)
+    for codename in dists:
+        assert_in_results(
+            res, action='update_repository.shard', codename=codename)
+        assert (archive_ds_p / 'www' / 'dists' / codename / 'Release').exists()
+    pool = archive_ds_p / 'www' / 'pool' / 'main' / 't' / 'tqdm'
+    old_files = [pool / 'tqdm_4.57.0-1.dsc',
+                 pool / 'tqdm_4.57.0-1.debian.tar.xz']
+    assert all(f.exists() for f in old_files)
+
+    def update_pkg(codename):
+        run('dget -u -d '
+            'https://snapshot.debian.org/archive/debian/20210305T143148Z/pool/main/t/tqdm/tqdm_4.57.0-2.dsc',
+            dataset=Dataset(dists[codename] / 'packages' / 'tqdm'),
+            **ckwa
+        )
+        save(dataset=dists[codename], **ckwa)
+        deb_update_reprepro_repository(dataset=archive_ds_p, **ckwa)
+
+    # bookworm still references the old version
+    update_pkg('bullseye')
+    assert all(f.exists() for f in old_files)
+    # no codename references the old version anymore
+    update_pkg('bookworm')
+    assert not any(f.exists() for f in old_files)
+    assert (pool / 'tqdm_4.57.0.orig.tar.xz').exists()
+    # no instance still registers the removed files, a future import of
+    # them would not copy them into the pool again
+    for codename in dists:
+        registered = Runner(cwd=str(archive_ds_p)).run(
+            ['reprepro', '-b', f'shards/{codename}', 'dumpunreferenced'],
+            protocol=StdOutCapture)['stdout'].splitlines()
+        assert all((archive_ds_p / 'www' / f).exists() for f in registered)
+    assert_repo_status(archive_ds_p)
+
+
+@with_tempfile
+def test_estimate_update(path=None):
+    path = Path(path)
+    dist_ds_p = path / 'dist'
+    pkg_ds_p = dist_ds_p / 'packages' / 'hello'
+    archive_ds_p = path / 'archive'
+    deb_new_distribution(dist_ds_p, **ckwa)
+    deb_new_package(dataset=dist_ds_p, name=pkg_ds_p.name, **ckwa)
+    files = {
+        'hello_1.0.orig.tar.gz': b'orig' * 1000,
+        'hello_1.0-1.debian.tar.xz': b'debian' * 10,
+    }
+    for name, content in files.items():
+        (pkg_ds_p / name).write_bytes(content)
+    (pkg_ds_p / 'hello_1.0-1.dsc').write_text(
+        'Format: 3.0 (quilt)\nSource: hello\nVersion: 1.0-1\nFiles:\n'
+        + ''.join(f' 00 {len(c)} {n}\n' for n, c in files.items()))
+    (pkg_ds_p / 'hello_1.0-1_amd64.deb').write_bytes(b'deb' * 100)
+    # not part of any import
+    (pkg_ds_p / 'notes.txt').write_bytes(b'notes' * 1000)
+    save(dataset=pkg_ds_p, **ckwa)
+    save(dataset=dist_ds_p, **ckwa)
+
+    deb_new_reprepro_repository(archive_ds_p, **ckwa)
+    (archive_ds_p / 'conf' / 'distributions').write_text(
+        'Codename: bullseye\nComponents: main\n'
+        'Architectures: source amd64\n')
+    save(dataset=archive_ds_p, **ckwa)
+    deb_add_distribution(
+        dataset=archive_ds_p, source=str(dist_ds_p), name='bullseye', **ckwa)
+    archive_ds = Dataset(archive_ds_p)
+    hexsha = archive_ds.repo.get_hexsha()
+    res = deb_update_reprepro_repository(
+        dataset=archive_ds_p, estimate=True, **ckwa)
+    assert_in_results(
+        res,
+        action='update_repository.estimate',
+        path=str(archive_ds_p),
+        # the changes of a package dataset that is not installed are unknown
+        imports=0,
+        packages_not_estimated=1,
+    )
+    # nothing was installed or modified
+    assert not Dataset(
+        archive_ds_p / 'distributions' / 'bullseye' / 'packages' /
+        'hello').is_installed()
+    assert archive_ds.repo.get_hexsha() == hexsha
+    assert_repo_status(archive_ds_p)
+    # with the package dataset installed, the files to import are estimated
+    archive_ds.get(
+        archive_ds_p / 'distributions' / 'bullseye' / 'packages' / 'hello',
+        get_data=False, recursive=True, **ckwa)
+    bytesize = sum(
+        (pkg_ds_p / n).stat().st_size
+        for n in list(files) + ['hello_1.0-1.dsc', 'hello_1.0-1_amd64.deb'])
+    res = deb_update_reprepro_repository(
+        dataset=archive_ds_p, estimate=True, **ckwa)
+    assert_in_results(
+        res,
+        action='update_repository.estimate',
+        path=str(archive_ds_p),
+        includedsc=1,
+        includedeb=1,
+        packages_not_estimated=0,
+        bytesize=bytesize,
+    )
+    # same estimate with the files named in the .dsc
+    archive_ds.get(
+        archive_ds_p / 'distributions' / 'bullseye' / 'packages' / 'hello' /
+        'hello_1.0-1.dsc', **ckwa)
+    res = deb_update_reprepro_repository(
+        dataset=archive_ds_p, estimate=True, **ckwa)
+    assert_in_results(
+        res,
+        action='update_repository.estimate',
+        path=str(archive_ds_p),
+        imports=2,
+        bytesize=bytesize,
+    )
+
+
+@with_tempfile
+def test_register_pool_files(path=None):
+    path = Path(path)
+    dist_ds_p = path / 'dist'
+    pkg_ds_p = dist_ds_p / 'packages' / 'hello'
+    archive_ds_p = path / 'archive'
+    deb_new_distribution(dist_ds_p, **ckwa)
+    deb_new_package(dataset=dist_ds_p, name=pkg_ds_p.name, **ckwa)
+    # a backend that the archive would not use, to tell a reused key from
+    # one computed for the pool copy
+    with (pkg_ds_p / '.gitattributes').open('a') as f:
+        f.write('*.deb annex.backend=SHA256E\n')
+    (pkg_ds_p / 'hello_1.0-1_amd64.deb').write_bytes(b'deb' * 1000)
+    save(dataset=pkg_ds_p, **ckwa)
+    save(dataset=dist_ds_p, **ckwa)
+    deb_new_reprepro_repository(archive_ds_p, **ckwa)
+    (archive_ds_p / 'conf' / 'distributions').write_text(
+        'Codename: bullseye\nComponents: main\n'
+        'Architectures: source amd64\n')
+    save(dataset=archive_ds_p, **ckwa)
+    deb_add_distribution(
+        dataset=archive_ds_p, source=str(dist_ds_p), name='bullseye', **ckwa)
+    ds = Dataset(archive_ds_p)
+    www_ds = Dataset(archive_ds_p / 'www')
+    pkg_ds = Dataset(
+        archive_ds_p / 'distributions' / 'bullseye' / 'packages' / 'hello')
+    ds.get(pkg_ds.path, recursive=True, **ckwa)
+    deb = pkg_ds.pathobj / 'hello_1.0-1_amd64.deb'
+    pool_deb = www_ds.pathobj / 'pool' / 'main' / 'h' / 'hello' / deb.name
+    packages = www_ds.pathobj / 'dists' / 'bullseye' / 'main' / \
+        'binary-amd64' / 'Packages'
+
+    def fake_import(ds, dist_codename, updated_files, shards):
+        # what a reprepro import does: copy into the pool, update the
+        # indices, and commit them
+        updated_files.remove(deb)
+        pool_deb.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(deb, pool_deb)
+        packages.parent.mkdir(parents=True, exist_ok=True)
+        packages.write_text(f'Package: hello\nFilename: {pool_deb.name}\n')
+        www_ds.save(path='dists', **ckwa)
+        ds.save(path='www', message='Import hello', **ckwa)
+        yield from _register_pool_files(ds, [deb])
+
+    parent = ds.repo.get_hexsha()
+    with patch(
+            'datalad_debian.update_reprepro_repository._include_pkg_files',
+            fake_import):
+        list(_include_pkg_updates(ds, 'bullseye', [deb], move_content=True))
+    # the pool copy is registered under the key of the package file, the
+    # pool content is the copy itself
+    assert get_annex_key(deb).startswith('SHA256E-')
+    assert get_annex_key(pool_deb) == get_annex_key(deb)
+    assert www_ds.repo.file_has_content(
+        str(pool_deb.relative_to(www_ds.pathobj)))
+    assert pool_deb.read_bytes() == b'deb' * 1000
+    # with --move-content, the package dataset no longer has the content
+    assert not pkg_ds.repo.file_has_content(deb.name)
+    # the pool state is part of the import commit
+    assert ds.repo.get_hexsha('HEAD~1') == parent
+    assert ds.repo.format_commit('%s') == 'Import hello'
+    assert_repo_status(ds.path)
+    assert_repo_status(www_ds.path)
+
+
+@with_tempfile
+def test_update_single_package(path=None):
+    path = Path(path)
+    dist_ds_p = path / 'dist'
+    pkg_ds_p = dist_ds_p / 'packages' / 'hello'
+    archive_ds_p = path / 'archive'
+    deb_new_distribution(dist_ds_p, **ckwa)
+    deb_new_package(dataset=dist_ds_p, name=pkg_ds_p.name, **ckwa)
+    (pkg_ds_p / 'hello_1.0-1_amd64.deb').write_bytes(b'deb1')
+    save(dataset=pkg_ds_p, **ckwa)
+    save(dataset=dist_ds_p, **ckwa)
+    deb_new_reprepro_repository(archive_ds_p, **ckwa)
+    (archive_ds_p / 'conf' / 'distributions').write_text(
+        'Codename: bullseye\nComponents: main\n'
+        'Architectures: source amd64\n')
+    save(dataset=archive_ds_p, **ckwa)
+    deb_add_distribution(
+        dataset=archive_ds_p, source=str(dist_ds_p), name='bullseye', **ckwa)
+    archive_ds = Dataset(archive_ds_p)
+    archive_pkg_p = archive_ds_p / 'distributions' / 'bullseye' / \
+        'packages' / 'hello'
+    imports = []
+
+    def fake_run_import(ds, import_type, args, source_files, shards):
+        # stands in for reprepro, which updates 'www'
+        imports.append([p.name for p in source_files])
+        release = ds.pathobj / 'www' / 'dists' / 'bullseye' / 'Release'
+        release.parent.mkdir(parents=True, exist_ok=True)
+        if release.is_symlink():
+            release.unlink()
+        release.write_text(str(len(imports)))
+        yield from ds.save(path='www', recursive=True, **ckwa)
+        return True
+
+    def update():
+        with patch(
+                'datalad_debian.update_reprepro_repository._run_import',
+                fake_run_import):
+            res = deb_update_reprepro_repository(
+                str(archive_pkg_p), dataset=archive_ds_p, **ckwa)
+        assert_in_results(
+            res, action='update_repository', status='ok',
+            path=str(archive_pkg_p))
+
+    update()
+    assert imports == [['hello_1.0-1_amd64.deb']]
+    # an unchanged package dataset has nothing to import
+    update()
+    assert len(imports) == 1
+    # a new file in the package dataset is imported, and only that
+    (pkg_ds_p / 'hello_1.0-2_amd64.deb').write_bytes(b'deb2')
+    save(dataset=pkg_ds_p, **ckwa)
+    update()
+    assert imports[1:] == [['hello_1.0-2_amd64.deb']]
+    assert_repo_status(archive_ds_p)
+
+
+@with_tempfile
+def test_verify_uploads(path=None):
+    ds = create(path, **ckwa)
+    content = b'source' * 100
+    (ds.pathobj / 'hello_1.0.orig.tar.gz').write_bytes(content)
+    # not the same key as the intact file
+    (ds.pathobj / 'gone_1.0.orig.tar.gz').write_bytes(content + b'\n')
+
+    def write_dsc(name, files):
+        (ds.pathobj / name).write_text(
+            f'Format: 3.0 (quilt)\nSource: {name.split("_")[0]}\n'
+            'Checksums-Sha256:\n'
+            + ''.join(f' {hashlib.sha256(content).hexdigest()} {size} {f}\n'
+                      for f, size in files))
+
+    write_dsc('hello_1.0-1.dsc', [('hello_1.0.orig.tar.gz', len(content))])
+    # references a file that does not exist
+    write_dsc('missing_1.0-1.dsc', [('missing_1.0.orig.tar.gz', len(content))])
+    # references a file without content
+    write_dsc('gone_1.0-1.dsc', [('gone_1.0.orig.tar.gz', len(content) + 1)])
+    # cannot be parsed
+    write_dsc('malformed_1.0-1.dsc', [('malformed_1.0.orig.tar.gz', 'many')])
+    # has no content itself
+    write_dsc('dropped_1.0-1.dsc', [('dropped_1.0.orig.tar.gz', len(content))])
+    ds.save(**ckwa)
+    ds.drop(['gone_1.0.orig.tar.gz', 'dropped_1.0-1.dsc'],
+            reckless='kill', **ckwa)
+
+    updated_files = [
+        ds.pathobj / f for f in (
+            'hello_1.0-1.dsc', 'hello_1.0.orig.tar.gz', 'missing_1.0-1.dsc',
+            'gone_1.0-1.dsc', 'gone_1.0.orig.tar.gz', 'malformed_1.0-1.dsc',
+            'dropped_1.0-1.dsc')
+    ]
+    rejected = _verify_uploads(ds, updated_files)
+    # only the intact upload is left to import
+    assert updated_files == [
+        ds.pathobj / 'hello_1.0-1.dsc', ds.pathobj / 'hello_1.0.orig.tar.gz']
+    assert_result_count(rejected, 4)
+    for name, problem in (
+            ('missing_1.0-1.dsc', 'missing'),
+            ('gone_1.0-1.dsc', 'missing'),
+            ('malformed_1.0-1.dsc', 'cannot be read'),
+            ('dropped_1.0-1.dsc', 'cannot be read')):
+        res = [r for r in rejected if r['path'] == str(ds.pathobj / name)]
+        assert_in_results(
+            res, action='update_repository.verify', status='error')
+        assert problem in res[0]['message'][2]
+
+
+@with_tempfile
+def test_invalid_pdiff_history(path=None):
+    deb_new_reprepro_repository(path, **ckwa)
+    ds = Dataset(path)
+    hexsha = ds.repo.get_hexsha()
+    ds.config.set('datalad.debian.pdiff-history', 'many', scope='local')
+    res = deb_update_reprepro_repository(
+        dataset=path, on_failure='ignore', **ckwa)
+    assert_result_count(res, 1)
+    assert_in_results(res, action='update_repository', status='impossible')
+    assert 'datalad.debian.pdiff-history' in res[0]['message'][0]
+    # nothing was updated or configured
+    assert ds.repo.get_hexsha() == hexsha
+    assert not (ds.pathobj / 'conf' / 'pdiff-hook').exists()
+
+
+@with_tempfile
+def test_watch_step(path=None):
+    path = Path(path)
+    origin = Dataset(path / 'origin')
+    deb_new_distribution(origin.path, **ckwa)
+    dist_ds = clone(source=origin.path, path=path / 'dist', **ckwa)
+    siblings = {dist_ds.path: _get_tracking_sibling(dist_ds)}
+    assert siblings[dist_ds.path][0] == 'origin'
+    # a local sibling is polled every time
+    assert siblings[dist_ds.path][2]
+    states = {p: _get_sibling_state(Dataset(p), remote, ref)
+              for p, (remote, ref, _) in siblings.items()}
+    last_poll = {p: 0 for p in siblings}
+    pending = ChangeDebouncer(0)
+
+    def step():
+        return list(_watch_step(
+            path / 'archive', siblings, states, last_poll, pending, 300,
+            None, False, False))
+
+    with patch(
+            'datalad_debian.update_reprepro_repository._update_archive',
+            return_value=[]) as update_archive:
+        # the sibling did not change
+        step()
+        update_archive.assert_not_called()
+        (origin.pathobj / 'new').write_text('new')
+        origin.save(**ckwa)
+        # a new commit triggers an update from the distribution
+        step()
+        update_archive.assert_called_once_with(
+            path / 'archive', Path(dist_ds.path), None, False, False)
+        # and only once
+        step()
+        assert update_archive.call_count == 1
+
+
+def test_get_pkg_path():
+    ds = Dataset('/archive')
+    dists = ds.pathobj / 'distributions'
+    pkg = dists / 'bullseye' / 'packages' / 'tqdm'
+    assert _get_pkg_path(ds, None) is None
+    assert _get_pkg_path(ds, ds.pathobj) is None
+    assert _get_pkg_path(ds, dists / 'bullseye') is None
+    assert _get_pkg_path(ds, dists / 'bullseye' / 'packages') is None
+    assert _get_pkg_path(ds, pkg) == pkg
+    assert _get_pkg_path(ds, pkg / 'tqdm_4.57.0-1.dsc') == pkg
+
+
+def test_set_pdiff_index_lines():
+    conf = """\
+Codename: bullseye
+Components: main
+
+Codename: bookworm
+DebIndices: Packages Release .
+"""
+    enabled = _set_pdiff_index_lines(conf, True)
+    assert enabled.count(pdiff_index_lines[0]) == 1
+    assert enabled.count(pdiff_index_lines[1]) == 2
+    # custom settings are kept
+    assert 'DebIndices: Packages Release .\n' in enabled
+    assert _set_pdiff_index_lines(enabled, True) == enabled
+    assert _set_pdiff_index_lines(enabled, False) == conf
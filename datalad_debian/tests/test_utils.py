@@ -1,6 +1,27 @@
-from datalad.tests.utils_pytest import assert_raises
+import hashlib
+import threading
+import time
+from pathlib import Path
 
-from ..utils import result_matches
+from datalad.api import create
+from datalad.distribution.dataset import Dataset
+from datalad.tests.utils_pytest import (
+    assert_in_results,
+    assert_raises,
+    with_tempfile,
+)
+
+from ..utils import (
+    BoundedFeed,
+    ChangeDebouncer,
+    ShardedImports,
+    get_config_int,
+    get_dist_codename,
+    get_peak_memory,
+    parse_annex_key,
+    result_matches,
+    verify_file,
+)
 
 
 def test_result_matches():
@@ -23,3 +44,119 @@ def test_result_matches():
         dict(msg=('text %s', 'value')),
         msg=[('text %s', 'value'),]
     )
+
+
+def test_get_dist_codename():
+    dists = Path('/archive') / 'distributions'
+    assert get_dist_codename(Dataset(dists / 'bullseye')) == 'bullseye'
+    assert get_dist_codename(
+        Dataset(dists / 'bullseye-backports-arm64')) == 'bullseye'
+
+
+def test_bounded_feed():
+    feed = BoundedFeed(range(10), 2)
+    it = iter(feed)
+    assert next(it) == 0
+    assert next(it) == 1
+    # no free slot, and closed: iteration stops instead of blocking
+    feed.close()
+    assert list(it) == []
+
+    feed = BoundedFeed(range(5), 2)
+    seen = []
+    for i in feed:
+        seen.append(i)
+        feed.task_done()
+    assert seen == list(range(5))
+
+
+def test_get_peak_memory():
+    peak = get_peak_memory()
+    # whatever the platform reports, it cannot be less than a megabyte
+    # for a running Python process
+    assert peak is None or peak > 1024 ** 2
+
+
+def test_parse_annex_key():
+    assert parse_annex_key('SHA256E-s1234--abcdef.tar.gz') == dict(
+        backend='SHA256E', size=1234, hash='abcdef', algorithm='sha256')
+    assert parse_annex_key('MD5-s5--abc') == dict(
+        backend='MD5', size=5, hash='abc', algorithm='md5')
+    assert parse_annex_key('URL--http&c%%example.com%f') == dict(
+        backend='URL', size=None, hash='http&c%%example.com%f',
+        algorithm=None)
+    assert parse_annex_key('not a key') is None
+
+
+def test_change_debouncer():
+    d = ChangeDebouncer(10)
+    assert d.due(0) == []
+    d.changed('a', 0)
+    d.changed('b', 5)
+    assert d.due(9) == []
+    assert d.due(10) == ['a']
+    # another change resets the timer
+    d.changed('b', 12)
+    assert d.due(20) == []
+    assert d.due(22) == ['b']
+    # nothing pending anymore
+    assert d.due(100) == []
+
+
+def test_sharded_imports():
+    shards = ShardedImports()
+    events = []
+
+    def claim(names, label):
+        with shards.pool_files(names):
+            events.append(f'{label}-start')
+            time.sleep(0.2)
+            events.append(f'{label}-end')
+
+    with shards.pool_files(['a.deb', 'b.deb']):
+        # a disjoint claim does not have to wait
+        t1 = threading.Thread(target=claim, args=(['c.deb'], 'c'))
+        # an overlapping claim has to wait for the release
+        t2 = threading.Thread(target=claim, args=(['b.deb'], 'b'))
+        t1.start()
+        t2.start()
+        t1.join()
+        assert events == ['c-start', 'c-end']
+    t2.join()
+    assert events == ['c-start', 'c-end', 'b-start', 'b-end']
+
+
+@with_tempfile
+def test_verify_file(path=None):
+    path = Path(path)
+    path.write_bytes(b'content')
+    sha256 = hashlib.sha256(b'content').hexdigest()
+    assert verify_file((path, dict(size=7, sha256=sha256))) is None
+    # only the size is checked without a checksum
+    assert verify_file((path, dict(size=7))) is None
+    assert 'Size mismatch' in verify_file((path, dict(size=8)))[0]
+    assert verify_file((path, dict(size=7, sha256='0' * 64)))
+
+
+@with_tempfile
+def test_get_config_int(path=None):
+    ds = create(path, result_renderer='disabled')
+
+    def get(**kwargs):
+        res = []
+        gen = get_config_int(ds, 'datalad.debian.test', 5, 'test', **kwargs)
+        while True:
+            try:
+                res.append(next(gen))
+            except StopIteration as e:
+                return e.value, res
+
+    # the default
+    assert get() == (5, [])
+    ds.config.set('datalad.debian.test', '12', scope='local')
+    assert get() == (12, [])
+    for value, kwargs in (('many', {}), ('-1', {}), ('0', dict(minimum=1))):
+        ds.config.set('datalad.debian.test', value, scope='local')
+        number, res = get(**kwargs)
+        assert number is None
+        assert_in_results(res, action='test', status='impossible')
@@ -0,0 +1,95 @@
+import hashlib
+from pathlib import Path
+
+from datalad.tests.utils_pytest import (
+    assert_in_results,
+    assert_result_count,
+    with_tempfile,
+)
+
+from datalad.api import (
+    Dataset,
+    deb_new_reprepro_repository,
+    deb_verify_archive,
+)
+
+ckwa = dict(result_renderer='disabled', on_failure='ignore')
+
+
+def _stanza(path, content, md5=True, sha256=None):
+    return (
+        f"Package: {path.split('/')[-1].split('_')[0]}\n"
+        f"Filename: {path}\n"
+        f"Size: {len(content)}\n"
+        + (f"MD5sum: {hashlib.md5(content).hexdigest()}\n" if md5 else '')
+        + f"SHA256: {sha256 or hashlib.sha256(content).hexdigest()}\n\n"
+    )
+
+
+@with_tempfile
+def test_verify_archive(path=None):
+    path = Path(path)
+    deb_new_reprepro_repository(path, **ckwa)
+    www = Dataset(path / 'www')
+    pool = www.pathobj / 'pool' / 'main' / 'h' / 'hello'
+    pool.mkdir(parents=True)
+    files = {
+        # annexed, MD5E key matches index
+        'annexed_1_all.deb': (b'annexed', {}),
+        # in git, verified by checksum
+        'ingit_1_all.deb': (b'ingit', dict(md5=False)),
+        # corrupted
+        'broken_1_all.deb': (b'broken', dict(md5=False, sha256='0' * 64)),
+    }
+    packages = ''
+    for name, (content, props) in files.items():
+        (pool / name).write_bytes(content)
+        packages += _stanza(f'pool/main/h/hello/{name}', content, **props)
+    packages += _stanza('pool/main/h/hello/missing_1_all.deb', b'missing')
+    (pool / 'orphan_1_all.deb').write_bytes(b'orphan')
+    index = www.pathobj / 'dists' / 'bullseye' / 'main' / 'binary-all' / \
+        'Packages'
+    index.parent.mkdir(parents=True)
+    index.write_text(packages)
+    www.save(path=pool / 'ingit_1_all.deb', to_git=True, **ckwa)
+    Dataset(path).save(recursive=True, **ckwa)
+
+    res = deb_verify_archive(dataset=path, jobs=2, **ckwa)
+    assert_in_results(
+        res, status='error', verification='mismatch',
+        path=str(pool / 'broken_1_all.deb'))
+    assert_in_results(
+        res, status='error', verification='missing',
+        path=str(pool / 'missing_1_all.deb'))
+    assert_in_results(
+        res, status='error', verification='orphan',
+        path=str(pool / 'orphan_1_all.deb'))
+    assert_result_count(res, 3, action='verify_archive', type='file')
+    assert_in_results(
+        res, action='verify_archive', status='error',
+        verified=1, skipped=1, mismatch=1, missing=1, orphan=1)
+
+    # without content the annexed file can still be verified by key,
+    # but a corrupted one cannot be checked anymore
+    www.drop(pool / 'broken_1_all.deb', reckless='kill', **ckwa)
+    res = deb_verify_archive(dataset=path, **ckwa)
+    assert_in_results(
+        res, status='impossible', verification='unavailable',
+        path=str(pool / 'broken_1_all.deb'))
+    www.drop(pool / 'annexed_1_all.deb', reckless='kill', **ckwa)
+    res = deb_verify_archive(dataset=path, **ckwa)
+    assert_in_results(res, action='verify_archive', skipped=1, verified=1)
+
+    # a file that cannot be read is reported, and does not stop the
+    # verification, also without parallel jobs
+    (pool / 'unreadable_1_all.deb').mkdir()
+    packages += _stanza('pool/main/h/hello/unreadable_1_all.deb', b'dir')
+    index.unlink()
+    index.write_text(packages)
+    res = deb_verify_archive(dataset=path, jobs=0, **ckwa)
+    assert_in_results(
+        res, status='error', verification='unreadable',
+        path=str(pool / 'unreadable_1_all.deb'))
+    assert_in_results(
+        res, action='verify_archive', status='error', verified=1,
+        unreadable=1)
@@ -1,33 +1,128 @@
 import logging
-from pathlib import Path
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from pathlib import (
+    Path,
+    PurePosixPath,
+)
 from debian.deb822 import (
     Changes,
     Dsc,
 )
 
+from datalad.core.local.run import run_command
 from datalad.distribution.dataset import (
+    Dataset,
     EnsureDataset,
     datasetmethod,
     require_dataset,
+    resolve_path,
 )
 from datalad.interface.base import (
     Interface,
     build_doc,
 )
+from datalad.interface.common_opts import jobs_opt
 from datalad.interface.results import get_status_dict
 from datalad.interface.utils import (
     eval_results,
 )
+from datalad.runner import (
+    Runner,
+    StdOutErrCapture,
+)
 from datalad.support.constraints import (
+    EnsureFloat,
     EnsureNone,
     EnsureStr,
 )
+from datalad.support.exceptions import (
+    CapturedException,
+    CommandError,
+)
+from datalad.support.parallel import ProducerConsumer
 from datalad.support.param import Parameter
 
+from datalad_debian.archive_index import (
+    add_verified_keys,
+    get_entry_files,
+    get_index_db_path,
+    get_verified_keys,
+    iter_index_entries,
+    iter_index_files,
+)
+from datalad_debian.archive_query import update_archive_index
+from datalad_debian.archive_snapshot import tag_archive_snapshot
+from datalad_debian.debdeltas import (
+    generate_debdeltas,
+    get_binary_files,
+)
+from datalad_debian.utils import (
+    BoundedFeed,
+    ChangeDebouncer,
+    ShardedImports,
+    get_annex_key,
+    get_dist_codename,
+    get_peak_memory,
+    matches_annex_key,
+    parse_annex_key,
+    verify_file,
+)
 
 lgr = logging.getLogger('datalad.debian.new_distribution')
 
 
+# the types of reprepro imports performed
+import_types = ('includechanges', 'includedsc', 'includedeb')
+# weight of the most recent import duration in the running average
+# of import durations of a type
+duration_avg_weight = 0.2
+# number of updated package datasets of a distribution that are installed
+# at once, and then planned and imported, before the next ones are
+# considered
+pkg_batch_size = 64
+
+# reprepro imports only save the indices and the reprepro database,
+# pool files are saved by _register_pool_files()
+import_kwargs = dict(
+    outputs=['db', 'www/dists'],
+    explicit=True,
+    # do not unlock the outputs, reprepro replaces them
+    assume_ready='outputs',
+    result_renderer='disabled',
+)
+
+# reprepro options of a per-codename instance
+shard_opts_tmpl = """\
+# generated from conf/options, do not edit
+{options}
+outdir +b/../../www
+# the pool is shared with the instances of other codenames,
+# deb-update-reprepro-repository removes files no instance references
+keepunreferencedfiles
+"""
+
+# index hook of reprepro instances that generate pdiffs (relative to
+# the reprepro configuration directory)
+pdiff_hook_name = 'pdiff-hook'
+pdiff_hook_tmpl = """\
+#!/bin/sh
+# generated from the configuration datalad.debian.pdiff-history,
+# do not edit
+exec rredtool --max-patch-count={history} "$@"
+"""
+# index configuration that makes reprepro call the pdiff hook on export
+pdiff_index_lines = (
+    f'DebIndices: Packages Release . .gz {pdiff_hook_name}',
+    f'DscIndices: Sources Release . .gz {pdiff_hook_name}',
+)
+
+# the hexsha of the empty tree, to compare a first commit against
+empty_tree_hexsha = '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
+
 ckwa = dict(
     result_xfm=None,
     result_renderer='disabled',
@@ -40,6 +135,31 @@ ckwa = dict(
 @build_doc
 class UpdateRepreproRepository(Interface):
     """Update a (reprepro) Debian archive repository dataset
+
+    Most of the time of an update is spent waiting for git, git-annex, and
+    network transfers. With [PY: `jobs` PY][CMD: --jobs CMD], the update of
+    distribution datasets, and the preparation of package imports
+    (obtaining package datasets, determining new files, and retrieving their
+    content) are performed concurrently. The actual imports into the archive
+    are always performed one after another, because reprepro locks its
+    database, and each import is recorded as a separate commit.
+
+    If the update is constrained to a package dataset, only this package
+    dataset is updated (from its own sibling), and only its new files are
+    imported. All other distribution and package datasets are left as they
+    are. This is meant for urgent updates of individual packages, which
+    should not have to wait for a full archive update.
+
+    Each update that changes the archive is recorded as a snapshot, see
+    [CMD: deb-archive-snapshot CMD][PY: deb_archive_snapshot PY].
+
+    If the configuration 'datalad.debian.pdiff-history' is set to a number
+    of patches, reprepro is configured to generate pdiffs (e.g.
+    Packages.diff/Index) for all Packages and Sources indices with each
+    export, keeping this many patches. APT clients then only download the
+    changes of an index since their last update. Distributions with custom
+    'DebIndices' or 'DscIndices' settings in conf/distributions are left
+    as they are. Setting it to 0 disables pdiff generation again.
     """
     _params_ = dict(
         dataset=Parameter(
@@ -50,80 +170,773 @@ class UpdateRepreproRepository(Interface):
             args=("path",),
             nargs='?',
             metavar='PATH',
-            doc="""path to constrain the update to""",
+            doc="""path to constrain the update to. This can be the path of
+            a distribution dataset (or any path inside one) to limit the
+            update to this distribution, or the path of a package dataset
+            of a distribution to only update and import this package""",
             # put dataset 2nd to avoid useless conversion
             constraints=EnsureStr() | EnsureDataset() | EnsureNone()),
+        jobs=jobs_opt,
+        watch=Parameter(
+            args=("--watch",),
+            metavar='SECONDS',
+            doc="""after the update, keep monitoring the siblings of all
+            (matching) distribution datasets for changes, and run an update
+            constrained to a changed distribution whenever it saw a
+            change. Siblings on a remote host are polled at the given
+            interval, siblings with a local path are checked every
+            second. Monitoring continues until interrupted""",
+            constraints=EnsureFloat() | EnsureNone()),
+        debounce=Parameter(
+            args=("--debounce",),
+            metavar='SECONDS',
+            doc="""in watch mode, the time a distribution sibling must not
+            have changed anymore before an update is triggered. This
+            coalesces bursts of pushes into a single update""",
+            constraints=EnsureFloat()),
+        estimate=Parameter(
+            args=("--estimate",),
+            doc="""do not import anything, but report the number of imports,
+            the amount of data that would need to be transferred, and an
+            estimate of the time needed for the imports (based on the
+            durations of imports in previous updates). Nothing is
+            modified or installed, distribution datasets (and, if needed,
+            package datasets) are only fetched from, and no file content
+            is obtained. Package datasets that are not installed are
+            only counted""",
+            action='store_true'),
+        move_content=Parameter(
+            args=("--move-content",),
+            doc="""drop the content of imported files from the package
+            datasets after an import, such that it is only kept once, in
+            the archive. Content is only dropped if git-annex can confirm
+            that another copy exists, e.g. in the sibling a package dataset
+            was obtained from""",
+            action='store_true'),
+        debdeltas=Parameter(
+            args=("--debdeltas",),
+            doc="""after the imports, generate debdelta files between the
+            previous and the new version of each updated binary package.
+            Deltas are published in the 'debdeltas/' directory of the
+            archive, with the directory layout of the package pool, for use
+            with debdelta-upgrade. Requires debdelta to be installed""",
+            action='store_true'),
     )
 
-    _examples_ = []
+    _examples_ = [
+        dict(text="Update the archive from a single distribution only",
+             code_cmd="datalad deb-update-reprepro-repository "
+                      "distributions/bullseye",
+             code_py="deb_update_reprepro_repository("
+                     "'distributions/bullseye')"),
+        dict(text="Import a new upload of a single package right away",
+             code_cmd="datalad deb-update-reprepro-repository "
+                      "distributions/bullseye/packages/hello",
+             code_py="deb_update_reprepro_repository("
+                     "'distributions/bullseye/packages/hello')"),
+        dict(text="Keep updating the archive whenever a distribution "
+                  "changes, polling remote distribution siblings every five "
+                  "minutes",
+             code_cmd="datalad deb-update-reprepro-repository --watch 300",
+             code_py="deb_update_reprepro_repository(watch=300)"),
+        dict(text="Report what an update would import, and how long it "
+                  "would likely take, without performing it",
+             code_cmd="datalad deb-update-reprepro-repository --estimate",
+             code_py="deb_update_reprepro_repository(estimate=True)"),
+    ]
 
     @staticmethod
     @datasetmethod(name='deb_update_reprepro_repository')
     @eval_results
-    def __call__(path=None, *, dataset=None):
+    def __call__(path=None, *, dataset=None, jobs='auto', watch=None,
+                 debounce=10.0, estimate=False, move_content=False,
+                 debdeltas=False):
         reprepro_ds = require_dataset(dataset)
 
-        # TODO allow user-provided reference commitish
-        # last recorded update of www subdataset
-        last_update_hexsha = reprepro_ds.repo.call_git_oneline(
-            ['log', '-1', '--format=%H'], files='www')
-        lgr.debug('Using archive update ref %r', last_update_hexsha)
-
-        # we want to make sure all the distributions are up-to-date,
-        # we need the respective superdatasets to be able to run
-        # update() on them
-        yield from reprepro_ds.get(
-            'distributions',
-            get_data=False,
-            recursive=True,
-            recursion_limit=1,
-            result_renderer="disabled",
-        )
-
-        dist_subdatasets = reprepro_ds.subdatasets(
-            'distributions',
-            result_xfm='datasets',
-            result_renderer="disabled",
-        )
-        for dist_sds in dist_subdatasets:
-            yield from dist_sds.update(
-                # 'reset' means we intentionally discard any local change
-                how='reset',
-                follow='parentds-lazy',
-                # we cannot limit recursion without risking a dataset hierarchy
-                # that is not in-sync
-                recursive=True,
-                result_renderer="disabled",
+        if path is None:
+            constraint = None
+        elif isinstance(path, Dataset):
+            constraint = path.pathobj
+        else:
+            constraint = resolve_path(path, dataset)
+        dists = reprepro_ds.pathobj / 'distributions'
+        if constraint not in (None, reprepro_ds.pathobj, dists) \
+                and dists not in constraint.parents:
+            yield get_status_dict(
+                status='impossible',
+                ds=reprepro_ds,
+                action='update_repository',
+                message=('Path %s does not point to a distribution dataset',
+                         constraint),
             )
-        yield from reprepro_ds.save(
-            'distributions',
-            message='Update distribution subdatasets',
-            result_renderer="disabled",
+            return
 
-        )
+        if estimate:
+            yield from _estimate_update(reprepro_ds, constraint, jobs)
+            return
 
-        # which distributions saw an update since the last update of 'www'
-        # this is not necessarily identical to what was saved above
-        updated_dists = [
-            d for d in reprepro_ds.diff(
-                'distributions',
-                fr=last_update_hexsha,
-                result_xfm='datasets',
-                result_renderer='disabled')
-            if d in dist_subdatasets
-        ]
-        # TODO could be done in parallel
+        pkg_path = _get_pkg_path(reprepro_ds, constraint)
+        if pkg_path:
+            yield from _update_package(
+                reprepro_ds, pkg_path, move_content, debdeltas)
+        else:
+            yield from _update_archive(
+                reprepro_ds, constraint, jobs, move_content, debdeltas)
+
+        if watch is not None:
+            yield from _watch_distributions(
+                reprepro_ds, constraint, jobs, watch, debounce, move_content,
+                debdeltas)
+
+
+def _update_archive(reprepro_ds, constraint, jobs, move_content=False,
+                    debdeltas=False):
+    # TODO allow user-provided reference commitish
+    # last recorded update of www subdataset
+    last_update_hexsha = reprepro_ds.repo.call_git_oneline(
+        ['log', '-1', '--format=%H'], files='www')
+    lgr.debug('Using archive update ref %r', last_update_hexsha)
+    if not (yield from _configure_pdiffs(reprepro_ds)):
+        return
+    if debdeltas:
+        old_binaries, old_www = yield from _get_debdelta_base(reprepro_ds)
+
+    updated_dists = []
+    yield from _update_dists(
+        reprepro_ds, constraint, last_update_hexsha, jobs, updated_dists)
+    if reprepro_ds.config.get(
+            'datalad.debian.archive-layout', 'single') == 'per-codename':
+        yield from _update_shards(
+            reprepro_ds, updated_dists, last_update_hexsha, jobs,
+            move_content)
+    else:
         for ud in updated_dists:
             yield from _get_updates_from_dist(
                 reprepro_ds,
                 ud,
                 last_update_hexsha,
+                jobs,
+                move_content=move_content,
+            )
+    # keep the query index in sync with the archive
+    yield from update_archive_index(reprepro_ds)
+    if debdeltas:
+        yield from generate_debdeltas(reprepro_ds, old_binaries, old_www)
+    yield from tag_archive_snapshot(reprepro_ds)
+
+    yield get_status_dict(
+        status='ok',
+        ds=reprepro_ds,
+        action='update_repository',
+        # high-water mark of the memory use of the entire update
+        peak_memory=get_peak_memory(),
+    )
+
+
+def _get_pkg_path(ds, constraint):
+    """Return the path of the package dataset matching a constraint, if any"""
+    if constraint is None or constraint == ds.pathobj:
+        return None
+    parts = constraint.relative_to(ds.pathobj / 'distributions').parts
+    if len(parts) < 3 or parts[1] != 'packages':
+        return None
+    return ds.pathobj.joinpath('distributions', *parts[:3])
+
+
+def _update_package(reprepro_ds, pkg_path, move_content=False,
+                    debdeltas=False):
+    """Update a single package dataset, and import its new files
+
+    The package dataset is updated from its own sibling, and the new state
+    is only recorded in its distribution dataset. Updating the distribution
+    dataset itself would record changes of other packages, which would then
+    be considered imported by the next update.
+    """
+    last_update_hexsha = reprepro_ds.repo.call_git_oneline(
+        ['log', '-1', '--format=%H'], files='www')
+    lgr.debug('Using archive update ref %r', last_update_hexsha)
+    if not (yield from _configure_pdiffs(reprepro_ds)):
+        return
+    if debdeltas:
+        old_binaries, old_www = yield from _get_debdelta_base(reprepro_ds)
+
+    yield from reprepro_ds.get(
+        pkg_path,
+        get_data=False,
+        **ckwa
+    )
+    pkg_ds = Dataset(pkg_path)
+    if not pkg_ds.is_installed():
+        yield get_status_dict(
+            status='impossible',
+            ds=reprepro_ds,
+            action='update_repository',
+            message=('Path %s does not point to a package dataset',
+                     pkg_path),
+        )
+        return
+    yield from pkg_ds.update(
+        how='reset',
+        follow='sibling',
+        **ckwa
+    )
+    # records the new state in the distribution dataset too
+    yield from reprepro_ds.save(
+        pkg_path,
+        message=f'Update package dataset {pkg_path.name}',
+        **ckwa
+    )
+
+    dist_codename = get_dist_codename(Dataset(pkg_path.parent.parent))
+    shards = None
+    if reprepro_ds.config.get(
+            'datalad.debian.archive-layout', 'single') == 'per-codename':
+        configured = yield from _configure_shards(
+            reprepro_ds, [dist_codename])
+        if not configured:
+            return
+        shards = ShardedImports()
+    updated_files, rejected = _get_pkg_updates(
+        reprepro_ds, pkg_ds, last_update_hexsha)
+    yield from rejected
+    yield from _include_pkg_updates(
+        reprepro_ds, dist_codename, updated_files, move_content, shards)
+    if shards is not None:
+        yield from _remove_unreferenced_pool_files(reprepro_ds)
+    yield from update_archive_index(reprepro_ds)
+    if debdeltas:
+        yield from generate_debdeltas(reprepro_ds, old_binaries, old_www)
+    yield from tag_archive_snapshot(reprepro_ds)
+
+    yield get_status_dict(
+        status='ok',
+        ds=reprepro_ds,
+        action='update_repository',
+        path=str(pkg_path),
+        peak_memory=get_peak_memory(),
+    )
+
+
+def _get_debdelta_base(reprepro_ds):
+    """Report the binary packages, and the commit of 'www' before an update
+
+    Returns
+    -------
+    tuple
+      As expected by `generate_debdeltas()`.
+    """
+    yield from update_archive_index(reprepro_ds)
+    return (
+        get_binary_files(reprepro_ds),
+        Dataset(reprepro_ds.pathobj / 'www').repo.get_hexsha(),
+    )
+
+
+def _update_shards(reprepro_ds, updated_dists, ref, jobs, move_content):
+    """Import updates into per-codename reprepro instances
+
+    Distributions with different codenames are processed concurrently.
+    """
+    dists_by_codename = {}
+    for ud in updated_dists:
+        dists_by_codename.setdefault(get_dist_codename(ud), []).append(ud)
+    codenames = yield from _configure_shards(
+        reprepro_ds, dists_by_codename.keys())
+    shards = ShardedImports()
+    yield from ProducerConsumer(
+        codenames,
+        lambda c: _update_shard(
+            reprepro_ds, c, dists_by_codename[c], ref, jobs, move_content,
+            shards),
+        jobs=jobs,
+    )
+    yield from _remove_unreferenced_pool_files(reprepro_ds)
+
+
+def _update_shard(ds, codename, dists, ref, jobs, move_content, shards):
+    for ud in dists:
+        yield from _get_updates_from_dist(
+            ds,
+            ud,
+            ref,
+            jobs,
+            move_content=move_content,
+            shards=shards,
+        )
+    yield get_status_dict(
+        status='ok',
+        ds=ds,
+        action='update_repository.shard',
+        path=str(ds.pathobj / 'shards' / codename),
+        type='directory',
+        codename=codename,
+    )
+
+
+def _configure_shards(ds, codenames):
+    """Derive the configuration of per-codename reprepro instances
+
+    Returns
+    -------
+    list
+      Codenames with a valid configuration.
+    """
+    conf = ds.pathobj / 'conf'
+    stanzas = _get_dist_config_stanzas(
+        (conf / 'distributions').read_text())
+    options = [
+        line for line in (conf / 'options').read_text().splitlines()
+        # the output location is relative to the instance
+        if line.split(maxsplit=1)[:1] != ['outdir']
+    ]
+    configured = []
+    changed = []
+    for codename in sorted(codenames):
+        if codename not in stanzas:
+            yield get_status_dict(
+                status='impossible',
+                ds=ds,
+                action='update_repository',
+                message=('No configuration for codename %r in %s',
+                         codename, conf / 'distributions'),
             )
+            continue
+        configured.append(codename)
+        shard_conf = ds.pathobj / 'shards' / codename / 'conf'
+        shard_conf.mkdir(parents=True, exist_ok=True)
+        shard_files = [
+            ('distributions', stanzas[codename]),
+            ('options', shard_opts_tmpl.format(options='\n'.join(options))),
+        ]
+        if (conf / pdiff_hook_name).exists():
+            shard_files.append(
+                (pdiff_hook_name, (conf / pdiff_hook_name).read_text()))
+        for name, content in shard_files:
+            f = shard_conf / name
+            if not f.exists() or f.read_text() != content:
+                f.write_text(content)
+                changed.append(f)
+            if name == pdiff_hook_name:
+                f.chmod(0o755)
+    if changed:
+        yield from ds.save(
+            path=changed,
+            message='Update reprepro shard configuration',
+            **ckwa
+        )
+    return configured
+
+
+def _configure_pdiffs(ds):
+    """Configure reprepro's pdiff generation according to the configuration
+
+    Only index settings made by this function are ever changed.
+
+    Returns
+    -------
+    bool
+      Whether the configuration is valid. Nothing is changed otherwise.
+    """
+    value = ds.config.get('datalad.debian.pdiff-history', 0)
+    try:
+        history = int(value)
+    except (TypeError, ValueError):
+        history = -1
+    if history < 0:
+        yield get_status_dict(
+            status='impossible',
+            ds=ds,
+            action='update_repository',
+            message=('Invalid configuration datalad.debian.pdiff-history=%r, '
+                     'expected the number of patches to keep (0 disables '
+                     'pdiffs)', value),
+        )
+        return False
+    conf = ds.pathobj / 'conf'
+    hook = conf / pdiff_hook_name
+    dists_conf = conf / 'distributions'
+    changed = []
+    if history > 0:
+        content = pdiff_hook_tmpl.format(history=history)
+        if not hook.exists() or hook.read_text() != content:
+            hook.write_text(content)
+            changed.append(hook)
+        hook.chmod(0o755)
+    elif hook.exists():
+        hook.unlink()
+        changed.append(hook)
+    text = dists_conf.read_text()
+    new_text = _set_pdiff_index_lines(text, history > 0)
+    if new_text != text:
+        dists_conf.write_text(new_text)
+        changed.append(dists_conf)
+    if changed:
+        yield from ds.save(
+            path=changed,
+            message='Update pdiff configuration',
+            **ckwa
+        )
+    return True
+
+
+def _set_pdiff_index_lines(text, enable):
+    """Add (or remove) the pdiff index configuration of all distributions"""
+    stanzas = []
+    for stanza in text.split('\n\n'):
+        lines = [
+            line for line in stanza.split('\n')
+            if line not in pdiff_index_lines
+        ]
+        fields = {line.partition(':')[0].strip() for line in lines}
+        if enable and 'Codename' in fields:
+            # the last line of the last stanza may be empty
+            trailing = [] if lines[-1] else [lines.pop()]
+            lines.extend(
+                line for line in pdiff_index_lines
+                if line.partition(':')[0] not in fields)
+            lines.extend(trailing)
+        stanzas.append('\n'.join(lines))
+    return '\n\n'.join(stanzas)
+
+
+def _get_dist_config_stanzas(text):
+    """Split a reprepro distributions config into stanzas by codename"""
+    stanzas = {}
+    for stanza in text.split('\n\n'):
+        for line in stanza.splitlines():
+            field, _, value = line.partition(':')
+            if field.strip() == 'Codename' and value.strip():
+                stanzas[value.strip()] = stanza.strip('\n') + '\n'
+    return stanzas
+
+
+def _remove_unreferenced_pool_files(ds):
+    """Remove pool files that no package index references anymore
+
+    Per-codename reprepro instances keep unreferenced files, because they
+    do not know whether another instance still references them. A file is
+    only removed when the package indices of all codenames no longer
+    reference it, and it is then also removed from the files database of
+    every instance that still registers it. Otherwise a later import of
+    the same file would consider it present in the pool, and not copy it
+    again.
+    """
+    www_ds = Dataset(ds.pathobj / 'www')
+    referenced = set()
+    try:
+        for index in iter_index_files(www_ds.pathobj):
+            for entry in iter_index_entries(index):
+                referenced.update(get_entry_files(entry))
+    except FileNotFoundError as e:
+        # never remove anything based on incomplete information
+        yield get_status_dict(
+            status='impossible',
+            ds=ds,
+            action='update_repository.cleanup',
+            message='Package index not available, keeping all pool files',
+            exception=CapturedException(e),
+        )
+        return
+    unreferenced = [
+        p for p in www_ds.repo.call_git_items_(
+            ['ls-files', '--', 'pool'], read_only=True)
+        if p not in referenced
+    ]
+    if not unreferenced:
+        return
+    # the files each instance registers without referencing them
+    registered = {}
+    for shard in sorted((ds.pathobj / 'shards').glob('*/db')):
+        try:
+            registered[shard.parent] = set(
+                Runner(cwd=ds.path).run(
+                    ['reprepro', '-b', str(shard.parent), 'dumpunreferenced'],
+                    protocol=StdOutErrCapture)['stdout'].splitlines())
+        except CommandError as e:
+            yield get_status_dict(
+                status='impossible',
+                ds=ds,
+                action='update_repository.cleanup',
+                path=str(shard.parent),
+                message='Cannot query files database, keeping all pool files',
+                exception=CapturedException(e),
+            )
+            return
+    forgotten = []
+    for shard, files in registered.items():
+        to_forget = [p for p in unreferenced if p in files]
+        if not to_forget:
+            continue
+        try:
+            Runner(cwd=ds.path).run(
+                ['reprepro', '-b', str(shard), '_forget'] + to_forget,
+                protocol=StdOutErrCapture)
+        except CommandError as e:
+            yield get_status_dict(
+                status='error',
+                ds=ds,
+                action='update_repository.cleanup',
+                path=str(shard),
+                message=('Cannot remove %i file(s) from files database, '
+                         'keeping them in the pool', len(to_forget)),
+                exception=CapturedException(e),
+            )
+            unreferenced = [p for p in unreferenced if p not in files]
+            continue
+        forgotten.append(shard / 'db')
+    if not unreferenced and not forgotten:
+        return
+    for p in unreferenced:
+        (www_ds.pathobj / p).unlink()
+    yield from ds.save(
+        path=[www_ds.pathobj / p for p in unreferenced] + forgotten,
+        message='Remove unreferenced pool files',
+        **ckwa
+    )
+
+
+def _estimate_update(reprepro_ds, constraint, jobs):
+    """Estimate the import effort of an update, without performing it
+
+    Neither the archive dataset, nor the checkout of any distribution or
+    package dataset is modified, and nothing is installed. Installed
+    distribution datasets are fetched from their siblings, and installed
+    package datasets are fetched from, if the package state a distribution
+    declares is not yet available. The changes of package datasets that
+    are not installed cannot be estimated, and are only counted.
+    """
+    last_update_hexsha = reprepro_ds.repo.call_git_oneline(
+        ['log', '-1', '--format=%H'], files='www')
+    dist_subdatasets = _get_dist_paths(reprepro_ds, constraint)
+    if not dist_subdatasets:
+        yield get_status_dict(
+            status='notneeded',
+            ds=reprepro_ds,
+            action='update_repository.estimate',
+            message=('No distribution dataset matches %s', constraint)
+            if constraint else 'No distribution dataset registered',
+        )
+        return
+    durations = _get_import_durations(reprepro_ds)
+    total = {}
+    for dist_path in dist_subdatasets:
+        dist_ds = Dataset(dist_path)
+        if not dist_ds.is_installed():
+            yield get_status_dict(
+                status='impossible',
+                ds=reprepro_ds,
+                path=dist_path,
+                action='update_repository.estimate',
+                message='Distribution dataset is not installed, '
+                        'cannot estimate its updates',
+            )
+            continue
+        estimate = {}
+        yield from _estimate_dist_updates(
+            reprepro_ds, dist_ds, last_update_hexsha, jobs, estimate)
+        if not estimate:
+            # no package changed
+            continue
+        _add_counts(total, estimate)
+        yield _get_estimate_result(
+            estimate, durations, ds=reprepro_ds, path=dist_path)
+    yield _get_estimate_result(total, durations, ds=reprepro_ds)
+
+
+def _update_dists(reprepro_ds, constraint, ref, jobs, updated_dists):
+    """Update all distribution datasets matching a constraint
+
+    Any distribution dataset that changed since `ref` is appended to
+    `updated_dists`.
+    """
+    # we want to make sure all the distributions are up-to-date,
+    # we need the respective superdatasets to be able to run
+    # update() on them
+    yield from reprepro_ds.get(
+        _get_dists_root(reprepro_ds, constraint),
+        get_data=False,
+        recursive=True,
+        recursion_limit=1,
+        jobs=jobs,
+        result_renderer="disabled",
+        return_type='generator',
+        # we leave the flow-control to the caller
+        on_failure='ignore',
+    )
+
+    # only the paths are kept, to be able to tell distribution datasets
+    # apart from other changes. This record grows with the number of
+    # distributions. Updated package datasets are processed in batches of
+    # a fixed size, and their files as a stream
+    dist_subdatasets = _get_dist_paths(reprepro_ds, constraint)
+    if not dist_subdatasets:
+        yield get_status_dict(
+            status='notneeded',
+            ds=reprepro_ds,
+            action='update_repository',
+            message=('No distribution dataset matches %s', constraint)
+            if constraint else 'No distribution dataset registered',
+        )
+        return
+    # distribution datasets are independent of each other, and their
+    # update is dominated by network transfers
+    yield from ProducerConsumer(
+        (Dataset(p) for p in dist_subdatasets),
+        _update_dist,
+        jobs=jobs,
+    )
+    yield from reprepro_ds.save(
+        dist_subdatasets,
+        message='Update distribution subdatasets',
+        result_renderer="disabled",
+
+    )
+
+    # which distributions saw an update since the last update of 'www'
+    # this is not necessarily identical to what was saved above
+    updated_dists.extend(
+        d for d in reprepro_ds.diff(
+            dist_subdatasets,
+            fr=ref,
+            result_xfm='datasets',
+            result_renderer='disabled',
+            return_type='generator')
+        if d.path in dist_subdatasets
+    )
+
+
+def _get_dists_root(ds, constraint):
+    """Return the path underneath which relevant distributions are located"""
+    dists = ds.pathobj / 'distributions'
+    if constraint is None or constraint in (dists, ds.pathobj):
+        return dists
+    # the distribution dataset containing or matching the constraint
+    return dists / constraint.relative_to(dists).parts[0]
+
+
+def _get_dist_paths(ds, constraint):
+    """Report the paths of all distribution datasets matching a constraint
+
+    Returns
+    -------
+    list(str)
+    """
+    dists = ds.pathobj / 'distributions'
+    return [
+        r['path'] for r in ds.subdatasets(
+            _get_dists_root(ds, constraint),
+            result_renderer="disabled",
+            return_type='generator',
+            on_failure='ignore',
+        )
+        if r.get('status') == 'ok' and r.get('type') == 'dataset'
+        and Path(r['path']).parent == dists
+    ]
+
+
+def _watch_distributions(ds, constraint, jobs, interval, debounce,
+                         move_content, debdeltas):
+    """Monitor distribution siblings, and update on changes
+
+    Runs until interrupted.
+    """
+    siblings = {
+        p: _get_tracking_sibling(Dataset(p))
+        for p in _get_dist_paths(ds, constraint)
+    }
+    states = {p: _get_sibling_state(Dataset(p), remote, ref)
+              for p, (remote, ref, _) in siblings.items()}
+    last_poll = {p: time.monotonic() for p in siblings}
+    pending = ChangeDebouncer(debounce)
+    lgr.info('Watching %i distribution(s) for changes', len(siblings))
+    try:
+        while True:
+            yield from _watch_step(
+                ds, siblings, states, last_poll, pending, interval, jobs,
+                move_content, debdeltas)
+            time.sleep(1)
+    except KeyboardInterrupt:
+        lgr.info('Stopped watching distributions')
+
+
+def _watch_step(ds, siblings, states, last_poll, pending, interval, jobs,
+                move_content, debdeltas):
+    """Poll distribution siblings once, and update from changed ones
+
+    Siblings that are local paths are polled every time, others once per
+    `interval`. `states`, `last_poll`, and `pending` are updated in place.
+    """
+    now = time.monotonic()
+    for p, (remote, ref, is_local) in siblings.items():
+        if not is_local and now - last_poll[p] < interval:
+            continue
+        last_poll[p] = now
+        state = _get_sibling_state(Dataset(p), remote, ref)
+        if state != states[p]:
+            lgr.debug('Change detected for %s', p)
+            states[p] = state
+            pending.changed(p, now)
+    for p in pending.due(time.monotonic()):
+        lgr.info('Updating from changed distribution %s', p)
+        yield from _update_archive(
+            ds, Path(p), jobs, move_content, debdeltas)
+
+
+def _get_tracking_sibling(ds):
+    """Report the sibling and branch a distribution dataset is updated from
+
+    Returns
+    -------
+    (str, str, bool)
+      Sibling name, branch (or 'HEAD'), and whether the sibling is
+      a local path.
+    """
+    remote, branch = ds.repo.get_tracking_branch()
+    remote = remote or 'origin'
+    url = ds.config.get(f'remote.{remote}.url', '')
+    return (
+        remote,
+        branch or 'HEAD',
+        # URLs and SSH targets do not exist locally
+        Path(url).is_dir() if url else False,
+    )
 
 
-def _get_updates_from_dist(ds, dist_ds, ref):
+def _get_sibling_state(ds, remote, ref):
+    """Return an identifier for the state of a branch of a sibling"""
+    try:
+        return ds.repo.call_git(['ls-remote', remote, ref])
+    except CommandError as e:
+        # could be a temporary network issue, the next
+        # poll will tell
+        lgr.debug('Cannot query %s of %s: %s', ref, ds, CapturedException(e))
+        return None
+
+
+def _update_dist(dist_ds):
+    return dist_ds.update(
+        # 'reset' means we intentionally discard any local change
+        how='reset',
+        follow='parentds-lazy',
+        # we cannot limit recursion without risking a dataset hierarchy
+        # that is not in-sync
+        recursive=True,
+        result_renderer="disabled",
+        return_type='generator',
+        # we leave the flow-control to the caller
+        on_failure='ignore',
+    )
+
+
+def _get_updates_from_dist(ds, dist_ds, ref, jobs, move_content=False,
+                           shards=None):
+    """Import updates from a distribution dataset
+
+    If `shards` is given, imports go into
+    the reprepro instance of the distribution's codename.
+    """
     lgr.debug('Updating from %s', dist_ds.pathobj.relative_to(ds.pathobj))
-    updated_pkg_datasets = [
+    updated_pkg_datasets = (
         # we must use `ds` again to keep the validity of `ref`
         pkg_ds for pkg_ds in ds.diff(
             fr=ref,
@@ -132,36 +945,80 @@ def _get_updates_from_dist(ds, dist_ds, ref):
             recursion_limit=1,
             result_xfm='datasets',
             result_renderer='disabled',
+            return_type='generator',
         )
         # we are not interested in the distribution dataset here
         if pkg_ds != dist_ds
-    ]
-    # TODO could be done in parallel
-    for up in updated_pkg_datasets:
-        yield from _get_updates_from_pkg(
-            ds,
-            # only use the part in front of the first '-'
-            # as the target distribution label.
-            # the full name could be different, when multiple
-            # distribution packages (maybe with different builders)
-            # are all targeting the same distribution in the archive
-            dist_ds.pathobj.name.split('-', maxsplit=1)[0],
-            up,
-            ref,
+    )
+    dist_codename = get_dist_codename(dist_ds)
+    # TODO option to drop packages that were not present locally before?
+    # package datasets are installed here, a batch at a time, installing
+    # them from concurrent planners would modify the distribution dataset
+    # concurrently. Only a batch is kept in memory, not all updated
+    # package datasets of the distribution
+    for batch in iter(
+            lambda: list(islice(updated_pkg_datasets, pkg_batch_size)), []):
+        yield from ds.get(
+            [pkg_ds.path for pkg_ds in batch],
+            get_data=False,
+            jobs=jobs,
+            **ckwa
         )
+        yield from _import_pkg_updates(
+            ds, batch, dist_codename, ref, jobs, move_content, shards)
 
 
-def _get_updates_from_pkg(ds, dist_codename, pkg_ds, ref):
-    # TODO option to drop packages that were not present locally before?
-    # make sure the package dataset is present locally
-    lgr.debug('Updating from %s', pkg_ds.pathobj.relative_to(ds.pathobj))
-    ds.get(
-        path=pkg_ds.pathobj,
-        get_data=False,
-        result_renderer='disabled',
-        return_type='item-or-list',
+def _import_pkg_updates(ds, pkg_datasets, dist_codename, ref, jobs,
+                        move_content, shards):
+    """Plan and import the updates of installed package datasets"""
+    # planning the imports of individual packages only involves git,
+    # git-annex, and network transfers, hence it runs concurrently, and
+    # does not modify any dataset other than the package dataset.
+    # The imports themselves are done here, one at a time, as soon as
+    # the plan for a package is ready. The number of packages that are
+    # planned ahead of the imports is bounded, to keep the memory demand
+    # of the plans independent of the number of updated packages
+    pkg_feed = BoundedFeed(
+        pkg_datasets,
+        2 * max(1, ProducerConsumer.get_effective_jobs(jobs) or 1),
     )
-    updated_files = [
+    try:
+        for plan in ProducerConsumer(
+                pkg_feed,
+                partial(_plan_pkg_updates, ds, ref=ref, feed=pkg_feed),
+                jobs=jobs):
+            updated_files, rejected = plan
+            yield from rejected
+            yield from _include_pkg_updates(
+                ds, dist_codename, updated_files, move_content, shards)
+            pkg_feed.task_done()
+    finally:
+        pkg_feed.close()
+
+
+def _plan_pkg_updates(ds, pkg_ds, ref, feed):
+    try:
+        return _get_pkg_updates(ds, pkg_ds, ref)
+    except Exception:
+        # there will be no plan for the caller to process, free the slot
+        # in the feed right away
+        feed.task_done()
+        raise
+
+
+def _get_updated_files(ds, pkg_ds, ref):
+    """Report all files of a package dataset that changed since `ref`
+
+    The package dataset must be installed. Nothing is modified, hence this
+    can run concurrently for the package datasets of a distribution.
+
+    Returns
+    -------
+    list(Path)
+    """
+    # the package dataset is installed by the caller
+    lgr.debug('Updating from %s', pkg_ds.pathobj.relative_to(ds.pathobj))
+    return [
         # we must use `ds` again to keep the validity of `ref`
         Path(r['path']) for r in ds.diff(
             fr=ref,
@@ -169,30 +1026,548 @@ def _get_updates_from_pkg(ds, dist_codename, pkg_ds, ref):
             recursive=True,
             recursion_limit=2,
             result_renderer='disabled',
+            return_type='generator',
         )
+        if r.get('state') in ('added', 'modified')
+        and r.get('type') in ('file', 'symlink')
+    ]
+
+
+def _get_pkg_updates(ds, pkg_ds, ref):
+    """Determine the files of a package dataset that need to be imported
+
+    Any file content needed for the import is obtained too, and the
+    files referenced by .changes and .dsc files are verified against their
+    declared checksums. Uploads with any broken file are not imported.
+
+    Returns
+    -------
+    tuple
+      List of files to import, and a list of result records for rejected
+      uploads.
+    """
+    updated_files = [
+        f for f in _get_updated_files(ds, pkg_ds, ref)
         # we can handle three types of files
         # - changes files from builds of any kind
         # - dsc of source packages
         # - lonely debs
-        if r.get('state') in ('added', 'modified')
-        and Path(r['path']).suffix in ('.changes', '.dsc', '.deb')
+        if f.suffix in ('.changes', '.dsc', '.deb')
+    ]
+    if updated_files:
+        # .changes and .dsc files are parsed to determine what else to import,
+        # everything else is needed for the import itself
+        ds.get(
+            path=updated_files,
+            get_data=True,
+            result_renderer='disabled',
+            return_type='list',
+            on_failure='ignore',
+        )
+    rejected = _verify_uploads(ds, updated_files)
+    return updated_files, rejected
+
+
+def _verify_uploads(ds, updated_files):
+    """Verify all files referenced by .changes and .dsc files
+
+    Rejected uploads (the .changes or .dsc file, and any file it references)
+    are removed from `updated_files`. An upload is rejected, if its .changes
+    or .dsc file cannot be read or parsed (e.g., because its content could
+    not be obtained), or if any file it references is missing or does not
+    match its declared checksum. Verified file content is recorded by
+    annex key, and is not verified again.
+
+    Returns
+    -------
+    list(dict)
+      Result records for rejected uploads.
+    """
+    uploads = {}
+    problems = {}
+    for f in updated_files:
+        if f.suffix not in ('.changes', '.dsc'):
+            continue
+        # the content was obtained by the caller, but failures to do so
+        # are only noticed here
+        try:
+            desc = (Changes if f.suffix == '.changes' else Dsc)(f.read_text())
+            uploads[f] = [
+                (f.parent / c['name'],
+                 dict(size=int(c['size']), sha256=c['sha256']))
+                for c in desc.get('Checksums-Sha256') or []
+            ]
+        except (OSError, KeyError, ValueError) as e:
+            uploads[f] = []
+            problems[f] = f'cannot be read: {e!r}'
+    if not uploads:
+        return []
+    specs = dict(spec for specs in uploads.values() for spec in specs)
+    if specs:
+        # referenced files need not be new, but their content is needed
+        ds.get(
+            path=list(specs),
+            get_data=True,
+            result_renderer='disabled',
+            return_type='list',
+            on_failure='ignore',
+        )
+    db_path = get_index_db_path(ds)
+    keys = {p: get_annex_key(p) for p in specs}
+    verified = get_verified_keys(
+        db_path,
+        ((k, specs[p]['sha256']) for p, k in keys.items() if k))
+    to_checksum = []
+    for p, props in specs.items():
+        # the content is needed for the import, even if it is known to
+        # be valid
+        if not p.exists():
+            problems[p] = 'missing'
+            continue
+        if (keys[p], props['sha256']) in verified \
+                or matches_annex_key(p, props):
+            continue
+        to_checksum.append((p, props))
+    newly_verified = []
+    with ThreadPoolExecutor(
+            max_workers=min(len(to_checksum), os.cpu_count() or 1) or 1) \
+            as executor:
+        for (p, props), problem in zip(
+                to_checksum, executor.map(verify_file, to_checksum)):
+            if problem:
+                problems[p] = problem[0] % problem[1:]
+            elif keys[p]:
+                newly_verified.append((keys[p], props['sha256']))
+    add_verified_keys(db_path, newly_verified)
+
+    rejected = []
+    for upload, upload_specs in uploads.items():
+        broken = [(p, problems[p])
+                  for p in [upload] + [p for p, _ in upload_specs]
+                  if p in problems]
+        if not broken:
+            continue
+        for f in [upload] + [p for p, _ in upload_specs]:
+            if f in updated_files:
+                updated_files.remove(f)
+        rejected.append(get_status_dict(
+            status='error',
+            ds=ds,
+            action='update_repository.verify',
+            path=str(upload),
+            type='file',
+            message=(
+                'Not importing %s, broken file(s): %s',
+                upload.name,
+                '; '.join(f'{p.name} ({msg})' for p, msg in broken)),
+        ))
+    return rejected
+
+
+def _estimate_dist_updates(ds, dist_ds, ref, jobs, estimate):
+    """Estimate the import effort for the updates of a distribution dataset
+
+    The distribution dataset is only fetched from. The package datasets
+    its tracking branch declares are compared to those declared by the
+    state that was recorded in `ds` at `ref`, and the import effort of
+    any changed package dataset is added to the `estimate` dict.
+    """
+    yield from dist_ds.update(how=None, **ckwa)
+    repo = dist_ds.repo
+    try:
+        new = repo.call_git_oneline(
+            ['rev-parse', '--verify', '-q', '@{upstream}'], read_only=True)
+    except CommandError:
+        # nothing to update from, the estimate is for the local state
+        new = repo.get_hexsha()
+    old = _get_recorded_commit(
+        ds.repo, ref, dist_ds.pathobj.relative_to(ds.pathobj))
+    if old and not _has_commit(repo, old):
+        old = None
+    old_pkgs = _get_pkg_commits(repo, old)
+    updated_pkgs = [
+        (Dataset(dist_ds.pathobj / p), old_pkgs.get(p), commit)
+        for p, commit in _get_pkg_commits(repo, new).items()
+        if old_pkgs.get(p) != commit
     ]
+    # package datasets are independent of each other, and fetching from
+    # them is dominated by network transfers
+    for counts in ProducerConsumer(
+            updated_pkgs, _estimate_pkg_updates, jobs=jobs):
+        _add_counts(estimate, counts)
+
+
+def _get_recorded_commit(repo, ref, path):
+    """Report the commit of a subdataset recorded at `ref`, if any"""
+    if not ref:
+        return None
+    try:
+        return repo.call_git_oneline(
+            ['rev-parse', '--verify', '-q', f'{ref}:{path.as_posix()}'],
+            read_only=True)
+    except CommandError:
+        return None
+
+
+def _has_commit(repo, commit):
+    return repo.call_git_success(
+        ['cat-file', '-e', f'{commit}^{{commit}}'], read_only=True)
+
+
+def _get_pkg_commits(repo, commit):
+    """Report the package datasets declared by a distribution commit
+
+    Returns
+    -------
+    dict
+      Mapping of the path of a package dataset (relative to the
+      distribution dataset) to its commit.
+    """
+    if not commit:
+        return {}
+    pkgs = {}
+    for line in repo.call_git_items_(
+            ['ls-tree', '-z', commit, '--', 'packages/'],
+            read_only=True, sep='\0'):
+        props, path = line.split('\t', maxsplit=1)
+        _, otype, sha = props.split()
+        if otype == 'commit':
+            pkgs[path] = sha
+    return pkgs
+
+
+def _estimate_pkg_updates(pkg_update):
+    """Estimate the import effort for a package dataset
+
+    Only the files that would be imported are considered: .changes, .dsc,
+    and .deb files, and the files referenced by the .changes and .dsc
+    files, as far as they changed. No file content is obtained.
+
+    Returns
+    -------
+    dict
+      Number of imports by type, total size of the files to import, and
+      the size of those whose content is not yet available locally.
+      Package datasets that are not installed, or whose new state cannot
+      be fetched, are counted as `packages_not_estimated`.
+    """
+    pkg_ds, old, new = pkg_update
+    if not pkg_ds.is_installed():
+        return dict(packages_not_estimated=1)
+    repo = pkg_ds.repo
+    if not _has_commit(repo, new):
+        # only fetch, the checkout is not modified
+        pkg_ds.update(
+            how=None,
+            result_renderer='disabled',
+            return_type='list',
+            on_failure='ignore',
+        )
+        if not _has_commit(repo, new):
+            return dict(packages_not_estimated=1)
+    changed = [
+        p for p in map(PurePosixPath, repo.call_git_items_(
+            ['diff-tree', '-r', '-z', '--no-renames', '--name-only',
+             '--diff-filter=AM', old or empty_tree_hexsha, new],
+            read_only=True, sep='\0'))
+        # the builder is not part of the import
+        if p.parts[0] != 'builder'
+    ]
+    if not changed:
+        return {}
+    annexinfo = repo.get_content_annexinfo(
+        init={repo.pathobj / p: {} for p in changed},
+        ref=new,
+        eval_availability=True,
+    )
+    referenced = set()
+    covered = set()
+    for f in changed:
+        if f.suffix not in ('.changes', '.dsc'):
+            continue
+        props = annexinfo[repo.pathobj / f]
+        if 'key' not in props:
+            text = repo.call_git(
+                ['cat-file', 'blob', f'{new}:{f}'], read_only=True)
+        elif props.get('has_content'):
+            text = Path(props['objloc']).read_text()
+        else:
+            # without the content, assume that the upload consists of all
+            # changed files of the same source package, and that a changes
+            # file covers all binary packages of the same version
+            source, *version = f.stem.split('_')
+            referenced.update(
+                c for c in changed
+                if c.parent == f.parent and c.name.startswith(f'{source}_'))
+            if f.suffix == '.changes':
+                covered.update(
+                    d for d in changed
+                    if d.suffix == '.deb'
+                    and d.name.split('_')[1:2] == version[:1])
+            continue
+        files = [
+            f.parent / c['name']
+            for c in (Changes if f.suffix == '.changes' else Dsc)(
+                text).get('Files') or []
+        ]
+        referenced.update(files)
+        if f.suffix == '.changes':
+            covered.update(files)
+    to_import = [
+        f for f in changed
+        if f in referenced or f.suffix in ('.changes', '.dsc', '.deb')
+    ]
+    estimate = _count_imports(to_import, covered)
+    estimate.update(bytesize=0, bytes_to_transfer=0)
+    git_sizes = _get_blob_sizes(
+        repo, new, [f for f in to_import
+                    if 'key' not in annexinfo[repo.pathobj / f]])
+    for f in to_import:
+        props = annexinfo[repo.pathobj / f]
+        if 'key' not in props:
+            estimate['bytesize'] += git_sizes.get(f, 0)
+            continue
+        size = int(props.get('bytesize') or 0)
+        estimate['bytesize'] += size
+        if not props.get('has_content'):
+            estimate['bytes_to_transfer'] += size
+    return estimate
+
+
+def _get_blob_sizes(repo, commit, paths):
+    """Report the size of files in Git at `commit`"""
+    if not paths:
+        return {}
+    sizes = {}
+    for line in repo.call_git_items_(
+            ['ls-tree', '-z', '-l', commit],
+            files=[str(p) for p in paths],
+            read_only=True, sep='\0'):
+        props, path = line.split('\t', maxsplit=1)
+        _, otype, _, size = props.split()
+        if otype == 'blob':
+            sizes[PurePosixPath(path)] = int(size)
+    return sizes
+
+
+def _count_imports(updated_files, covered):
+    """Count the reprepro imports necessary for a set of package files
+
+    `covered` are the files that are imported with a .changes file.
+    """
+    return {
+        'includechanges': len(
+            [f for f in updated_files if f.suffix == '.changes']),
+        'includedsc': len([f for f in updated_files
+                           if f.suffix == '.dsc' and f not in covered]),
+        'includedeb': len([f for f in updated_files
+                           if f.suffix == '.deb' and f not in covered]),
+    }
+
+
+def _add_counts(total, counts):
+    for k, v in counts.items():
+        total[k] = total.get(k, 0) + v
+
+
+def _get_estimate_result(estimate, durations, **kwargs):
+    imports = {k: estimate.get(k, 0) for k in import_types}
+    nimports = sum(imports.values())
+    known = list(durations.values())
+    duration = None
+    if known:
+        # for import types without a history, assume an average
+        fallback = sum(known) / len(known)
+        duration = sum(
+            n * durations.get(k, fallback) for k, n in imports.items())
+    not_estimated = estimate.get('packages_not_estimated', 0)
+    return get_status_dict(
+        status='ok',
+        action='update_repository.estimate',
+        message=(
+            '%i import(s), %s bytes (%s bytes to transfer), '
+            'estimated import duration: %s%s',
+            nimports,
+            estimate.get('bytesize', 0),
+            estimate.get('bytes_to_transfer', 0),
+            'unknown (no previous imports)' if duration is None
+            else f'{duration:.0f}s',
+            f', {not_estimated} updated package dataset(s) not estimated '
+            '(not installed)' if not_estimated else ''),
+        imports=nimports,
+        bytesize=estimate.get('bytesize', 0),
+        bytes_to_transfer=estimate.get('bytes_to_transfer', 0),
+        duration=duration,
+        packages_not_estimated=not_estimated,
+        **imports,
+        **kwargs
+    )
+
+
+def _get_import_durations(ds):
+    """Report the average duration of past imports, by import type
+
+    Returns
+    -------
+    dict
+      Keys are import types, values are durations in seconds. Import types
+      without a history are not reported.
+    """
+    durations = {}
+    for t in import_types:
+        d = ds.config.get(f'datalad.debian.import-duration.{t}')
+        if d is not None:
+            durations[t] = float(d)
+    return durations
+
+
+def _record_import_duration(ds, import_type, duration):
+    """Update the running average of the import duration of a type"""
+    var = f'datalad.debian.import-duration.{import_type}'
+    prev = ds.config.get(var)
+    if prev is not None:
+        duration = duration_avg_weight * duration \
+            + (1 - duration_avg_weight) * float(prev)
+    ds.config.set(var, f'{duration:.3f}', scope='local')
+
+
+def _include_pkg_updates(ds, dist_codename, updated_files,
+                         move_content=False, shards=None):
     if not updated_files:
         return
+    # the includes below consume the list
+    imported_files = list(updated_files)
+    yield from _include_pkg_files(ds, dist_codename, updated_files, shards)
+    if move_content:
+        # the content is now in the archive's pool
+        yield from ds.drop(
+            imported_files,
+            what='filecontent',
+            **ckwa
+        )
+
+
+def _include_pkg_files(ds, dist_codename, updated_files, shards):
     # TODO option to give a single commit across all updates?
     # it won't have the prov-records from run, but it may be needed
     # for bring the amount of commits down to a sane level for
     # huge archives
-    yield from _include_changes(ds, dist_codename, updated_files)
+    yield from _include_changes(ds, dist_codename, updated_files, shards)
     if not updated_files:
         return
-    yield from _include_dsc(ds, dist_codename, updated_files)
+    yield from _include_dsc(ds, dist_codename, updated_files, shards)
     if not updated_files:
         return
-    yield from _include_deb(ds, dist_codename, updated_files)
+    yield from _include_deb(ds, dist_codename, updated_files, shards)
+
+
+def _run_import(ds, import_type, args, source_files, shards):
+    """Run a reprepro import, and record it
+
+    Returns
+    -------
+    bool
+      Whether the import succeeded.
+    """
+    inputs = [str(p) for p in source_files]
+    start = time.monotonic()
+    if shards is None:
+        yield from ds.run(
+            ' '.join(['reprepro'] + args),
+            inputs=inputs,
+            **import_kwargs
+        )
+        yield from _register_pool_files(ds, source_files)
+        _record_import_duration(ds, import_type, time.monotonic() - start)
+        return True
+
+    # the codename is always the last argument before the imported file
+    codename = args[-2]
+    cmd = ['reprepro', '-b', f'shards/{codename}'] + args
+    # concurrent imports from other codenames must not touch the same pool
+    # files, and all version control operations must happen one at a time
+    with shards.pool_files(p.name for p in source_files):
+        # unlike run(), the command execution below does not obtain inputs
+        yield from ds.get(inputs, **ckwa)
+        try:
+            Runner(cwd=ds.path).run(cmd, protocol=StdOutErrCapture)
+        except CommandError as e:
+            yield get_status_dict(
+                status='error',
+                ds=ds,
+                action=f'update_repository.{import_type}',
+                message=('Import failed: %s', ' '.join(cmd)),
+                exception=CapturedException(e),
+            )
+            return False
+        with shards.vcs_lock:
+            yield from run_command(
+                ' '.join(cmd),
+                dataset=ds,
+                inputs=inputs,
+                outputs=[f'shards/{codename}/db', f'www/dists/{codename}'],
+                explicit=True,
+                # the command was executed above already
+                inject=True,
+            )
+            yield from _register_pool_files(
+                ds, source_files, only_sources=True)
+            _record_import_duration(
+                ds, import_type, time.monotonic() - start)
+    return True
+
+
+def _register_pool_files(ds, source_files, only_sources=False):
+    """Save the pool of the archive, reusing the annex keys of source files
+
+    reprepro copies the files of an import into the pool. Instead of
+    having git-annex compute the checksum of such a copy again, it is
+    registered under the annex key of its source file, if the size of the
+    copy matches the key. Any other pool modification is saved normally,
+    unless `only_sources` is set, in which case only new pool files
+    matching a source file are saved. The outcome is amended to the commit
+    of the import.
+    """
+    www_ds = Dataset(ds.pathobj / 'www')
+    known_keys = {f.name: get_annex_key(f) for f in source_files}
+    new_files = []
+    for relpath in www_ds.repo.call_git_items_(
+            ['ls-files', '--others', '--exclude-standard', '--', 'pool'],
+            read_only=True):
+        name = PurePosixPath(relpath).name
+        if name not in known_keys:
+            continue
+        new_files.append(www_ds.pathobj / relpath)
+        key = known_keys[name]
+        props = parse_annex_key(key) if key else None
+        if not props or props['size'] is None \
+                or props['size'] != (www_ds.pathobj / relpath).stat().st_size:
+            continue
+        # moves the file into the annex as the content of the key,
+        # and puts a link to it in its place
+        www_ds.repo.call_annex(['setkey', key, relpath])
+        www_ds.repo.call_annex(['fromkey', key, relpath])
+        lgr.debug('Registered %s under known key %s', relpath, key)
+    if only_sources and not new_files:
+        return
+    yield from www_ds.save(
+        path=new_files if only_sources else 'pool',
+        message='Update pool files',
+        **ckwa
+    )
+    # other imports may be in progress, and other modifications must not
+    # end up in the commit of the import, only record the new state of
+    # the archive dataset
+    if only_sources or not ds.repo.call_git_success(
+            ['diff', '--quiet', 'HEAD', '--', 'www'], read_only=True):
+        yield from ds.save(
+            path='www',
+            amend=True,
+            **ckwa
+        )
 
 
-def _include_changes(ds, dist_codename, updated_files):
+def _include_changes(ds, dist_codename, updated_files, shards):
     for changes in (c for c in updated_files if c.suffix == '.changes'):
         lgr.debug('Import CHANGES from %s', changes.relative_to(ds.pathobj))
         ds.get(
@@ -214,7 +1589,9 @@ def _include_changes(ds, dist_codename, updated_files):
             except ValueError:
                 # file not present, nothing to worry about
                 pass
-        yield from ds.run(
+        success = yield from _run_import(
+            ds,
+            'includechanges',
             # TODO should be forcibly take `dist_codename`, or forcibly
             # take changes['Distribution']?
             # The latter is sensible, but requires the package to be built
@@ -224,10 +1601,13 @@ def _include_changes(ds, dist_codename, updated_files):
             # package)
             # right now go with the more flexible "force dist_codename"
             # and guard against a mismatch
-            f'reprepro --ignore=wrongdistribution include {dist_codename} {changes}',
-            inputs=[str(p) for p in changes_files],
-            result_renderer='disabled',
+            ['--ignore=wrongdistribution', 'include', dist_codename,
+             str(changes)],
+            changes_files,
+            shards,
         )
+        if not success:
+            continue
         yield get_status_dict(
             status='ok',
             ds=ds,
@@ -236,7 +1616,7 @@ def _include_changes(ds, dist_codename, updated_files):
         )
 
 
-def _include_dsc(ds, dist_codename, updated_files):
+def _include_dsc(ds, dist_codename, updated_files, shards):
     for dsc in (c for c in updated_files if c.suffix == '.dsc'):
         lgr.debug('Import DSC from %s', dsc.relative_to(ds.pathobj))
         ds.get(
@@ -259,11 +1639,15 @@ def _include_dsc(ds, dist_codename, updated_files):
                 # file not present, nothing to worry about
                 pass
         # TODO add commit message
-        yield from ds.run(
-            f'reprepro includedsc {dist_codename} {dsc}',
-            inputs=[str(p) for p in dsc_files],
-            result_renderer='disabled',
+        success = yield from _run_import(
+            ds,
+            'includedsc',
+            ['includedsc', dist_codename, str(dsc)],
+            dsc_files,
+            shards,
         )
+        if not success:
+            continue
         yield get_status_dict(
             status='ok',
             ds=ds,
@@ -272,15 +1656,19 @@ def _include_dsc(ds, dist_codename, updated_files):
         )
 
 
-def _include_deb(ds, dist_codename, updated_files):
+def _include_deb(ds, dist_codename, updated_files, shards):
     for deb in (c for c in updated_files if c.suffix == '.deb'):
         lgr.debug('Import DEB from %s', deb.relative_to(ds.pathobj))
         # TODO add commit message
-        yield from ds.run(
-            f'reprepro includedeb {dist_codename} {deb}',
-            inputs=[str(deb)],
-            result_renderer='disabled',
+        success = yield from _run_import(
+            ds,
+            'includedeb',
+            ['includedeb', dist_codename, str(deb)],
+            [deb],
+            shards,
         )
+        if not success:
+            continue
         yield get_status_dict(
             status='ok',
             ds=ds,
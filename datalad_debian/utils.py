@@ -1,3 +1,20 @@
+import hashlib
+import mmap
+import os
+import sys
+from contextlib import contextmanager
+from functools import lru_cache
+from threading import (
+    BoundedSemaphore,
+    Condition,
+    Lock,
+)
+
+from datalad.interface.results import get_status_dict
+from datalad.runner import (
+    Runner,
+    StdOutCapture,
+)
 
 
 def result_matches(res, **kwargs) -> bool:
@@ -38,4 +55,304 @@ def result_matches(res, **kwargs) -> bool:
     return True
 
 
+def get_dist_codename(dist_ds):
+    """Report the codename a distribution dataset targets in an archive"""
+    # only use the part in front of the first '-'
+    # as the target distribution label.
+    # the full name could be different, when multiple
+    # distribution packages (maybe with different builders)
+    # are all targeting the same distribution in the archive
+    return dist_ds.pathobj.name.split('-', maxsplit=1)[0]
+
+
+class BoundedFeed:
+    """Iterable to feed items into a (parallel) processing pipeline
+
+    At most `size` items are handed out that have not been reported
+    as processed via `task_done()`. Iteration blocks until a slot is
+    available, hence a fast producer cannot run ahead of a slow consumer
+    by more than `size` items, and memory demand stays constant.
+
+    Parameters
+    ----------
+    items: iterable
+      Items to feed.
+    size: int
+      Maximum number of items in flight.
+    """
+    def __init__(self, items, size):
+        self._items = items
+        self._slots = BoundedSemaphore(size)
+        self._closed = False
+
+    def __iter__(self):
+        for item in self._items:
+            # wait for a free slot, but do not block forever when
+            # the consumer side has given up already
+            while not self._slots.acquire(timeout=1):
+                if self._closed:
+                    return
+            if self._closed:
+                return
+            yield item
+
+    def task_done(self):
+        """Report an item as processed, and free its slot"""
+        self._slots.release()
+
+    def close(self):
+        """Stop feeding items"""
+        self._closed = True
+
+
+class ChangeDebouncer:
+    """Coalesce bursts of change notifications
+
+    Parameters
+    ----------
+    delay: float
+      Time (in seconds) without further changes, before a change is
+      reported as due.
+    """
+    def __init__(self, delay):
+        self.delay = delay
+        self._pending = {}
+
+    def changed(self, key, now):
+        """Register a change of `key` at time `now`"""
+        self._pending[key] = now
+
+    def due(self, now):
+        """Report all changes that were quiet for long enough at time `now`
+
+        Reported keys are no longer pending.
+
+        Returns
+        -------
+        list
+        """
+        due = [k for k, t in self._pending.items() if now - t >= self.delay]
+        for k in due:
+            del self._pending[k]
+        return due
+
+
+class ShardedImports:
+    """Coordinate concurrent imports into a shared package pool
+
+    `vcs_lock` must be held for any version control operation on the
+    archive. `pool_files()` claims a set of pool file names for the duration
+    of an import, waiting until no other import has claimed any of them.
+    """
+    def __init__(self):
+        self.vcs_lock = Lock()
+        self._claimed = set()
+        self._cond = Condition()
+
+    @contextmanager
+    def pool_files(self, names):
+        names = set(names)
+        with self._cond:
+            self._cond.wait_for(lambda: self._claimed.isdisjoint(names))
+            self._claimed.update(names)
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._claimed.difference_update(names)
+                self._cond.notify_all()
+
+
+def get_peak_memory():
+    """Report the high-water mark of the memory use of this process
+
+    Returns
+    -------
+    int or None
+      Peak resident set size in bytes, or None if this information
+      is not available on this platform.
+    """
+    try:
+        import resource
+    except ImportError:
+        # not on POSIX
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # reported in kilobytes on Linux, but in bytes on macOS
+    return maxrss if sys.platform == 'darwin' else maxrss * 1024
+
+
+# hashlib checksum algorithms, strongest first
+checksum_preference = ('sha512', 'sha256', 'sha1', 'md5')
+
+# checksum algorithm names (as used by hashlib) of git-annex key backends
+annex_backend_algorithms = {
+    'MD5': 'md5',
+    'SHA1': 'sha1',
+    'SHA256': 'sha256',
+    'SHA512': 'sha512',
+}
+
+
+def parse_annex_key(key):
+    """Split a git-annex key into its components
+
+    Parameters
+    ----------
+    key: str
+      git-annex key, e.g. 'SHA256E-s1234--abcdef.deb'
 
+    Returns
+    -------
+    dict or None
+      With 'backend', 'size' (int or None), and 'hash' (the key name, without
+      a file name extension for backends that add one), and 'algorithm' (name
+      of the corresponding hashlib checksum, or None for non-checksum
+      backends). None is returned for strings that are not a key.
+    """
+    fields, sep, name = key.partition('--')
+    if not sep or not fields:
+        return None
+    fields = fields.split('-')
+    backend = fields[0]
+    size = None
+    for f in fields[1:]:
+        if f.startswith('s') and f[1:].isdigit():
+            size = int(f[1:])
+    if backend.endswith('E'):
+        name = name.split('.', maxsplit=1)[0]
+        backend_base = backend[:-1]
+    else:
+        backend_base = backend
+    return dict(
+        backend=backend,
+        size=size,
+        hash=name,
+        algorithm=annex_backend_algorithms.get(backend_base),
+    )
+
+
+def get_annex_key(path):
+    """Determine the git-annex key of an annexed file from its worktree item
+
+    No git-annex process is involved. Both locked (symlinks) and unlocked
+    (pointer files) annexed files are supported.
+
+    Parameters
+    ----------
+    path: Path
+
+    Returns
+    -------
+    str or None
+      The key, or None if `path` does not look like an annexed file.
+    """
+    if path.is_symlink():
+        target = os.readlink(path)
+    else:
+        try:
+            # an unlocked file without content is a small pointer file,
+            # if it has content, it is not identifiable without git-annex
+            if path.stat().st_size > 1024:
+                return None
+            target = path.read_text().strip()
+        except (OSError, UnicodeDecodeError):
+            return None
+    target = target.replace('\\', '/')
+    if '/annex/objects/' not in f'/{target}':
+        return None
+    return target.rsplit('/', maxsplit=1)[-1]
+
+
+def matches_annex_key(path, props):
+    """Whether a file's annex key is based on a declared checksum
+
+    Parameters
+    ----------
+    path: Path
+    props: dict
+      Declared 'size', and checksums keyed by hashlib algorithm name.
+    """
+    key = get_annex_key(path)
+    if not key:
+        return False
+    key = parse_annex_key(key)
+    if not key or not key['algorithm'] or key['algorithm'] not in props:
+        return False
+    return key['hash'] == props[key['algorithm']] \
+        and key['size'] in (None, props['size'])
+
+
+def verify_file(spec):
+    """Checksum a file and compare with its declared properties
+
+    Parameters
+    ----------
+    spec: tuple
+      (Path, dict) with the declared 'size' and checksums (keyed by hashlib
+      algorithm name) of the file. Only the strongest checksum is verified.
+
+    Returns
+    -------
+    None or tuple
+      None if the file matches, or a result message tuple describing the
+      problem.
+    """
+    path, props = spec
+    algorithm = [a for a in checksum_preference if a in props]
+    with path.open('rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size != props['size']:
+            return ('Size mismatch, expected %i, found %i',
+                    props['size'], size)
+        if not algorithm:
+            # nothing else to check
+            return None
+        algorithm = algorithm[0]
+        checksum = hashlib.new(algorithm)
+        if size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                checksum.update(m)
+    if checksum.hexdigest() != props[algorithm]:
+        return ('%s mismatch, expected %s, found %s',
+                algorithm.upper(), props[algorithm], checksum.hexdigest())
+    return None
+
+
+@lru_cache(maxsize=None)
+def get_build_arch():
+    """Report the Debian architecture of the build host
+
+    It is determined once per process.
+    """
+    return Runner().run(
+        ['dpkg-architecture', '-q', 'DEB_BUILD_ARCH'],
+        protocol=StdOutCapture)['stdout'].strip()
+
+
+def get_config_int(ds, name, default, action, minimum=0):
+    """Read an integer setting from the configuration of a dataset
+
+    An invalid value is reported with an 'impossible' result, hence this
+    is to be used with `yield from`.
+
+    Returns
+    -------
+    int or None
+      None, if the configured value is invalid.
+    """
+    value = ds.config.get(name, default)
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        number = None
+    if number is None or number < minimum:
+        yield get_status_dict(
+            status='impossible',
+            ds=ds,
+            action=action,
+            message=('Invalid configuration %s=%r, expected an integer of '
+                     'at least %i', name, value, minimum),
+        )
+        return None
+    return number
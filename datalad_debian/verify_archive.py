@@ -0,0 +1,228 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import (
+    Path,
+    PurePosixPath,
+)
+
+from datalad.distribution.dataset import (
+    EnsureDataset,
+    datasetmethod,
+    require_dataset,
+)
+from datalad.interface.base import (
+    Interface,
+    build_doc,
+)
+from datalad.interface.results import get_status_dict
+from datalad.interface.utils import (
+    eval_results,
+)
+from datalad.support.constraints import (
+    EnsureChoice,
+    EnsureInt,
+    EnsureNone,
+)
+from datalad.support.exceptions import CapturedException
+from datalad.support.param import Parameter
+
+from datalad_debian.archive_index import (
+    get_entry_files,
+    iter_index_entries,
+    iter_index_files,
+)
+from datalad_debian.utils import (
+    matches_annex_key,
+    verify_file,
+)
+
+lgr = logging.getLogger('datalad.debian.verify_archive')
+
+
+@build_doc
+class VerifyArchive(Interface):
+    """Verify the integrity of a Debian archive
+
+    All package indices (Packages and Sources files) in the 'www' subdataset
+    of a Debian archive repository dataset are read, and each pool file
+    referenced in them is verified to exist with the declared size and
+    checksum. Pool files not referenced by any index are reported as
+    orphans.
+
+    Verification of annexed pool files whose git-annex key is based on a
+    checksum that matches the index declaration is skipped -- their integrity
+    is implied by the key (and can be checked with ``git annex fsck``). All
+    other files are checksummed in parallel. Files whose content is not
+    available locally cannot be verified and are reported as such.
+    """
+    _params_ = dict(
+        dataset=Parameter(
+            args=("-d", "--dataset"),
+            doc="""specify the Debian archive repository dataset to
+            verify""",
+            constraints=EnsureDataset() | EnsureNone()),
+        jobs=Parameter(
+            args=("-J", "--jobs"),
+            metavar="NJOBS",
+            doc="""number of files to checksum in parallel. "auto" uses
+            the number of CPU cores""",
+            constraints=EnsureInt() | EnsureChoice('auto') | EnsureNone()),
+    )
+
+    _examples_ = [
+        dict(text="Verify an archive, using eight parallel checksum jobs",
+             code_cmd="datalad deb-verify-archive -J 8",
+             code_py="deb_verify_archive(jobs=8)"),
+    ]
+
+    @staticmethod
+    @datasetmethod(name='deb_verify_archive')
+    @eval_results
+    def __call__(*, dataset=None, jobs='auto'):
+        archive_ds = require_dataset(dataset)
+        www = archive_ds.pathobj / 'www'
+        if jobs in (None, 'auto'):
+            jobs = os.cpu_count() or 1
+        # 0 means no parallel jobs, but there is always one
+        jobs = max(1, jobs)
+
+        res_kwargs = dict(
+            action='verify_archive',
+            type='file',
+            logger=lgr,
+        )
+
+        # collect expectations from all indices. this is the only record
+        # growing with the size of the archive, but it only holds a few
+        # checksums per file
+        expected = {}
+        for index in iter_index_files(www):
+            lgr.debug('Reading %s', index)
+            for entry in iter_index_entries(index):
+                for path, props in get_entry_files(entry).items():
+                    known = expected.setdefault(path, props)
+                    if known is not props and not _consistent(known, props):
+                        yield get_status_dict(
+                            status='error',
+                            path=str(www / path),
+                            message=(
+                                'Conflicting declarations for %s in %s',
+                                path, index),
+                            verification='conflict',
+                            **res_kwargs
+                        )
+
+        counts = dict(verified=0, skipped=0, mismatch=0, missing=0,
+                      unavailable=0, unreadable=0, orphan=0)
+
+        to_checksum = []
+        for path, props in expected.items():
+            fpath = www / path
+            if not fpath.is_symlink() and not fpath.exists():
+                counts['missing'] += 1
+                yield get_status_dict(
+                    status='error',
+                    path=str(fpath),
+                    message='File referenced in index is missing',
+                    verification='missing',
+                    **res_kwargs
+                )
+                continue
+            if matches_annex_key(fpath, props):
+                counts['skipped'] += 1
+                continue
+            if not fpath.exists():
+                # broken symlink, no annexed content
+                counts['unavailable'] += 1
+                yield get_status_dict(
+                    status='impossible',
+                    path=str(fpath),
+                    message='File content not available locally',
+                    verification='unavailable',
+                    **res_kwargs
+                )
+                continue
+            to_checksum.append((fpath, props))
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            # hashing releases the GIL, threads make use of all cores
+            for (fpath, props), (problem, exc) in zip(
+                    to_checksum,
+                    executor.map(_verify_file, to_checksum)):
+                if exc is not None:
+                    counts['unreadable'] += 1
+                    yield get_status_dict(
+                        status='error',
+                        path=str(fpath),
+                        message='Cannot verify file',
+                        verification='unreadable',
+                        exception=exc,
+                        **res_kwargs
+                    )
+                    continue
+                if problem is None:
+                    counts['verified'] += 1
+                    continue
+                counts['mismatch'] += 1
+                yield get_status_dict(
+                    status='error',
+                    path=str(fpath),
+                    message=problem,
+                    verification='mismatch',
+                    **res_kwargs
+                )
+
+        for fpath in _iter_pool_files(www):
+            if PurePosixPath(fpath.relative_to(www)).as_posix() in expected:
+                continue
+            counts['orphan'] += 1
+            yield get_status_dict(
+                status='error',
+                path=str(fpath),
+                message='File is not referenced by any index',
+                verification='orphan',
+                **res_kwargs
+            )
+
+        failed = counts['mismatch'] + counts['missing'] \
+            + counts['unreadable'] + counts['orphan']
+        yield get_status_dict(
+            action='verify_archive',
+            status='error' if failed else 'ok',
+            ds=archive_ds,
+            message=(
+                '%i file(s) verified, %i skipped (verified by annex key), '
+                '%i mismatch(es), %i missing, %i unavailable, '
+                '%i unreadable, %i orphan(s)',
+                counts['verified'], counts['skipped'], counts['mismatch'],
+                counts['missing'], counts['unavailable'], counts['unreadable'],
+                counts['orphan']),
+            **counts
+        )
+
+
+def _verify_file(spec):
+    """Like `verify_file()`, but report any exception instead of raising it
+
+    Returns
+    -------
+    tuple
+      The outcome of `verify_file()`, and a CapturedException or None.
+    """
+    try:
+        return verify_file(spec), None
+    except Exception as e:
+        # e.g. unreadable file, or malformed checksum declaration
+        return None, CapturedException(e)
+
+
+def _consistent(props1, props2):
+    return all(props1[k] == props2[k] for k in props1 if k in props2)
+
+
+def _iter_pool_files(www):
+    for root, dirs, files in os.walk(www / 'pool'):
+        dirs.sort()
+        for f in sorted(files):
+            yield Path(root) / f